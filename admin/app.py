@@ -1,8 +1,11 @@
 import os
 import sys
+import csv
+import io
+import click
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, Response, stream_with_context
 from database import DatabaseManager
 
 app = Flask(__name__)
@@ -52,6 +55,49 @@ def check_candidate_access(candidate_id):
     
     return check_test_access(candidate['test_id'])
 
+def get_page_args(default_sort='created_at', default_limit=50):
+    """Параметры постраничного вывода из строки запроса"""
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        limit = default_limit
+    
+    return {
+        'limit': max(1, min(limit, 500)),
+        'after': request.args.get('after') or None,
+        'sort': request.args.get('sort', default_sort),
+        'order': 'asc' if request.args.get('order') == 'asc' else 'desc',
+        'search': request.args.get('q') or None
+    }
+
+def csv_response(filename, header, rows, chunk_rows=1000):
+    """Потоковая отдача CSV порциями (UTF-8 с BOM, чтобы Excel корректно открыл кириллицу)"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')
+        writer.writerow(header)
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+CODES_EXPORT_HEADER = ['Код', 'Статус', 'Создан', 'Сотрудник', 'Должность', 'Отдел', 'Тест']
+
+def code_export_rows(rows):
+    for code, is_used, created_at, full_name, position, department, title in rows:
+        yield (code, 'Использован' if is_used else 'Активен', created_at,
+               full_name or '', position or '', department or '', title or '')
+
 # === ОСНОВНЫЕ МАРШРУТЫ ===
 
 @app.route('/')
@@ -269,8 +315,9 @@ def edit_test(test_id):
     questions = db.get_questions_for_test(test_id)
     for question in questions:
         question['options'] = db.get_options_for_question(question['question_id'])
+    item_stats = db.get_item_statistics(test_id)
     
-    return render_template('edit_test.html', test=test, questions=questions)
+    return render_template('edit_test.html', test=test, questions=questions, item_stats=item_stats)
 
 @app.route('/tests/<int:test_id>/update', methods=['POST'])
 def update_test(test_id):
@@ -303,6 +350,18 @@ def delete_test(test_id):
     db.delete_test(test_id)
     return jsonify({'success': True, 'message': 'Тест успешно удален'})
 
+@app.route('/tests/<int:test_id>/item-stats/rebuild', methods=['POST'])
+def rebuild_item_stats(test_id):
+    if not check_auth() or not is_hr():
+        return jsonify({'success': False, 'message': 'Доступ запрещен'})
+    
+    access, message = check_test_access(test_id)
+    if not access:
+        return jsonify({'success': False, 'message': message})
+    
+    count = db.rebuild_item_statistics(test_id)
+    return jsonify({'success': True, 'message': f'Статистика пересчитана для вопросов: {count}'})
+
 @app.route('/tests/<int:test_id>/codes')
 def test_codes(test_id):
     if not check_auth() or not is_hr():
@@ -315,9 +374,17 @@ def test_codes(test_id):
         return redirect(url_for('tests'))
     
     test = db.get_test_by_id(test_id)
-    codes = db.get_codes_for_test(test_id)
+    page_args = get_page_args()
+    status = request.args.get('status') or None
+    try:
+        page = db.get_codes_page(test_id=test_id, status=status, **page_args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('test_codes', test_id=test_id))
+    counts = db.get_code_counts(test_id=test_id)
     
-    return render_template('codes.html', test=test, codes=codes)
+    return render_template('codes.html', test=test, codes=page['items'], counts=counts,
+                           next_cursor=page['next_cursor'], page_args=page_args, status=status)
 
 @app.route('/tests/<int:test_id>/generate-codes', methods=['POST'])
 def generate_codes(test_id):
@@ -332,6 +399,20 @@ def generate_codes(test_id):
     codes = db.generate_codes_for_test(test_id, count, get_current_user()['user_id'])
     return jsonify({'success': True, 'codes': codes, 'count': len(codes)})
 
+@app.route('/tests/<int:test_id>/codes/export')
+def export_test_codes(test_id):
+    if not check_auth() or not is_hr():
+        flash('Доступ запрещен', 'error')
+        return redirect(url_for('index'))
+    
+    access, message = check_test_access(test_id)
+    if not access:
+        flash(message, 'error')
+        return redirect(url_for('tests'))
+    
+    return csv_response(f'codes_test_{test_id}.csv', CODES_EXPORT_HEADER,
+                        code_export_rows(db.iter_codes(test_id=test_id)))
+
 # === УПРАВЛЕНИЕ ВОПРОСАМИ ===
 
 @app.route('/tests/<int:test_id>/add_question', methods=['POST'])
@@ -420,44 +501,17 @@ def all_candidates():
         return redirect(url_for('index'))
     
     user = get_current_user()
-    tests = db.get_all_tests(user['user_id'] if user['role'] != 'administrator' else None)
-    
-    all_candidates = []
-    for test in tests:
-        candidates = db.get_candidates_for_test(test['test_id'])
-        for candidate in candidates:
-            candidate['test_title'] = test['title']
-            candidate['test_id'] = test['test_id']
-            all_candidates.append(candidate)
-    
-    # Получаем статистику для всех кандидатов
-    candidates_with_stats = []
-    for candidate in all_candidates:
-        # Получаем статистику по кодам
-        codes = db.get_codes_for_candidate(candidate['candidate_id'])
-        total_codes = len(codes)
-        used_codes = len([c for c in codes if c['is_used']])
-        
-        # Получаем результаты тестирования
-        candidate_results = db.get_candidate_results(candidate['candidate_id'])
-        if candidate_results and candidate_results['results']:
-            best_score = 0
-            for result in candidate_results['results']:
-                score_percent = (result[4] / result[5] * 100)
-                if score_percent > best_score:
-                    best_score = score_percent
-            tests_taken = len(candidate_results['results'])
-        else:
-            best_score = 0
-            tests_taken = 0
-        
-        candidate['total_codes'] = total_codes
-        candidate['used_codes'] = used_codes
-        candidate['best_score'] = round(best_score, 2)
-        candidate['tests_taken'] = tests_taken
-        candidates_with_stats.append(candidate)
+    owner_id = user['user_id'] if user['role'] != 'administrator' else None
+    page_args = get_page_args()
+    try:
+        page = db.get_candidates_page(user_id=owner_id, **page_args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('all_candidates'))
+    summary = db.get_candidates_summary(user_id=owner_id, search=page_args['search'])
     
-    return render_template('all_candidates.html', candidates=candidates_with_stats)
+    return render_template('all_candidates.html', candidates=page['items'], summary=summary,
+                           next_cursor=page['next_cursor'], page_args=page_args, status=None)
 
 @app.route('/tests/<int:test_id>/candidates')
 def test_candidates(test_id):
@@ -503,6 +557,59 @@ def create_candidate(test_id):
     
     return render_template('create_candidate.html', test=test)
 
+# Заголовки CSV для импорта кандидатов (в том числе из выгрузки /candidates/export)
+CANDIDATE_IMPORT_COLUMNS = {
+    'full_name': 'full_name', 'фио': 'full_name',
+    'position': 'position', 'должность': 'position',
+    'department': 'department', 'отдел': 'department'
+}
+
+def read_candidates_csv(file_storage):
+    """Построчно читать загруженный CSV с кандидатами, не загружая файл целиком"""
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    sample = stream.readline()
+    delimiter = ';' if sample.count(';') > sample.count(',') else ','
+    header = next(csv.reader([sample], delimiter=delimiter), [])
+    fields = [CANDIDATE_IMPORT_COLUMNS.get(name.strip().lower(), name.strip()) for name in header]
+    
+    for values in csv.reader(stream, delimiter=delimiter):
+        if not any(value.strip() for value in values):
+            continue
+        yield dict(zip(fields, values))
+
+@app.route('/tests/<int:test_id>/candidates/import', methods=['POST'])
+def import_candidates(test_id):
+    if not check_auth() or not is_hr():
+        return jsonify({'success': False, 'message': 'Доступ запрещен'})
+    
+    access, message = check_test_access(test_id)
+    if not access:
+        return jsonify({'success': False, 'message': message})
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'message': 'Файл не выбран'})
+    
+    try:
+        codes_per_candidate = max(0, min(int(request.form.get('codes_per_candidate', 0) or 0), 10))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Некорректное количество кодов'})
+    
+    try:
+        report = db.import_candidates(
+            test_id, read_candidates_csv(upload),
+            get_current_user()['user_id'], codes_per_candidate
+        )
+    except (csv.Error, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'message': f'Ошибка чтения CSV: {e}'})
+    
+    return jsonify({
+        'success': True,
+        'imported': report['imported'],
+        'codes_generated': report['codes_generated'],
+        'errors': [{'row': row, 'message': text} for row, text in report['errors']]
+    })
+
 @app.route('/candidates/<int:candidate_id>/edit', methods=['GET', 'POST'])
 def edit_candidate(candidate_id):
     if not check_auth() or not is_hr():
@@ -557,7 +664,14 @@ def candidate_codes(candidate_id):
     
     candidate = db.get_candidate_by_id(candidate_id)
     test = db.get_test_by_id(candidate['test_id'])
-    codes = db.get_codes_for_candidate(candidate_id)
+    page_args = get_page_args()
+    status = request.args.get('status') or None
+    try:
+        page = db.get_codes_page(candidate_id=candidate_id, status=status, **page_args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('candidate_codes', candidate_id=candidate_id))
+    counts = db.get_code_counts(candidate_id=candidate_id)
     candidate_results = db.get_candidate_results(candidate_id)
     
     # Получаем список администраторов для отображения создателей кодов
@@ -566,10 +680,50 @@ def candidate_codes(candidate_id):
     return render_template('candidate_codes.html', 
                          candidate=candidate, 
                          test=test, 
-                         codes=codes, 
+                         codes=page['items'], 
+                         counts=counts,
+                         next_cursor=page['next_cursor'],
+                         page_args=page_args,
+                         status=status,
                          candidate_results=candidate_results,
                          admins=admins)
 
+@app.route('/candidates/<int:candidate_id>/codes/export')
+def export_candidate_codes(candidate_id):
+    if not check_auth() or not is_hr():
+        flash('Доступ запрещен', 'error')
+        return redirect(url_for('index'))
+    
+    access, message = check_candidate_access(candidate_id)
+    if not access:
+        flash(message, 'error')
+        return redirect(url_for('tests'))
+    
+    return csv_response(f'codes_candidate_{candidate_id}.csv', CODES_EXPORT_HEADER,
+                        code_export_rows(db.iter_codes(candidate_id=candidate_id)))
+
+@app.route('/candidates/export')
+def export_candidates():
+    if not check_auth() or not is_hr():
+        flash('Доступ запрещен', 'error')
+        return redirect(url_for('index'))
+    
+    test_id = request.args.get('test_id', type=int)
+    if test_id is not None:
+        access, message = check_test_access(test_id)
+        if not access:
+            flash(message, 'error')
+            return redirect(url_for('all_candidates'))
+    
+    user = get_current_user()
+    rows = db.iter_candidates_with_stats(
+        user_id=user['user_id'] if user['role'] != 'administrator' else None,
+        test_id=test_id
+    )
+    header = ['ФИО', 'Должность', 'Отдел', 'Тест', 'Всего кодов', 'Использовано кодов',
+              'Лучший результат, %', 'Попыток', 'Добавлен']
+    return csv_response('candidates.csv', header, rows)
+
 @app.route('/candidates/<int:candidate_id>/generate-codes', methods=['POST'])
 def generate_candidate_codes(candidate_id):
     if not check_auth() or not is_hr():
@@ -595,6 +749,61 @@ def api_tests():
     tests = db.get_all_tests(user['user_id'] if user['role'] != 'administrator' else None)
     return jsonify(tests)
 
+@app.route('/api/candidates', methods=['GET'])
+def api_candidates():
+    """API для постраничного получения кандидатов со статистикой"""
+    if not check_auth() or not is_hr():
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    user = get_current_user()
+    test_id = request.args.get('test_id', type=int)
+    if test_id is not None:
+        access, message = check_test_access(test_id)
+        if not access:
+            return jsonify({'error': message}), 403
+    
+    try:
+        page = db.get_candidates_page(
+            user_id=user['user_id'] if user['role'] != 'administrator' else None,
+            test_id=test_id,
+            **get_page_args()
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@app.route('/api/tests/<int:test_id>/codes')
+def api_test_codes(test_id):
+    """API для постраничного получения кодов теста"""
+    if not check_auth() or not is_hr():
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    access, message = check_test_access(test_id)
+    if not access:
+        return jsonify({'error': message}), 403
+    
+    try:
+        page = db.get_codes_page(test_id=test_id, status=request.args.get('status'), **get_page_args())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@app.route('/api/candidates/<int:candidate_id>/codes')
+def api_candidate_codes(candidate_id):
+    """API для постраничного получения кодов кандидата"""
+    if not check_auth() or not is_hr():
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    
+    access, message = check_candidate_access(candidate_id)
+    if not access:
+        return jsonify({'error': message}), 403
+    
+    try:
+        page = db.get_codes_page(candidate_id=candidate_id, status=request.args.get('status'), **get_page_args())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
 @app.route('/api/candidates', methods=['POST'])
 def api_create_candidate():
     """API для создания кандидата"""
@@ -655,6 +864,28 @@ def statistics():
     stats = db.get_statistics(user['user_id'] if user['role'] != 'administrator' else None)
     return render_template('statistics.html', stats=stats, user=user)
 
+@app.route('/results/export')
+def export_results():
+    if not check_auth() or not is_hr():
+        flash('Доступ запрещен', 'error')
+        return redirect(url_for('index'))
+    
+    test_id = request.args.get('test_id', type=int)
+    if test_id is not None:
+        access, message = check_test_access(test_id)
+        if not access:
+            flash(message, 'error')
+            return redirect(url_for('statistics'))
+    
+    user = get_current_user()
+    rows = db.iter_results(
+        user_id=user['user_id'] if user['role'] != 'administrator' else None,
+        test_id=test_id
+    )
+    header = ['ID результата', 'Тест', 'Код', 'Сотрудник', 'Username', 'Имя в Telegram',
+              'Правильных ответов', 'Всего вопросов', 'Завершен']
+    return csv_response('results.csv', header, rows)
+
 @app.route('/clear-data', methods=['POST'])
 def clear_data():
     if not check_auth() or not is_administrator():
@@ -666,30 +897,22 @@ def clear_data():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Ошибка: {str(e)}'})
 
-# === ДОПОЛНИТЕЛЬНЫЕ МЕТОДЫ ДЛЯ КОДОВ ===
-
-def generate_codes_for_test(self, test_id, count, created_by):
-    """Сгенерировать коды для теста (без привязки к кандидату)"""
-    conn = sqlite3.connect(self.tests_db)
-    cursor = conn.cursor()
-    
-    codes = []
-    for _ in range(count):
-        # Генерируем код формата: ABC12345
-        code = ''.join(random.choices(string.ascii_uppercase, k=3)) + \
-               ''.join(random.choices(string.digits, k=5))
-        try:
-            cursor.execute(
-                "INSERT INTO personal_codes (test_id, code, created_by) VALUES (?, ?, ?)",
-                (test_id, code, created_by)
-            )
-            codes.append(code)
-        except sqlite3.IntegrityError:
-            continue
-    
-    conn.commit()
-    conn.close()
-    return codes
+# === КОМАНДЫ ОБСЛУЖИВАНИЯ ===
+
+@app.cli.command('rebuild-item-stats')
+@click.argument('test_id', type=int, required=False)
+def rebuild_item_stats_command(test_id):
+    """Пересчитать статистику заданий по сохраненным ответам"""
+    count = db.rebuild_item_statistics(test_id)
+    click.echo(f'Статистика пересчитана для вопросов: {count}')
+
+@app.cli.command('check-stats')
+def check_stats_command():
+    """Сверить сводные таблицы статистики с исходными данными и пересобрать их"""
+    mismatches = db.rebuild_statistics_rollups()
+    for table, key, stored, actual in mismatches:
+        click.echo(f'{table}[{key}]: было {stored}, стало {actual}')
+    click.echo(f'Расхождений: {len(mismatches)}, сводные таблицы пересобраны')
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
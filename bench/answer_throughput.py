@@ -0,0 +1,110 @@
+"""Пропускная способность записи ответов, ответов/с
+
+Потоки-пользователи одновременно отвечают на вопросы своих сессий.
+Сравниваются прежний save_answer (чтение JSON ответов сессии, UPDATE и
+фиксация с новым соединением на каждый ответ) и журнал ответов с групповой
+фиксацией в режимах answer_durability 'commit' (ответ подтверждается после
+фиксации пакета) и 'buffered' (сразу; время включает запись остатка).
+
+    python bench/answer_throughput.py [--users 32] [--answers 200]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from common import ROOT, bot_database, report, temp_data_dir
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+
+def legacy_save_answer(users_db, session_id, question_id, answer_index):
+    """Прежний save_answer: read-modify-write JSON и фиксация на каждый ответ"""
+    conn = sqlite3.connect(users_db)
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT answers FROM testing_sessions WHERE session_id = ?", (session_id,))
+    result = cursor.fetchone()
+    
+    answers = {}
+    if result and result[0]:
+        answers = json.loads(result[0])
+    
+    answers[str(question_id)] = answer_index
+    
+    cursor.execute("""
+        UPDATE testing_sessions 
+        SET answers = ?, last_activity = ?, current_question = ?
+        WHERE session_id = ?
+    """, (json.dumps(answers), datetime.now(), question_id, session_id))
+    
+    conn.commit()
+    conn.close()
+
+def start_sessions(db, users):
+    test_id = db.create_test("Тест", "Описание")
+    question_id = db.create_question(test_id, "Вопрос", 0)
+    db.create_option(question_id, "Вариант", True)
+    db.update_test(test_id, "Тест", "Описание", 1)
+    return [db.redeem_code(code, user_id)['session_id']
+            for user_id, code in enumerate(db.generate_codes(test_id, users), start=1)]
+
+def run_users(sessions, answers, save):
+    """Время, за которое все пользователи дали по answers ответов"""
+    barrier = threading.Barrier(len(sessions) + 1)
+    
+    def user(session_id):
+        barrier.wait()
+        for n in range(answers):
+            save(session_id, n, n % 4)
+    
+    threads = [threading.Thread(target=user, args=(session_id,)) for session_id in sessions]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--answers', type=int, default=200)
+    args = parser.parse_args()
+    total = args.users * args.answers
+    
+    rows = []
+    for name, durability in (("прежний save_answer", None),
+                             ("журнал, durability=commit", 'commit'),
+                             ("журнал, durability=buffered", 'buffered')):
+        with temp_data_dir():
+            db = bot_database.DatabaseManager(storage_config={
+                'checkpoint_interval': 0, 'answer_durability': durability or 'commit'
+            })
+            sessions = start_sessions(db, args.users)
+            
+            if durability is None:
+                elapsed = run_users(sessions, args.answers,
+                                    lambda *answer: legacy_save_answer(db.users_db, *answer))
+            else:
+                journal = db.answer_journal
+                batches = journal.batches_written
+                elapsed = run_users(sessions, args.answers,
+                                    lambda s, q, a: db.save_answer(s, q, a, q))
+                started = time.perf_counter()
+                journal.flush()
+                elapsed += time.perf_counter() - started
+                assert journal.rows_written == total, journal.rows_written
+                name += f" ({total / (journal.batches_written - batches):.0f} ответов в пакете)"
+            
+            rows.append((name, f"{total / elapsed:,.0f} ответов/с".replace(',', ' ')))
+            db.close_all()
+    
+    report(f"Запись ответов: {args.users} пользователей по {args.answers} ответов", rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Микробенчмарк кодека callback_data кнопок ответа
+
+Время кодирования и разбора AnswerCallbackCodec, в том числе для поддельных
+и чужих нажатий, которые отбрасываются до обращения к БД, и для прежнего
+формата answer_{session_id}_{question_id}_{idx} для сравнения. Отдельно -
+сборка клавиатуры вопроса при показе: подпись кнопок, InlineKeyboardMarkup
+и его сериализация в PTB.
+
+    python bench/callback_codec.py [--number 200000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+from common import ROOT, report
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+from callbacks import AnswerCallbackCodec, ANSWER_PREFIX
+from rendering import QuestionView, question_markup
+
+def legacy_decode(data):
+    """Прежний разбор в handle_answer"""
+    parts = data.split("_")
+    return int(parts[1]), int(parts[2]), int(parts[3])
+
+def forge(data):
+    """Та же строка с измененным символом MAC (последний символ несет биты дополнения)"""
+    return data[:-2] + ('A' if data[-2] != 'A' else 'B') + data[-1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args()
+    
+    codec = AnswerCallbackCodec("123456:TOKEN")
+    user_id, session_id = 987654321, 123456
+    data = codec.encode(user_id, session_id, 7, 2)
+    forged = forge(data)
+    assert codec.decode(user_id, data) == (session_id, 7, 2)
+    assert codec.decode(user_id, forged) is None
+    assert codec.decode(user_id + 1, data) is None
+    
+    view = QuestionView(7, "Вопрос 8 из 20:\n\nТекст вопроса",
+                        tuple(f"Вариант {idx}: " + "ответ " * 8 for idx in range(4)))
+    callback_data = codec.encode_options(user_id, session_id, 7, 4)
+    markup = question_markup(view, callback_data)
+    
+    cases = (
+        ("encode", lambda: codec.encode(user_id, session_id, 7, 2)),
+        ("encode_options (4 варианта)", lambda: codec.encode_options(user_id, session_id, 7, 4)),
+        ("decode: верная кнопка", lambda: codec.decode(user_id, data)),
+        ("decode: подделанный MAC", lambda: codec.decode(user_id, forged)),
+        ("decode: кнопка другого пользователя", lambda: codec.decode(user_id + 1, data)),
+        ("decode: не та длина", lambda: codec.decode(user_id, ANSWER_PREFIX + "x")),
+        ("прежний формат: f-строка", lambda: f"answer_{session_id}_{7}_{2}"),
+        ("прежний формат: split + int", lambda: legacy_decode("answer_123456_7_2")),
+        ("клавиатура: question_markup (4 кнопки)", lambda: question_markup(view, callback_data)),
+        ("клавиатура: to_json в PTB", markup.to_json),
+        ("показ вопроса: подпись + разметка + to_json",
+         lambda: question_markup(view, codec.encode_options(user_id, session_id, 7, 4)).to_json()),
+    )
+    rows = [(f"{name} ({len(data)} байт)" if name == "encode" else name,
+             f"{min(timeit.repeat(func, number=args.number, repeat=3)) / args.number * 1e6:.2f} мкс")
+            for name, func in cases]
+    
+    report(f"Кодек callback_data, лучшее из 3 по {args.number} вызовов", rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Страница /candidates при 10 000 кандидатов
+
+Сравнивает прежнюю схему (цикл по тестам и кандидатам: get_codes_for_candidate
+и get_candidate_results на каждого) с текущей страницей, которая читает строки
+сводной таблицы candidate_stats по индексу поля сортировки. Прежний цикл выполняется
+уже на пуле соединений, поэтому его время - оценка снизу для старого кода.
+Текущая страница запрашивается через тестовый клиент Flask целиком, с шаблоном.
+
+    python bench/candidates_page.py [--candidates 10000] [--tests 10]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from common import ROOT, load_module, per_call, report, temp_data_dir
+
+ADMIN = {'user_id': 1, 'username': 'admin', 'role': 'administrator'}
+
+def fill(db, candidates, tests):
+    """Кандидаты с одним кодом; половина кодов использована и имеет результат"""
+    per_test = candidates // tests
+    for n in range(tests):
+        test_id = db.create_test(f"Тест {n}", "Описание", 1)
+        db.import_candidates(test_id, (
+            {'full_name': f"Кандидат {n}-{i}", 'position': "Инженер", 'department': "Отдел"}
+            for i in range(per_test)
+        ), 1, codes_per_candidate=1)
+    
+    conn = sqlite3.connect(db.tests_db)
+    codes = conn.execute("SELECT code, test_id FROM personal_codes WHERE code_id % 2 = 0").fetchall()
+    conn.execute("UPDATE personal_codes SET is_used = 1 WHERE code_id % 2 = 0")
+    conn.commit()
+    conn.close()
+    
+    random.seed(1)
+    conn = sqlite3.connect(db.users_db)
+    conn.executemany("INSERT INTO telegram_users (user_id, consent_accepted) VALUES (?, 1)",
+                     [(i,) for i in range(1, len(codes) + 1)])
+    conn.executemany("INSERT INTO results (user_id, test_id, code, score, total_questions) VALUES (?, ?, ?, ?, 10)",
+                     [(i, test_id, code, random.randint(0, 10)) for i, (code, test_id) in enumerate(codes, start=1)])
+    conn.commit()
+    conn.close()
+    db.rebuild_statistics_rollups()
+
+def legacy_candidates(db):
+    """Прежнее представление all_candidates: запросы по каждому кандидату"""
+    all_candidates = []
+    for test in db.get_all_tests(None):
+        for candidate in db.get_candidates_for_test(test['test_id']):
+            candidate['test_title'] = test['title']
+            all_candidates.append(candidate)
+    
+    for candidate in all_candidates:
+        codes = db.get_codes_for_candidate(candidate['candidate_id'])
+        candidate['total_codes'] = len(codes)
+        candidate['used_codes'] = len([c for c in codes if c['is_used']])
+        results = db.get_candidate_results(candidate['candidate_id'])
+        scores = [r[4] / r[5] * 100 for r in results['results']] if results else []
+        candidate['best_score'] = round(max(scores, default=0), 2)
+        candidate['tests_taken'] = len(scores)
+    return all_candidates
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--candidates', type=int, default=10000)
+    parser.add_argument('--tests', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    
+    with temp_data_dir():
+        started = time.perf_counter()
+        sys.path.insert(0, os.path.join(ROOT, 'admin'))
+        admin = load_module('admin_app', 'admin/app.py')
+        fill(admin.db, args.candidates, args.tests)
+        print(f"Подготовка данных: {time.perf_counter() - started:.1f} с")
+        
+        client = admin.app.test_client()
+        with client.session_transaction() as session:
+            session['authenticated'] = True
+            session['user'] = ADMIN
+        
+        def get(url):
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+            return response
+        
+        first = get('/candidates')
+        cursor = first.get_data(as_text=True).split('after=')[1].split('"')[0].split('&')[0]
+        
+        legacy_started = time.perf_counter()
+        legacy_rows = len(legacy_candidates(admin.db))
+        legacy = time.perf_counter() - legacy_started
+        
+        rows = [
+            (f"прежний цикл ({legacy_rows} кандидатов)", f"{legacy * 1000:.0f} мс"),
+            ("GET /candidates (50 строк)", f"{per_call(lambda: get('/candidates'), args.repeat) * 1000:.1f} мс"),
+            ("GET /candidates, следующая страница", f"{per_call(lambda: get('/candidates?after=' + cursor), args.repeat) * 1000:.1f} мс"),
+            ("GET /candidates?limit=500", f"{per_call(lambda: get('/candidates?limit=500'), args.repeat) * 1000:.1f} мс"),
+            ("get_candidates_page(sort='best_score')", f"{per_call(lambda: admin.db.get_candidates_page(sort='best_score'), args.repeat) * 1000:.2f} мс"),
+            ("get_candidates_page(user_id=1)", f"{per_call(lambda: admin.db.get_candidates_page(user_id=1), args.repeat) * 1000:.2f} мс"),
+            ("get_candidates_summary()", f"{per_call(admin.db.get_candidates_summary, args.repeat) * 1000:.2f} мс"),
+            ("GET /candidates?q=Кандидат 7-", f"{per_call(lambda: get('/candidates?q=Кандидат 7-'), args.repeat) * 1000:.1f} мс"),
+        ]
+        admin.db.close_all()
+    
+    report(f"/candidates: {args.candidates} кандидатов в {args.tests} тестах", rows)
+
+if __name__ == '__main__':
+    main()
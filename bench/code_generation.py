@@ -0,0 +1,41 @@
+"""Скорость массовой генерации персональных кодов
+
+Генерирует несколько пакетов кодов для одного теста и печатает скорость
+каждого пакета: с ростом таблицы personal_codes дороже становятся вставки
+в индексы. Проверяет, что возвращено ровно запрошенное число уникальных кодов.
+
+    python bench/code_generation.py [--count 100000] [--batches 4]
+"""
+import argparse
+import time
+
+from common import report, shared_database, temp_data_dir
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--batches', type=int, default=4)
+    args = parser.parse_args()
+    
+    rows = []
+    with temp_data_dir():
+        db = shared_database.DatabaseManager(storage_config={'checkpoint_interval': 0})
+        test_id = db.create_test("Тест", "Описание", 1)
+        generated = set()
+        for batch in range(args.batches):
+            started = time.perf_counter()
+            codes = db.generate_codes_for_test(test_id, args.count, 1)
+            elapsed = time.perf_counter() - started
+            
+            assert len(codes) == args.count, len(codes)
+            generated.update(codes)
+            rows.append((f"пакет {batch + 1} (в таблице {batch * args.count})",
+                         f"{args.count / elapsed:,.0f} кодов/с".replace(',', ' ')))
+        
+        assert len(generated) == args.count * args.batches
+        db.close_all()
+    
+    report(f"Генерация кодов пакетами по {args.count}", rows)
+
+if __name__ == '__main__':
+    main()
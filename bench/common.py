@@ -0,0 +1,42 @@
+"""Общие помощники бенчмарков
+
+Бенчмарки запускаются из корня репозитория: python bench/<имя>.py [параметры].
+Каждый работает во временном каталоге с пустыми data/tests.db и data/users.db
+и печатает результат в виде таблицы.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Загрузка модулей по пути и обе копии DatabaseManager - общие с тестами
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+from conftest import ROOT, load_module, bot_database, shared_database
+
+@contextmanager
+def temp_data_dir():
+    """Временный рабочий каталог (DatabaseManager создает data/ относительно cwd)"""
+    previous = os.getcwd()
+    path = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(path, ignore_errors=True)
+
+def per_call(func, number):
+    """Среднее время одного вызова func, сек"""
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - started) / number
+
+def report(title, rows):
+    """Напечатать таблицу (название, значение)"""
+    print(f"\n{title}")
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print(f"  {name.ljust(width)}  {value}")
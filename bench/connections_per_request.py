@@ -0,0 +1,100 @@
+"""Соединения SQLite на один запрос: до пула и с пулом
+
+"Запрос" - набор вызовов DatabaseManager, который делает один обработчик:
+страница теста в админке и нажатие кнопки ответа с завершением теста в боте.
+До пула каждый вызов открывал и закрывал свое соединение, поэтому число
+обращений к пулу равно числу соединений, которое открывал старый код.
+С пулом запрос в одном потоке получает одно и то же соединение на файл БД,
+а новых соединений после прогрева не открывается вовсе.
+
+    python bench/connections_per_request.py [--requests 1000]
+"""
+import argparse
+import sqlite3
+
+from common import per_call, report, shared_database, temp_data_dir
+
+def admin_test_page(db, test_id):
+    db.get_test_by_id(test_id)
+    db.get_questions_with_options(test_id)
+    db.get_codes_page(test_id=test_id)
+    db.get_test_candidates_statistics(test_id)
+    db.get_statistics(1)
+
+def bot_answer_and_finish(db, test_id, code, user_id):
+    session_id = db.redeem_code(code, user_id)['session_id']
+    db.get_active_session(user_id)
+    db.get_questions_with_options(test_id)
+    db.save_result(session_id, 1, 3)
+
+def setup(db, codes):
+    test_id = db.create_test("Тест", "Описание", 1)
+    for order in range(3):
+        question_id = db.create_question(test_id, f"Вопрос {order}", order)
+        for idx in range(3):
+            db.create_option(question_id, f"Вариант {idx}", idx == 1)
+    db.update_test(test_id, "Тест", "Описание", 1)
+    return test_id, db.generate_codes_for_test(test_id, codes, 1)
+
+class ConnectionCounter:
+    """Считает обращения к пулу и разные соединения, выданные за запрос"""
+    
+    def __init__(self, db):
+        self.db = db
+        self.acquired = 0
+        self.distinct = set()
+        acquire = db._acquire
+        
+        def counting_acquire(db_path):
+            conn = acquire(db_path)
+            self.acquired += 1
+            self.distinct.add((db_path, id(conn)))
+            return conn
+        
+        db._acquire = counting_acquire
+    
+    def measure(self, request, number):
+        opened = self.db.connections_opened
+        acquired, distinct = 0, 0
+        for i in range(number):
+            self.acquired = 0
+            self.distinct = set()
+            request(i)
+            acquired += self.acquired
+            distinct += len(self.distinct)
+        return acquired / number, distinct / number, (self.db.connections_opened - opened) / number
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+    
+    with temp_data_dir():
+        db = shared_database.DatabaseManager(storage_config={'checkpoint_interval': 0})
+        test_id, codes = setup(db, args.requests + 1)
+        counter = ConnectionCounter(db)
+        
+        # Прогрев: пул заполняется соединениями
+        admin_test_page(db, test_id)
+        bot_answer_and_finish(db, test_id, codes[-1], 10 ** 6)
+        
+        rows = []
+        for name, request in (
+            ("страница теста (админка)", lambda i: admin_test_page(db, test_id)),
+            ("ответ и завершение теста (бот)", lambda i: bot_answer_and_finish(db, test_id, codes[i], i + 1)),
+        ):
+            acquired, distinct, opened = counter.measure(request, args.requests)
+            rows.append((name, f"до пула: {acquired:.1f} соединений, с пулом: {distinct:.1f} "
+                               f"(по одному на файл БД), новых: {opened:.3f}"))
+        
+        # Цена одного соединения, которое старый код открывал на каждый вызов
+        connect_cost = per_call(lambda: db._open_connection(db.tests_db).close(), 500)
+        raw_connect_cost = per_call(lambda: sqlite3.connect(db.tests_db).close(), 500)
+        rows.append(("открыть + закрыть соединение", f"{connect_cost * 1e6:.0f} мкс "
+                     f"(без PRAGMA {raw_connect_cost * 1e6:.0f} мкс)"))
+        db.close_all()
+    
+    report(f"Соединения на запрос, {args.requests} запросов", rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Задержка цикла событий бота при 500 одновременных пользователях
+
+Каждый пользователь проходит путь обработчиков бота: регистрация, согласие,
+погашение кода, содержимое теста, ответы на вопросы, результат. Параллельно
+задача-монитор засыпает на interval и измеряет, насколько позже она
+проснулась, - это задержка обработки любых других обновлений.
+
+Сравниваются AsyncDatabaseManager (чтения в пуле потоков, записи в потоке-
+писателе) и прежняя схема: синхронные вызовы DatabaseManager прямо из корутин.
+
+    python bench/event_loop_lag.py [--users 500] [--questions 10]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+from common import ROOT, bot_database, report, temp_data_dir
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+
+class BlockingDatabase:
+    """Прежняя схема: методы DatabaseManager вызываются прямо в цикле событий"""
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        
+        return call
+
+def setup(db, users, questions):
+    test_id = db.create_test("Тест", "Описание")
+    for order in range(questions):
+        question_id = db.create_question(test_id, f"Вопрос {order}", order)
+        for idx in range(4):
+            db.create_option(question_id, f"Вариант {idx}", idx == 1)
+    db.update_test(test_id, "Тест", "Описание", 1)
+    return db.generate_codes(test_id, users)
+
+async def take_test(db, user_id, code):
+    await db.get_or_create_user(user_id, f"user{user_id}", "Имя")
+    await db.accept_consent(user_id)
+    await db.has_accepted_consent(user_id)
+    
+    redemption = await db.redeem_code(code, user_id)
+    content = await db.get_test_content(redemption['test_id'], redemption['content_revision'])
+    for ordinal, question in enumerate(content.questions):
+        # Пользователь читает вопрос перед нажатием кнопки
+        await asyncio.sleep(random.uniform(0, 0.05))
+        await db.save_answer(redemption['session_id'], question.question_id, 1, ordinal)
+    await db.save_result(redemption['session_id'], len(content), len(content))
+    return len(content)
+
+async def run(db, codes, interval):
+    lags = []
+    done = asyncio.Event()
+    
+    async def monitor():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lags.append(loop.time() - expected)
+    
+    monitor_task = asyncio.create_task(monitor())
+    started = time.perf_counter()
+    answers = await asyncio.gather(*(
+        take_test(db, user_id, code) for user_id, code in enumerate(codes, start=1)
+    ))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await monitor_task
+    return elapsed, sum(answers), lags
+
+def describe(elapsed, answers, lags):
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1]
+    return (f"задержка p50 {statistics.median(lags_ms):.1f} мс, p99 {p99:.1f} мс, "
+            f"макс {lags_ms[-1]:.1f} мс; {answers / elapsed:.0f} ответов/с, всего {elapsed:.1f} с")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.005)
+    args = parser.parse_args()
+    
+    rows = []
+    for name, wrap in (("синхронно в цикле событий", BlockingDatabase),
+                       ("AsyncDatabaseManager", bot_database.AsyncDatabaseManager)):
+        with temp_data_dir():
+            random.seed(1)
+            db = bot_database.DatabaseManager(storage_config={'checkpoint_interval': 0})
+            codes = setup(db, args.users, args.questions)
+            elapsed, answers, lags = asyncio.run(run(wrap(db), codes, args.interval))
+            rows.append((name, describe(elapsed, answers, lags)))
+            db.close_all()
+    
+    report(f"Цикл событий: {args.users} пользователей, {args.questions} вопросов", rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Память на 10 000 одновременных сессий прохождения теста
+
+Прежняя сессия - словарь с собственной копией списка вопросов (словари
+вопросов и вариантов из get_questions_with_options). Текущая - TestSession
+со __slots__ и массивом ответов, вопросы берутся из общего TestContent.
+Память считается через tracemalloc как прирост после создания всех сессий.
+
+    python bench/session_memory.py [--sessions 10000] [--questions 20]
+"""
+import argparse
+import gc
+import os
+import sqlite3
+import sys
+import tracemalloc
+
+from common import ROOT, bot_database, report, temp_data_dir
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+from sessions import SessionStore
+
+def setup(db, questions, options):
+    test_id = db.create_test("Тест", "Описание")
+    for order in range(questions):
+        question_id = db.create_question(test_id, f"Вопрос {order}: " + "текст вопроса " * 12, order)
+        for idx in range(options):
+            db.create_option(question_id, f"Вариант {idx}: " + "ответ " * 8, idx == 1)
+    db.update_test(test_id, "Тест", "Описание", 1)
+    return test_id
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return sessions, size
+
+def legacy_questions_with_options(tests_db, test_id):
+    """Прежний get_questions_with_options: новые словари при каждом вызове"""
+    conn = sqlite3.connect(tests_db)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("""
+        SELECT q.question_id, q.text, q.question_order,
+               o.option_id, o.text as option_text, o.is_correct
+        FROM questions q
+        LEFT JOIN options o ON q.question_id = o.question_id
+        WHERE q.test_id = ?
+        ORDER BY q.question_order, o.option_id
+    """, (test_id,)).fetchall()
+    conn.close()
+    
+    questions = {}
+    for row in rows:
+        q_id = row['question_id']
+        if q_id not in questions:
+            questions[q_id] = {
+                'question_id': q_id,
+                'text': row['text'],
+                'question_order': row['question_order'],
+                'options': []
+            }
+        if row['option_id']:
+            questions[q_id]['options'].append({
+                'option_id': row['option_id'],
+                'text': row['option_text'],
+                'is_correct': row['is_correct']
+            })
+    return list(questions.values())
+
+def legacy_sessions(db, test_id, count):
+    """Прежний бот: копия вопросов в каждой сессии"""
+    return {
+        user_id: {
+            'session_id': user_id,
+            'test_id': test_id,
+            'questions': legacy_questions_with_options(db.tests_db, test_id),
+            'current_question_index': -1,
+            'start_message_id': user_id
+        }
+        for user_id in range(count)
+    }
+
+def compact_sessions(db, test_id, count):
+    store = SessionStore(db)
+    content = db.get_test_content(test_id)
+    for user_id in range(count):
+        store.start(user_id, user_id, content)
+    return store
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--options', type=int, default=4)
+    args = parser.parse_args()
+    
+    rows = []
+    with temp_data_dir():
+        db = bot_database.DatabaseManager(storage_config={'checkpoint_interval': 0})
+        test_id = setup(db, args.questions, args.options)
+        # Соединения и кэш содержимого теста не должны попасть в замер
+        db.get_test_content(test_id)
+        
+        for name, build in (("словарь с копией вопросов", legacy_sessions),
+                            ("TestSession + общий TestContent", compact_sessions)):
+            sessions, size = measure(lambda: build(db, test_id, args.sessions))
+            rows.append((name, f"{size / 2 ** 20:.1f} МиБ, {size / args.sessions:.0f} байт на сессию"))
+            del sessions
+        db.close_all()
+    
+    report(f"Память: {args.sessions} сессий, {args.questions} вопросов по {args.options} варианта", rows)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,18 @@
 import os
+import asyncio
 import logging
 import sys
+from urllib.parse import urlparse
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from database import DatabaseManager
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+from database import DatabaseManager, AsyncDatabaseManager
+from sessions import SessionStore, SessionContentChanged
+from metrics import BotMetrics
+from codes import CodeFilter, AttemptThrottle
+from rendering import question_view, question_markup
+from callbacks import AnswerCallbackCodec, ANSWER_PREFIX
 
 # Настройка логирования
 logging.basicConfig(
@@ -14,25 +21,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя
+    
+    Обновления разных пользователей обрабатываются одновременно (не более workers
+    сразу), обновления одного пользователя - строго по очереди поступления:
+    два быстрых нажатия кнопки не гонятся за одну и ту же сессию.
+    max_pending ограничивает число принятых, но еще ждущих обработки обновлений.
+    """
+    
+    def __init__(self, workers=16, max_pending=256):
+        super().__init__(max(workers, max_pending))
+        self._workers = asyncio.BoundedSemaphore(workers)
+        # user_id -> [asyncio.Lock, число обновлений пользователя в обработке]
+        self._user_locks = {}
+    
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            async with self._workers:
+                await coroutine
+            return
+        
+        entry = self._user_locks.get(user.id)
+        if entry is None:
+            entry = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock будит ожидающих в порядке очереди
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user.id]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+# Показ вопросов: 'edit' - следующий вопрос заменяет предыдущий в том же сообщении
+# (один вызов edit_message_text), 'messages' - каждый вопрос отдельным сообщением
+QUESTION_FLOWS = ('edit', 'messages')
+
+# Период полной пересборки фильтра кодов (подхватывает погашения и сбросы из админки), сек
+CODE_FILTER_REBUILD_INTERVAL = 300
+
 class TestBot:
-    def __init__(self, token):
+    def __init__(self, token, workers=1, question_flow='edit', callback_secret=None):
+        if question_flow not in QUESTION_FLOWS:
+            raise ValueError(f"Неизвестный режим показа вопросов: {question_flow}")
+        
         self.token = token
-        self.db = DatabaseManager()
-        self.application = Application.builder().token(token).build()
+        self.question_flow = question_flow
+        self.metrics = BotMetrics()
+        # Ключ подписи кнопок должен переживать перезапуск: по умолчанию выводится из токена
+        self.callbacks = AnswerCallbackCodec(callback_secret or token)
+        self.db = AsyncDatabaseManager(DatabaseManager())
+        
+        # Заведомо неверные коды отсекаются в памяти, неудачные попытки ограничены
+        self.code_filter = CodeFilter()
+        self.code_throttle = AttemptThrottle()
+        self._code_filter_task = None
+        
+        builder = Application.builder().token(token).post_init(self.post_init).post_shutdown(self.shutdown)
+        if workers > 1:
+            # Без этого обновления обрабатываются строго последовательно
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(workers))
+        self.application = builder.build()
         
         # Регистрация обработчиков
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.application.add_handler(CallbackQueryHandler(self.handle_button))
         
-        # Хранилище сессий
-        self.user_sessions = {}
+        # Хранилище сессий (восстанавливаются из БД после перезапуска)
+        self.sessions = SessionStore(self.db)
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        self.db.get_or_create_user(user.id, user.username, user.first_name)
+        await self.db.get_or_create_user(user.id, user.username, user.first_name)
         
-        if not self.db.has_accepted_consent(user.id):
+        if not await self.db.has_accepted_consent(user.id):
             # Показываем соглашение
             keyboard = [[InlineKeyboardButton("✅ Принять", callback_data="accept_consent")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -65,7 +138,7 @@ class TestBot:
         
         if query.data == "accept_consent":
             # Пользователь принимает соглашение
-            self.db.accept_consent(user_id)
+            await self.db.accept_consent(user_id)
             
             # Удаляем кнопку и обновляем сообщение
             await query.edit_message_text(
@@ -73,78 +146,113 @@ class TestBot:
                 "Введите персональный код для начала теста:"
             )
         
-        elif query.data.startswith("answer_"):
+        elif query.data.startswith(ANSWER_PREFIX):
             # Обработка ответа на вопрос
             await self.handle_answer(query, context)
+        
+        elif query.data.startswith("answer_"):
+            # Кнопки старого формата, отправленные до обновления бота
+            await self.refresh_question(query)
     
     async def handle_answer(self, query, context):
-        data_parts = query.data.split("_")
-        session_id = int(data_parts[1])
-        question_id = int(data_parts[2])
-        answer_index = int(data_parts[3])
+        user_id = query.from_user.id
+        
+        # Битые и подделанные нажатия отсекаются до обращения к сессиям и БД
+        decoded = self.callbacks.decode(user_id, query.data)
+        if decoded is None:
+            self.metrics.incr('callbacks_rejected')
+            return
+        session_id, ordinal, answer_index = decoded
+        
+        # Сессия берется из памяти или восстанавливается из БД после перезапуска
+        session = await self.get_session(query)
+        if session is False:
+            return
+        if not session or session.session_id != session_id:
+            await query.message.reply_text("❌ Сессия теста прервана. Начните заново.")
+            return
+        
+        # query.answer() в handle_button
+        session.api_calls += 1
+        
+        # Повторное нажатие на кнопку уже отвеченного вопроса игнорируем
+        question = session.current_question
+        if question is None or session.index != ordinal or answer_index >= len(question.options):
+            self.metrics.incr('callbacks_stale')
+            return
         
         # Сохраняем ответ
-        self.db.save_answer(session_id, question_id, answer_index)
+        await self.sessions.record_answer(session, answer_index)
+        
+        # Получаем следующий вопрос
+        await self.show_next_question(query, context, session)
+    
+    def question_keyboard(self, user_id, session_id, view):
+        """Клавиатура вопроса с подписанной callback_data для пользователя"""
+        return question_markup(view, self.callbacks.encode_options(
+            user_id, session_id, view.ordinal, len(view.labels)
+        ))
+    
+    async def get_session(self, query):
+        """Сессия пользователя; False, если ее нельзя продолжить (пользователю уже ответили)"""
+        try:
+            return await self.sessions.get(query.from_user.id)
+        except SessionContentChanged:
+            self.metrics.incr('sessions_rejected_revision')
+            await query.message.reply_text(
+                "❌ Тест изменили, пока вы его проходили, и продолжить его нельзя. "
+                "Обратитесь за новым кодом."
+            )
+            return False
+    
+    async def refresh_question(self, query):
+        """Показать текущий вопрос заново с кнопками нового формата"""
+        session = await self.get_session(query)
+        if session and session.current_question is not None:
+            view = question_view(session.content, session.index)
+            keyboard = self.question_keyboard(query.from_user.id, session.session_id, view)
+            await self.show_screen(query, session, view.text, keyboard)
+    
+    async def show_screen(self, query, session, text, reply_markup=None):
+        """Показать следующий экран теста в выбранном режиме показа вопросов"""
+        if self.question_flow == 'edit':
+            # Одно изменение сообщения вместо удаления клавиатуры и нового сообщения
+            session.api_calls += 1
+            await query.edit_message_text(text, reply_markup=reply_markup)
+            return
         
         # Удаляем клавиатуру с предыдущего сообщения
+        session.api_calls += 1
         try:
             await query.edit_message_reply_markup(reply_markup=None)
         except Exception as e:
             logger.warning(f"Could not remove keyboard: {e}")
         
-        # Получаем следующий вопрос
-        await self.show_next_question(query, context, session_id, question_id)
+        session.api_calls += 1
+        await query.message.reply_text(text, reply_markup=reply_markup)
     
-    async def show_next_question(self, query, context, session_id, current_question_id):
-        # Получаем информацию о сессии
-        user_id = query.from_user.id
-        
-        if user_id not in self.user_sessions:
-            await query.message.reply_text("❌ Сессия теста прервана. Начните заново.")
-            return
-        
-        session_data = self.user_sessions[user_id]
-        questions = session_data['questions']
-        current_index = session_data['current_question_index']
-        
-        # Переходим к следующему вопросу
-        current_index += 1
-        self.user_sessions[user_id]['current_question_index'] = current_index
-        
-        if current_index < len(questions):
-            # Показываем следующий вопрос
-            question = questions[current_index]
-            keyboard = [
-                [InlineKeyboardButton(option['text'], callback_data=f"answer_{session_id}_{question['question_id']}_{idx}")]
-                for idx, option in enumerate(question['options'])
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.reply_text(
-                f"Вопрос {current_index + 1} из {len(questions)}:\n\n{question['text']}",
-                reply_markup=reply_markup
-            )
+    async def show_next_question(self, query, context, session):
+        if session.current_question is not None:
+            # Показываем следующий вопрос (текст и кнопки собраны заранее)
+            view = question_view(session.content, session.index)
+            keyboard = self.question_keyboard(query.from_user.id, session.session_id, view)
+            await self.show_screen(query, session, view.text, keyboard)
         else:
             # Тест завершен
-            await self.finish_test(query, context, session_id, session_data)
+            await self.finish_test(query, context, session)
     
-    async def finish_test(self, query, context, session_id, session_data):
-        # Вычисляем результат
-        score = 0
-        total_questions = len(session_data['questions'])
+    async def finish_test(self, query, context, session):
+        session_id = session.session_id
         
-        # Здесь должна быть логика проверки правильности ответов
-        # Для примера - случайный результат
-        import random
-        score = random.randint(0, total_questions)
+        # Вычисляем результат по ключу ответов теста
+        score = session.content.score(session.answers)
+        total_questions = len(session.questions)
         
-        # Сохраняем результат
-        self.db.save_result(session_id, score, total_questions)
+        # Сохраняем результат вместе с выбранными вариантами по вопросам
+        await self.db.save_result(session_id, score, total_questions, session.chosen_options())
         
         # Очищаем сессию пользователя
-        user_id = query.from_user.id
-        if user_id in self.user_sessions:
-            del self.user_sessions[user_id]
+        self.sessions.discard(query.from_user.id)
         
         # Показываем результат
         result_text = (
@@ -153,66 +261,162 @@ class TestBot:
             f"Успех: {score/total_questions*100:.1f}%"
         )
         
-        await query.message.reply_text(result_text)
+        await self.show_screen(query, session, result_text)
+        
+        self.metrics.incr('tests_completed')
+        if session.restored:
+            # Вызовы до перезапуска бота не сохраняются - такой тест занизил бы api_calls_per_test
+            self.metrics.incr('tests_completed_restored')
+        else:
+            self.metrics.incr('test_api_calls', session.api_calls)
+        logger.debug(f"Тест {session.session_id} завершен за {session.api_calls} вызовов Bot API")
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         text = update.message.text.strip()
         
-        if not self.db.has_accepted_consent(user.id):
+        if not await self.db.has_accepted_consent(user.id):
             await update.message.reply_text("Пожалуйста, сначала примите условия использования через команду /start")
             return
         
-        # Проверяем код
-        test_info = self.db.get_test_by_code(text)
+        if not self.code_throttle.allow(user.id):
+            self.metrics.incr('code_attempts_throttled')
+            await update.message.reply_text("⏳ Слишком много неверных попыток. Попробуйте ввести код позже.")
+            return
+        
+        test_info = None
+        self.metrics.incr('code_lookups')
+        if await self.code_may_exist(text):
+            # Проверяем и гасим код одной транзакцией: одновременно тот же код не получит никто другой
+            test_info = await self.db.redeem_code(text, user.id)
+            if not test_info:
+                self.metrics.incr('code_lookups_rejected_db')
+        else:
+            self.metrics.incr('code_lookups_rejected_filter')
+        
         if test_info:
+            self.code_filter.discard(text)
+            
             # Начинаем тест
-            session_id = self.db.mark_code_used(text, user.id, test_info['test_id'])
+            session_id = test_info['session_id']
             
-            # Получаем вопросы теста
-            questions = self.db.get_questions_with_options(test_info['test_id'])
+            # Получаем вопросы теста (общие для всех сессий этой ревизии)
+            content = await self.db.get_test_content(
+                test_info['test_id'], test_info['content_revision']
+            )
+            logger.debug(f"Кэш содержимого тестов: {self.db.content_cache.stats()}")
             
-            if questions:
+            if len(content):
                 # Сохраняем сессию пользователя
-                self.user_sessions[user.id] = {
-                    'session_id': session_id,
-                    'test_id': test_info['test_id'],
-                    'questions': questions,
-                    'current_question_index': -1,
-                    'start_message_id': update.message.message_id
-                }
+                session = self.sessions.start(user.id, session_id, content)
                 
                 # Показываем первый вопрос
-                first_question = questions[0]
-                self.user_sessions[user.id]['current_question_index'] = 0
-                
-                keyboard = [
-                    [InlineKeyboardButton(option['text'], callback_data=f"answer_{session_id}_{first_question['question_id']}_{idx}")]
-                    for idx, option in enumerate(first_question['options'])
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                view = question_view(content, 0)
                 
+                session.api_calls += 1
                 await update.message.reply_text(
-                    f"Начинаем тест: {test_info['title']}\n\n"
-                    f"Вопрос 1 из {len(questions)}:\n{first_question['text']}",
-                    reply_markup=reply_markup
+                    f"Начинаем тест: {test_info['title']}\n\n{view.text}",
+                    reply_markup=self.question_keyboard(user.id, session_id, view)
                 )
             else:
                 await update.message.reply_text("❌ В этом тесте нет вопросов.")
         else:
+            self.code_throttle.fail(user.id)
             await update.message.reply_text("❌ Код не найден или уже использован. Проверьте правильность ввода.")
     
-    def run(self):
-        self.application.run_polling()
+    async def code_may_exist(self, code):
+        """Проверить код по фильтру; промах перепроверяется после дочитывания новых кодов"""
+        if code in self.code_filter:
+            return True
+        
+        # Код мог быть только что создан в админке - дочитываем новые коды,
+        # но не чаще refresh_interval, чтобы перебор не нагружал БД
+        if self.code_filter.refresh_due():
+            if await self.db.get_code_reset_generation() != self.code_filter.generation:
+                # Админка сбросила коды: погашенные снова действуют, дочитывания
+                # по code_id недостаточно. Окно до обнаружения - refresh_interval
+                await self.rebuild_code_filter()
+                return code in self.code_filter
+            
+            added = self.code_filter.add(await self.db.get_codes_after(self.code_filter.last_code_id))
+            self.metrics.incr('code_filter_refreshes')
+            if added:
+                return code in self.code_filter
+        return False
+    
+    async def rebuild_code_filter(self):
+        # Поколение читаем до кодов: сброс между запросами заметит следующее обновление
+        generation = await self.db.get_code_reset_generation()
+        rows = await self.db.get_codes_after(0)
+        # Сортировка сотен тысяч хэшей не должна блокировать цикл событий;
+        # погашения во время сборки дадут лишь ложноположительные ответы
+        code_filter = CodeFilter(self.code_filter.refresh_interval)
+        await asyncio.get_running_loop().run_in_executor(None, code_filter.load, rows, generation)
+        self.code_filter = code_filter
+        logger.info(f"Фильтр кодов: {len(self.code_filter)} действующих кодов")
+    
+    async def _rebuild_code_filter_periodically(self):
+        while True:
+            await asyncio.sleep(CODE_FILTER_REBUILD_INTERVAL)
+            try:
+                await self.rebuild_code_filter()
+            except Exception:
+                logger.exception("Не удалось пересобрать фильтр кодов")
+    
+    async def post_init(self, application):
+        await self.rebuild_code_filter()
+        self._code_filter_task = asyncio.create_task(self._rebuild_code_filter_periodically())
+    
+    async def shutdown(self, application):
+        if self._code_filter_task:
+            self._code_filter_task.cancel()
+        
+        logger.info(f"Метрики бота: {self.metrics.snapshot()}")
+        
+        # Дожидаемся отложенных записей в БД до остановки процесса
+        await asyncio.get_running_loop().run_in_executor(None, self.db.shutdown)
+    
+    def run(self, webhook_url=None, listen="127.0.0.1", port=8443, secret_token=None):
+        """Запустить бота: polling или webhook (за локальным reverse proxy)
+        
+        В режиме webhook Telegram отправляет обновления на webhook_url, прокси
+        передает их на listen:port, путь берется из webhook_url.
+        """
+        if not webhook_url:
+            self.application.run_polling()
+            return
+        
+        self.application.run_webhook(
+            listen=listen,
+            port=port,
+            url_path=urlparse(webhook_url).path.lstrip('/'),
+            webhook_url=webhook_url,
+            secret_token=secret_token
+        )
 
 if __name__ == "__main__":
     
     BOT_TOKEN = "TOKEN_HERE"
     
+    # Режим webhook: внешний HTTPS-адрес, который проксируется на WEBHOOK_LISTEN:WEBHOOK_PORT
+    WEBHOOK_URL = os.environ.get("BOT_WEBHOOK_URL")
+    WEBHOOK_LISTEN = os.environ.get("BOT_WEBHOOK_LISTEN", "127.0.0.1")
+    WEBHOOK_PORT = int(os.environ.get("BOT_WEBHOOK_PORT", "8443"))
+    WEBHOOK_SECRET = os.environ.get("BOT_WEBHOOK_SECRET")
+    # Число одновременно обрабатываемых обновлений (в режиме webhook)
+    BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "16"))
+    # Показ вопросов: 'edit' (в одном сообщении) или 'messages' (отдельными сообщениями)
+    QUESTION_FLOW = os.environ.get("BOT_QUESTION_FLOW", "edit")
+    # Ключ подписи callback_data кнопок ответа (по умолчанию выводится из токена)
+    CALLBACK_SECRET = os.environ.get("BOT_CALLBACK_SECRET")
+    
     if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
         print("Пожалуйста, установите ваш Telegram Bot Token в переменной BOT_TOKEN")
         print("Получите токен у @BotFather в Telegram")
     else:
-        bot = TestBot(BOT_TOKEN)
-        print("Бот запущен...")
-        bot.run()
\ No newline at end of file
+        bot = TestBot(
+            BOT_TOKEN, workers=BOT_WORKERS if WEBHOOK_URL else 1,
+            question_flow=QUESTION_FLOW, callback_secret=CALLBACK_SECRET
+        )
+        print("Бот запущен..." if not WEBHOOK_URL else f"Бот запущен (webhook {WEBHOOK_URL})...")
+        bot.run(WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET)
\ No newline at end of file
@@ -0,0 +1,64 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+
+# callback_data кнопок ответа: префикс + base64 от (полезная нагрузка + MAC)
+ANSWER_PREFIX = "a:"
+CODEC_VERSION = 1
+
+# версия формата, session_id, номер вопроса в тесте, номер варианта
+_PAYLOAD = struct.Struct('>BIHB')
+_USER_ID = struct.Struct('>q')
+MAC_SIZE = 8
+ENCODED_LENGTH = len(ANSWER_PREFIX) + len(base64.urlsafe_b64encode(bytes(_PAYLOAD.size + MAC_SIZE)).rstrip(b'='))
+
+class AnswerCallbackCodec:
+    """Компактная подписанная callback_data для кнопок ответа
+    
+    Кнопка кодируется строкой фиксированной длины (24 байта при лимите Telegram
+    в 64). MAC - усеченный keyed BLAKE2b по полезной нагрузке и user_id
+    получателя, поэтому ответ за чужую сессию или с подмененным номером
+    варианта не подделать. Разбор не зависит от содержимого строки:
+    проверка длины, декодирование и сравнение MAC через compare_digest.
+    """
+    
+    def __init__(self, secret):
+        if isinstance(secret, str):
+            secret = secret.encode()
+        self._key = hashlib.sha256(b"answer-callback:" + secret).digest()
+    
+    def _mac(self, payload, user_id):
+        return hashlib.blake2b(
+            payload + _USER_ID.pack(user_id), key=self._key, digest_size=MAC_SIZE
+        ).digest()
+    
+    def encode(self, user_id, session_id, ordinal, option_index):
+        payload = _PAYLOAD.pack(CODEC_VERSION, session_id, ordinal, option_index)
+        raw = payload + self._mac(payload, user_id)
+        return ANSWER_PREFIX + base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+    
+    def encode_options(self, user_id, session_id, ordinal, count):
+        """callback_data для всех вариантов ответа на вопрос"""
+        return [self.encode(user_id, session_id, ordinal, idx) for idx in range(count)]
+    
+    def decode(self, user_id, data):
+        """Вернуть (session_id, ordinal, option_index) или None для битых и подделанных данных"""
+        if len(data) != ENCODED_LENGTH or not data.startswith(ANSWER_PREFIX):
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(data[len(ANSWER_PREFIX):] + '==')
+        except (binascii.Error, ValueError):
+            return None
+        if len(raw) != _PAYLOAD.size + MAC_SIZE:
+            return None
+        
+        payload, mac = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+        if not hmac.compare_digest(mac, self._mac(payload, user_id)):
+            return None
+        
+        version, session_id, ordinal, option_index = _PAYLOAD.unpack(payload)
+        if version != CODEC_VERSION:
+            return None
+        return session_id, ordinal, option_index
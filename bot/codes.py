@@ -0,0 +1,97 @@
+import time
+from array import array
+from bisect import bisect_left, insort
+
+class CodeFilter:
+    """Множество действующих (непогашенных) кодов в памяти
+    
+    Хранит отсортированный компактный массив 64-битных хэшей кодов: проверка -
+    двоичный поиск, без обращения к SQLite. Ложноположительный ответ (код
+    погашен в админке, тест выключен, коллизия хэша) безопасен - его отсеет
+    запрос к БД; ложноотрицательных быть не должно, поэтому новые коды
+    дочитываются по code_id (refresh), а полная пересборка выполняется
+    периодически, при старте и при смене поколения сброса кодов (generation):
+    после "очистить данные" в админке погашенные коды снова действуют.
+    """
+    
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self.last_code_id = 0
+        self.generation = 0
+        self._hashes = array('q')
+        self._last_refresh = 0.0
+    
+    def __len__(self):
+        return len(self._hashes)
+    
+    def __contains__(self, code):
+        h = hash(code)
+        i = bisect_left(self._hashes, h)
+        return i < len(self._hashes) and self._hashes[i] == h
+    
+    def load(self, rows, generation=0):
+        """Пересобрать фильтр по строкам (code_id, code, is_used)"""
+        self.generation = generation
+        self._hashes = array('q')
+        self.last_code_id = 0
+        self.add(rows)
+    
+    def add(self, rows):
+        """Добавить новые коды (строки (code_id, code, is_used) после last_code_id)"""
+        new = [hash(code) for _, code, is_used in rows if not is_used]
+        if rows:
+            # Строки упорядочены по code_id
+            self.last_code_id = max(self.last_code_id, rows[-1][0])
+        
+        if len(new) > 1000:
+            self._hashes = array('q', sorted(self._hashes.tolist() + new))
+        else:
+            for h in new:
+                insort(self._hashes, h)
+        self._last_refresh = time.monotonic()
+        return len(new)
+    
+    def discard(self, code):
+        """Убрать погашенный код"""
+        h = hash(code)
+        i = bisect_left(self._hashes, h)
+        if i < len(self._hashes) and self._hashes[i] == h:
+            del self._hashes[i]
+    
+    def refresh_due(self):
+        """Пора ли дочитать коды, созданные после последнего обновления"""
+        return time.monotonic() - self._last_refresh >= self.refresh_interval
+
+class AttemptThrottle:
+    """Ограничение неудачных попыток ввода кода (token bucket на пользователя)
+    
+    У каждого пользователя capacity попыток; каждая неудачная тратит одну,
+    восстанавливается refill_rate попыток в секунду.
+    """
+    
+    def __init__(self, capacity=5, refill_rate=1 / 30, max_users=100000):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_users = max_users
+        # user_id -> (токены, время последнего обновления)
+        self._buckets = {}
+    
+    def _tokens(self, user_id, now):
+        tokens, updated = self._buckets.get(user_id, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.refill_rate)
+    
+    def allow(self, user_id):
+        """Есть ли у пользователя право на попытку"""
+        return self._tokens(user_id, time.monotonic()) >= 1
+    
+    def fail(self, user_id):
+        """Учесть неудачную попытку"""
+        now = time.monotonic()
+        self._buckets[user_id] = (max(self._tokens(user_id, now) - 1, 0), now)
+        if len(self._buckets) > self.max_users:
+            self._forget_full(now)
+    
+    def _forget_full(self, now):
+        # Полностью восстановившиеся корзины не отличаются от отсутствующих
+        for user_id in [u for u in self._buckets if self._tokens(u, now) >= self.capacity]:
+            del self._buckets[user_id]
@@ -1,20 +1,475 @@
 import sqlite3
 import os
+import asyncio
+import functools
 import logging
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
+# Настройки хранилища SQLite (можно переопределить через storage_config)
+DEFAULT_STORAGE_CONFIG = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,          # отрицательное значение - размер в КиБ
+    'mmap_size': 64 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,          # мс ожидания снятия блокировки
+    'wal_autocheckpoint': 1000,    # страниц WAL до автоматического checkpoint
+    'checkpoint_interval': 30,     # секунд между фоновыми checkpoint, 0 - отключить
+    'answer_flush_interval': 0.005, # секунд накопления пакета ответов
+    'answer_batch_size': 256,      # ответов в пакете, после которых запись не ждет таймера
+    'answer_durability': 'commit', # 'commit' - ответ подтверждается после фиксации пакета,
+                                   # 'buffered' - сразу (при сбое теряется последний пакет)
+    'registration_flush_interval': 0.05  # секунд накопления пакета регистраций пользователей
+}
+
+def writes(method):
+    """Пометить метод DatabaseManager как запись: AsyncDatabaseManager выполнит его в потоке-писателе"""
+    method.writes = True
+    return method
+
+# Неизменяемое содержимое теста: один экземпляр на ревизию разделяется всеми сессиями
+Question = namedtuple('Question', ['question_id', 'text', 'question_order', 'options'])
+Option = namedtuple('Option', ['option_id', 'text', 'is_correct'])
+
+class TestContent:
+    """Вопросы теста в ревизии revision (кортеж Question с кортежами Option)
+    
+    При загрузке правильные варианты компилируются в ключ ответов: для каждого
+    вопроса битовая маска индексов вариантов с is_correct (их может быть несколько).
+    views заполняет бот: готовые тексты и кнопки вопросов для этой ревизии.
+    """
+    
+    __slots__ = ('test_id', 'revision', 'questions', 'answer_key', 'views')
+    
+    def __init__(self, test_id, revision, questions):
+        self.test_id = test_id
+        self.revision = revision
+        self.questions = tuple(questions)
+        self.answer_key = tuple(
+            sum(1 << idx for idx, option in enumerate(question.options) if option.is_correct)
+            for question in self.questions
+        )
+        self.views = None
+    
+    def __len__(self):
+        return len(self.questions)
+    
+    def score(self, answers):
+        """Посчитать число правильных ответов
+        
+        answers - индексы выбранных вариантов по порядку вопросов (отрицательный
+        индекс - вопрос без ответа).
+        """
+        return sum(
+            (mask >> answer) & 1
+            for mask, answer in zip(self.answer_key, answers)
+            if answer >= 0
+        )
+
+class TestContentCache:
+    """Ограниченный LRU-кэш вопросов с вариантами ответов по test_id
+    
+    Запись считается актуальной, пока совпадает ревизия содержимого теста
+    (tests.content_revision), которую админка увеличивает при каждом изменении.
+    """
+    
+    def __init__(self, max_tests=128):
+        self.max_tests = max_tests
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, test_id, revision):
+        with self._lock:
+            entry = self._entries.get(test_id)
+            if entry is not None and entry[0] == revision:
+                self._entries.move_to_end(test_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+    
+    def put(self, test_id, revision, content):
+        with self._lock:
+            self._entries[test_id] = (revision, content)
+            self._entries.move_to_end(test_id)
+            while len(self._entries) > self.max_tests:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, test_id=None):
+        with self._lock:
+            if test_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(test_id, None)
+    
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hit_rate, 4)
+        }
+
+class UserCache:
+    """Ограниченный LRU-кэш зарегистрированных пользователей: user_id -> принято ли соглашение
+    
+    Заполняется лениво при проверке соглашения и обновляется accept_consent,
+    поэтому вернувшийся пользователь проверяется без обращения к БД.
+    """
+    
+    def __init__(self, max_users=100000):
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._entries
+    
+    def get(self, user_id):
+        """Флаг соглашения или None, если пользователя нет в кэше"""
+        with self._lock:
+            consent = self._entries.get(user_id)
+            if consent is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return consent
+    
+    def put(self, user_id, consent):
+        with self._lock:
+            self._entries[user_id] = consent
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+class WriteBehindQueue:
+    """Отложенная запись строк одним INSERT с групповой фиксацией
+    
+    Строки копятся в очереди и записываются фоновым потоком пакетами до
+    batch_size строк, по одной транзакции на пакет. Если строки подтверждаются
+    после фиксации (durable), пакет - все, что пришло, пока писался предыдущий:
+    ждать таймера нет смысла, отправители сами ждут записи. В буферизованном
+    режиме пакет дополнительно копится до flush_interval секунд с первой строки.
+    put возвращает Future, который завершается после фиксации пакета.
+    """
+    
+    def __init__(self, db, db_path, sql, flush_interval=0.005, batch_size=256, durable=True,
+                 name="write-behind"):
+        self.db = db
+        self.db_path = db_path
+        self.sql = sql
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.durable = durable
+        self._queue = queue.Queue()
+        self._closed = False
+        self.rows_written = 0
+        self.batches_written = 0
+        
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def put(self, row):
+        """Поставить строку в очередь на запись"""
+        future = Future()
+        self._queue.put((row, future))
+        return future
+    
+    def flush(self):
+        """Дождаться записи всех строк, поставленных до вызова"""
+        if not self._thread.is_alive():
+            return
+        future = Future()
+        self._queue.put((None, future))
+        future.result()
+    
+    def close(self):
+        """Записать оставшиеся строки и остановить фоновый поток"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + (0 if self.durable else self.flush_interval)
+            # Метка flush() завершает пакет: вызывающий ждет записи, а не таймера
+            while len(batch) < self.batch_size and batch[-1][0] is not None:
+                try:
+                    timeout = deadline - time.monotonic()
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            self._write(batch)
+            if stop:
+                return
+    
+    def _write(self, batch):
+        rows = [row for row, _ in batch if row is not None]
+        try:
+            if rows:
+                with self.db._connection(self.db_path) as conn:
+                    conn.executemany(self.sql, rows)
+        except Exception as e:
+            logging.error(f"Не удалось записать пакет ({self._thread.name}, {len(rows)} строк): {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        
+        self.rows_written += len(rows)
+        self.batches_written += 1 if rows else 0
+        for _, future in batch:
+            future.set_result(None)
+
+class AnswerJournal(WriteBehindQueue):
+    """Журнал ответов: отложенная запись в session_answers"""
+    
+    def __init__(self, db, flush_interval=0.005, batch_size=256, durable=True):
+        super().__init__(db, db.users_db, """
+            INSERT INTO session_answers
+                (session_id, question_id, question_index, answer_index, answered_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, flush_interval, batch_size, durable, name="answer-journal")
+    
+    def append(self, session_id, question_id, question_index, answer_index):
+        """Поставить ответ в очередь на запись"""
+        return self.put((session_id, question_id, question_index, answer_index, datetime.now()))
+
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, pool_size=5, statement_cache_size=128, storage_config=None,
+                 content_cache_size=128, user_cache_size=100000):
         self.data_dir = "data"
         self.tests_db = os.path.join(self.data_dir, "tests.db")
         self.users_db = os.path.join(self.data_dir, "users.db")
+        
+        self.storage_config = dict(DEFAULT_STORAGE_CONFIG)
+        if storage_config:
+            self.storage_config.update(storage_config)
+        
+        # Пул долгоживущих соединений: по очереди свободных соединений на файл БД
+        self.pool_size = pool_size
+        self.statement_cache_size = statement_cache_size
+        self._pools = {
+            self.tests_db: queue.LifoQueue(maxsize=pool_size),
+            self.users_db: queue.LifoQueue(maxsize=pool_size)
+        }
+        self._local = threading.local()
+        # id соединений tests.db, к которым сейчас подключена users.db
+        self._attached = set()
+        self._stats_lock = threading.Lock()
+        self.connections_opened = 0
+        
+        self.content_cache = TestContentCache(content_cache_size)
+        self.user_cache = UserCache(user_cache_size)
+        
+        self._checkpoint_stop = threading.Event()
+        self._checkpoint_thread = None
+        
         self._init_databases()
+        self._start_checkpointer()
+        
+        config = self.storage_config
+        self.answer_journal = AnswerJournal(
+            self,
+            flush_interval=config['answer_flush_interval'],
+            batch_size=config['answer_batch_size'],
+            durable=config['answer_durability'] == 'commit'
+        )
+        # Регистрация не влияет на ответ пользователю, поэтому пишется без ожидания
+        self.user_registrations = WriteBehindQueue(self, self.users_db, """
+            INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO NOTHING
+        """, config['registration_flush_interval'], config['answer_batch_size'], durable=False,
+            name="user-registrations")
+    
+    # === ПУЛ СОЕДИНЕНИЙ ===
+    
+    def _open_connection(self, db_path):
+        """Открыть новое соединение с БД"""
+        config = self.storage_config
+        conn = sqlite3.connect(
+            db_path,
+            timeout=config['busy_timeout'] / 1000,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
+        # Настройки уровня соединения применяются к каждому новому соединению
+        conn.execute(f"PRAGMA busy_timeout = {int(config['busy_timeout'])}")
+        conn.execute(f"PRAGMA synchronous = {config['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {int(config['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(config['mmap_size'])}")
+        conn.execute(f"PRAGMA temp_store = {config['temp_store']}")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {int(config['wal_autocheckpoint'])}")
+        with self._stats_lock:
+            self.connections_opened += 1
+        return conn
+    
+    def _acquire(self, db_path):
+        """Взять свободное соединение из пула или открыть новое"""
+        try:
+            return self._pools[db_path].get_nowait()
+        except queue.Empty:
+            return self._open_connection(db_path)
+    
+    def _release(self, db_path, conn):
+        """Вернуть соединение в пул (лишние соединения закрываются)"""
+        try:
+            self._pools[db_path].put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    @contextmanager
+    def _connection(self, db_path, row_factory=None):
+        """Соединение из пула, закрепленное за текущим потоком.
+        
+        Вложенные вызовы в одном потоке (и в одном event loop бота)
+        получают то же самое соединение. По выходу из внешнего блока
+        незавершенная транзакция фиксируется (или откатывается при ошибке),
+        а соединение возвращается в пул вместе с кэшем подготовленных запросов.
+        """
+        held = getattr(self._local, 'connections', None)
+        if held is None:
+            held = self._local.connections = {}
+        
+        owner = db_path not in held
+        conn = self._acquire(db_path) if owner else held[db_path]
+        held[db_path] = conn
+        previous_factory = conn.row_factory
+        conn.row_factory = row_factory
+        try:
+            yield conn
+            if owner and conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if owner and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.row_factory = previous_factory
+            if owner:
+                del held[db_path]
+                if self._detach_users_db(conn):
+                    self._release(db_path, conn)
+    
+    def _attach_users_db(self, conn):
+        """Подключить users.db к соединению tests.db как схему users
+        
+        Подключение действует до возврата соединения в пул (см. _detach_users_db).
+        """
+        if id(conn) not in self._attached:
+            conn.execute("ATTACH DATABASE ? AS users", (self.users_db,))
+            self._attached.add(id(conn))
+    
+    def _detach_users_db(self, conn):
+        """Отключить users.db перед возвратом соединения в пул
+        
+        Иначе следующая транзакция на этом соединении (BEGIN IMMEDIATE при
+        генерации кодов, импорте) брала бы блокировку на запись и в users.db.
+        Возвращает False, если соединение пришлось закрыть.
+        """
+        if id(conn) not in self._attached:
+            return True
+        self._attached.discard(id(conn))
+        try:
+            conn.execute("DETACH DATABASE users")
+            return True
+        except sqlite3.Error as e:
+            logging.warning(f"Не удалось отключить users.db, соединение закрыто: {e}")
+            conn.close()
+            return False
+    
+    def _start_checkpointer(self):
+        """Запустить фоновый checkpoint WAL-журналов"""
+        interval = self.storage_config['checkpoint_interval']
+        if not interval or self.storage_config['journal_mode'].upper() != 'WAL':
+            return
+        
+        def run():
+            while not self._checkpoint_stop.wait(interval):
+                self.checkpoint()
+        
+        self._checkpoint_thread = threading.Thread(
+            target=run, name="sqlite-checkpoint", daemon=True
+        )
+        self._checkpoint_thread.start()
+    
+    def checkpoint(self, mode="PASSIVE"):
+        """Перенести содержимое WAL в основные файлы БД"""
+        for db_path in (self.tests_db, self.users_db):
+            try:
+                with self._connection(db_path) as conn:
+                    conn.execute(f"PRAGMA wal_checkpoint({mode})")
+            except sqlite3.Error as e:
+                logging.warning(f"Checkpoint {db_path} не выполнен: {e}")
+    
+    def close_all(self):
+        """Закрыть все свободные соединения пула"""
+        self.answer_journal.close()
+        self.user_registrations.close()
+        self._checkpoint_stop.set()
+        if self._checkpoint_thread and self._checkpoint_thread is not threading.current_thread():
+            self._checkpoint_thread.join()
+        for pool in self._pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
     
     def _init_databases(self):
         os.makedirs(self.data_dir, exist_ok=True)
         
+        # Режим журнала сохраняется в самом файле БД, достаточно установить его один раз
+        for db_path in (self.tests_db, self.users_db):
+            with self._connection(db_path) as conn:
+                conn.execute(f"PRAGMA journal_mode = {self.storage_config['journal_mode']}")
+        
         # Инициализация базы тестов
-        conn_tests = sqlite3.connect(self.tests_db)
+        with self._connection(self.tests_db) as conn_tests, \
+                self._connection(self.users_db) as conn_users:
+            self._create_schema(conn_tests, conn_users)
+    
+    def _create_schema(self, conn_tests, conn_users):
         cursor_tests = conn_tests.cursor()
         
         cursor_tests.execute("""
@@ -23,7 +478,8 @@ class DatabaseManager:
                 title TEXT NOT NULL,
                 description TEXT,
                 is_active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                content_revision INTEGER DEFAULT 0
             )
         """)
         
@@ -51,6 +507,7 @@ class DatabaseManager:
             CREATE TABLE IF NOT EXISTS personal_codes (
                 code_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 test_id INTEGER,
+                candidate_id INTEGER,
                 code TEXT UNIQUE NOT NULL,
                 is_used BOOLEAN DEFAULT 0,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -58,11 +515,53 @@ class DatabaseManager:
             )
         """)
         
+        # Сводные счетчики для дашборда админки (заполняются админкой при первом запуске)
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS test_stats (
+                test_id INTEGER PRIMARY KEY,
+                created_by INTEGER,
+                total_codes INTEGER DEFAULT 0,
+                used_codes INTEGER DEFAULT 0,
+                total_candidates INTEGER DEFAULT 0,
+                candidates_with_codes INTEGER DEFAULT 0,
+                tested_candidates INTEGER DEFAULT 0,
+                total_attempts INTEGER DEFAULT 0
+            )
+        """)
+        
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS admin_stats (
+                user_id INTEGER PRIMARY KEY,
+                total_tests INTEGER DEFAULT 0,
+                active_tests INTEGER DEFAULT 0,
+                total_codes INTEGER DEFAULT 0
+            )
+        """)
+        
+        # Счетчики кандидатов (строки заводит админка вместе с кандидатами)
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS candidate_stats (
+                candidate_id INTEGER PRIMARY KEY,
+                test_id INTEGER,
+                total_codes INTEGER DEFAULT 0,
+                used_codes INTEGER DEFAULT 0,
+                tests_taken INTEGER DEFAULT 0,
+                best_score REAL DEFAULT 0
+            )
+        """)
+        
+        # Поколение сброса кодов: растет при каждом "очистить данные", по нему
+        # бот понимает, что погашенные коды снова действуют
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS code_resets (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER DEFAULT 0
+            )
+        """)
+        
         conn_tests.commit()
-        conn_tests.close()
         
         # Инициализация базы пользователей
-        conn_users = sqlite3.connect(self.users_db)
         cursor_users = conn_users.cursor()
         
         cursor_users.execute("""
@@ -96,6 +595,7 @@ class DatabaseManager:
                 test_id INTEGER,
                 code TEXT,
                 current_question INTEGER DEFAULT 0,
+                content_revision INTEGER,
                 answers JSON TEXT,
                 started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 last_activity DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -103,377 +603,736 @@ class DatabaseManager:
             )
         """)
         
+        # Журнал ответов: строки только добавляются, последний ответ на вопрос - актуальный
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS session_answers (
+                answer_id INTEGER PRIMARY KEY,
+                session_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                question_index INTEGER NOT NULL,
+                answer_index INTEGER NOT NULL,
+                answered_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Ответы завершенных тестов по вопросам (для аналитики)
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS result_answers (
+                result_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                option_id INTEGER,
+                answered_at DATETIME,
+                PRIMARY KEY (result_id, question_id)
+            ) WITHOUT ROWID
+        """)
+        
+        # Накопительные суммы для анализа заданий (обновляются в save_result)
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS item_stats (
+                question_id INTEGER PRIMARY KEY,
+                test_id INTEGER NOT NULL,
+                responses INTEGER DEFAULT 0,
+                correct INTEGER DEFAULT 0,
+                score_sum REAL DEFAULT 0,
+                score_sq_sum REAL DEFAULT 0,
+                correct_score_sum REAL DEFAULT 0
+            )
+        """)
+        
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS option_stats (
+                option_id INTEGER PRIMARY KEY,
+                question_id INTEGER NOT NULL,
+                test_id INTEGER NOT NULL,
+                chosen INTEGER DEFAULT 0
+            )
+        """)
+        
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS global_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_users INTEGER DEFAULT 0,
+                total_results INTEGER DEFAULT 0,
+                scored_results INTEGER DEFAULT 0,
+                score_pct_sum REAL DEFAULT 0
+            )
+        """)
+        
+        self._migrate_columns(cursor_tests, cursor_users)
+        self._migrate_indexes(cursor_tests, cursor_users)
+        
+        conn_tests.commit()
         conn_users.commit()
-        conn_users.close()
+    
+    def _migrate_columns(self, cursor_tests, cursor_users):
+        """Добавить в существующие БД колонки, появившиеся после их создания"""
+        cursor_tests.execute("PRAGMA table_info(tests)")
+        if 'content_revision' not in {row[1] for row in cursor_tests.fetchall()}:
+            cursor_tests.execute("ALTER TABLE tests ADD COLUMN content_revision INTEGER DEFAULT 0")
+        
+        # Коды кандидатов выдает админка; в БД, созданной ботом, колонки могло не быть
+        cursor_tests.execute("PRAGMA table_info(personal_codes)")
+        if 'candidate_id' not in {row[1] for row in cursor_tests.fetchall()}:
+            cursor_tests.execute("ALTER TABLE personal_codes ADD COLUMN candidate_id INTEGER")
+        
+        # Сводка кандидатов теста; в старых БД ее заполняет пересборка в админке
+        cursor_tests.execute("PRAGMA table_info(test_stats)")
+        test_stats_columns = {row[1] for row in cursor_tests.fetchall()}
+        for column in ('total_candidates', 'candidates_with_codes', 'tested_candidates', 'total_attempts'):
+            if column not in test_stats_columns:
+                cursor_tests.execute(f"ALTER TABLE test_stats ADD COLUMN {column} INTEGER DEFAULT 0")
+        
+        # Средний балл считается только по результатам с вопросами; score_pct_sum
+        # их и так не включал, досчитываем лишь знаменатель
+        cursor_users.execute("PRAGMA table_info(global_stats)")
+        if 'scored_results' not in {row[1] for row in cursor_users.fetchall()}:
+            cursor_users.execute("ALTER TABLE global_stats ADD COLUMN scored_results INTEGER DEFAULT 0")
+            cursor_users.execute("""
+                UPDATE global_stats
+                SET scored_results = (SELECT COUNT(*) FROM results WHERE total_questions > 0)
+            """)
+        
+        # Ревизия содержимого, на которой начата сессия (у старых сессий - NULL)
+        cursor_users.execute("PRAGMA table_info(testing_sessions)")
+        if 'content_revision' not in {row[1] for row in cursor_users.fetchall()}:
+            cursor_users.execute("ALTER TABLE testing_sessions ADD COLUMN content_revision INTEGER")
+    
+    def _migrate_indexes(self, cursor_tests, cursor_users):
+        """Создать вторичные индексы для горячих запросов (в том числе в существующих БД)"""
+        # personal_codes.code уже покрыт UNIQUE-индексом (redeem_code, get_test_by_code)
+        # (test_id, is_used) заменен индексом (test_id, is_used, code) - его префиксом
+        cursor_tests.execute("DROP INDEX IF EXISTS idx_personal_codes_test")
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_personal_codes_test_used_code
+            ON personal_codes (test_id, is_used, code)
+        """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_questions_test
+            ON questions (test_id, question_order)
+        """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_options_question
+            ON options (question_id)
+        """)
+        
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_results_code
+            ON results (code, score, total_questions)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_testing_sessions_user
+            ON testing_sessions (user_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_session_answers_session
+            ON session_answers (session_id, question_index)
+        """)
+        # Распределение ответов по вопросу и выборки по варианту ответа
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_result_answers_question
+            ON result_answers (question_id, option_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_result_answers_option
+            ON result_answers (option_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_item_stats_test
+            ON item_stats (test_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_option_stats_test
+            ON option_stats (test_id)
+        """)
+        
+        # Обновляем статистику планировщика после создания индексов
+        cursor_tests.execute("PRAGMA optimize")
+        cursor_users.execute("PRAGMA optimize")
     
     # === МЕТОДЫ ДЛЯ ТЕСТОВ ===
     
     def get_all_tests(self):
         """Получить все тесты для админки"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM tests ORDER BY created_at DESC")
-        tests = cursor.fetchall()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM tests ORDER BY created_at DESC")
+            tests = cursor.fetchall()
         return tests
     
     def get_test_by_id(self, test_id):
         """Получить тест по ID"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM tests WHERE test_id = ?", (test_id,))
-        test = cursor.fetchone()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM tests WHERE test_id = ?", (test_id,))
+            test = cursor.fetchone()
         return test
     
+    @writes
     def create_test(self, title, description):
         """Создать новый тест"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO tests (title, description) VALUES (?, ?)",
-            (title, description)
-        )
-        test_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO tests (title, description) VALUES (?, ?)",
+                (title, description)
+            )
+            test_id = cursor.lastrowid
+            conn.commit()
         return test_id
     
+    @writes
     def update_test(self, test_id, title, description, is_active):
         """Обновить тест"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "UPDATE tests SET title = ?, description = ?, is_active = ? WHERE test_id = ?",
-            (title, description, is_active, test_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE tests SET title = ?, description = ?, is_active = ?,
+                       content_revision = content_revision + 1
+                WHERE test_id = ?
+            """, (title, description, is_active, test_id))
+            conn.commit()
     
+    @writes
     def delete_test(self, test_id):
         """Удалить тест"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM tests WHERE test_id = ?", (test_id,))
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("DELETE FROM tests WHERE test_id = ?", (test_id,))
+            conn.commit()
     
     # === МЕТОДЫ ДЛЯ ВОПРОСОВ ===
     
     def get_questions_for_test(self, test_id):
         """Получить все вопросы для теста"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM questions 
-            WHERE test_id = ? 
-            ORDER BY question_order
-        """, (test_id,))
-        questions = cursor.fetchall()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT * FROM questions 
+                WHERE test_id = ? 
+                ORDER BY question_order
+            """, (test_id,))
+            questions = cursor.fetchall()
         return questions
     
+    @writes
     def create_question(self, test_id, text, question_order):
         """Создать вопрос"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO questions (test_id, text, question_order) VALUES (?, ?, ?)",
-            (test_id, text, question_order)
-        )
-        question_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO questions (test_id, text, question_order) VALUES (?, ?, ?)",
+                (test_id, text, question_order)
+            )
+            question_id = cursor.lastrowid
+            cursor.execute(
+                "UPDATE tests SET content_revision = content_revision + 1 WHERE test_id = ?",
+                (test_id,)
+            )
+            conn.commit()
         return question_id
     
+    @writes
     def create_option(self, question_id, text, is_correct):
         """Создать вариант ответа"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO options (question_id, text, is_correct) VALUES (?, ?, ?)",
-            (question_id, text, is_correct)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO options (question_id, text, is_correct) VALUES (?, ?, ?)",
+                (question_id, text, is_correct)
+            )
+            cursor.execute("""
+                UPDATE tests SET content_revision = content_revision + 1
+                WHERE test_id = (SELECT test_id FROM questions WHERE question_id = ?)
+            """, (question_id,))
+            conn.commit()
     
     # === МЕТОДЫ ДЛЯ КОДОВ ===
     
+    @writes
     def generate_codes(self, test_id, count):
         """Сгенерировать коды для теста"""
-        import random
+        import secrets
         import string
         
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        codes = []
-        for _ in range(count):
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            cursor.execute(
-                "INSERT INTO personal_codes (test_id, code) VALUES (?, ?)",
-                (test_id, code)
-            )
-            codes.append(code)
-        
-        conn.commit()
-        conn.close()
+        alphabet = string.ascii_uppercase + string.digits
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            codes = []
+            for _ in range(count):
+                code = ''.join(secrets.choice(alphabet) for _ in range(8))
+                cursor.execute(
+                    "INSERT INTO personal_codes (test_id, code) VALUES (?, ?)",
+                    (test_id, code)
+                )
+                codes.append(code)
+            
+            self._add_test_stats(cursor, test_id, codes=len(codes))
+            conn.commit()
         return codes
     
     def get_codes_for_test(self, test_id):
         """Получить все коды для теста"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT pc.*, u.username, u.user_id, r.finished_at
-            FROM personal_codes pc
-            LEFT JOIN results r ON pc.code = r.code
-            LEFT JOIN users u ON r.user_id = u.user_id
-            WHERE pc.test_id = ?
-            ORDER BY pc.created_at DESC
-        """, (test_id,))
-        codes = cursor.fetchall()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT pc.*, u.username, u.user_id, r.finished_at
+                FROM personal_codes pc
+                LEFT JOIN results r ON pc.code = r.code
+                LEFT JOIN users u ON r.user_id = u.user_id
+                WHERE pc.test_id = ?
+                ORDER BY pc.created_at DESC
+            """, (test_id,))
+            codes = cursor.fetchall()
         return codes
     
     # === МЕТОДЫ ДЛЯ БОТА ===
     
     def get_test_by_code(self, code):
         """Получить тест по коду"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT t.test_id, t.title, t.description, pc.code
-            FROM personal_codes pc
-            JOIN tests t ON pc.test_id = t.test_id
-            WHERE pc.code = ? AND pc.is_used = 0 AND t.is_active = 1
-        """, (code,))
-        
-        result = cursor.fetchone()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT t.test_id, t.title, t.description, pc.code, t.content_revision
+                FROM personal_codes pc
+                JOIN tests t ON pc.test_id = t.test_id
+                WHERE pc.code = ? AND pc.is_used = 0 AND t.is_active = 1
+            """, (code,))
+            
+            result = cursor.fetchone()
         return result
     
-    def get_questions_with_options(self, test_id):
-        """Получить вопросы с вариантами ответов"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def get_codes_after(self, code_id=0):
+        """Коды с code_id больше заданного: (code_id, code, is_used) для фильтра кодов"""
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT code_id, code, is_used FROM personal_codes
+                WHERE code_id > ?
+                ORDER BY code_id
+            """, (code_id,))
+            return cursor.fetchall()
+    
+    def get_code_reset_generation(self):
+        """Поколение сброса кодов (меняется, когда админка снова делает коды действующими)"""
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT generation FROM code_resets WHERE id = 1")
+            result = cursor.fetchone()
+        return result[0] if result else 0
+    
+    def get_content_revision(self, test_id):
+        """Получить текущую ревизию содержимого теста"""
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT content_revision FROM tests WHERE test_id = ?", (test_id,))
+            result = cursor.fetchone()
+        return result[0] if result else None
+    
+    def get_test_content(self, test_id, revision=None):
+        """Получить неизменяемое содержимое теста (через кэш по ревизии содержимого)
         
-        cursor.execute("""
-            SELECT q.question_id, q.text, q.question_order,
-                   o.option_id, o.text as option_text, o.is_correct
-            FROM questions q
-            LEFT JOIN options o ON q.question_id = o.question_id
-            WHERE q.test_id = ?
-            ORDER BY q.question_order, o.option_id
-        """, (test_id,))
+        revision можно передать из результата redeem_code, чтобы не делать лишний запрос.
+        """
+        if revision is None:
+            revision = self.get_content_revision(test_id)
         
-        rows = cursor.fetchall()
-        conn.close()
+        content = self.content_cache.get(test_id, revision)
+        if content is None:
+            content = TestContent(test_id, revision, self._load_questions_with_options(test_id))
+            self.content_cache.put(test_id, revision, content)
+        return content
+    
+    def get_questions_with_options(self, test_id, revision=None):
+        """Получить вопросы с вариантами ответов"""
+        return self.get_test_content(test_id, revision).questions
+    
+    def _load_questions_with_options(self, test_id):
+        """Загрузить вопросы с вариантами ответов из БД"""
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT q.question_id, q.text, q.question_order,
+                       o.option_id, o.text as option_text, o.is_correct
+                FROM questions q
+                LEFT JOIN options o ON q.question_id = o.question_id
+                WHERE q.test_id = ?
+                ORDER BY q.question_order, o.option_id
+            """, (test_id,))
+            
+            rows = cursor.fetchall()
         
         # Группируем варианты по вопросам
         questions = {}
         for row in rows:
             q_id = row['question_id']
             if q_id not in questions:
-                questions[q_id] = {
-                    'question_id': q_id,
-                    'text': row['text'],
-                    'question_order': row['question_order'],
-                    'options': []
-                }
+                questions[q_id] = (row['text'], row['question_order'], [])
             if row['option_id']:
-                questions[q_id]['options'].append({
-                    'option_id': row['option_id'],
-                    'text': row['option_text'],
-                    'is_correct': row['is_correct']
-                })
+                questions[q_id][2].append(
+                    Option(row['option_id'], row['option_text'], bool(row['is_correct']))
+                )
         
-        return list(questions.values())
+        return [
+            Question(q_id, text, order, tuple(options))
+            for q_id, (text, order, options) in questions.items()
+        ]
     
     # === МЕТОДЫ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ ===
     
     def get_or_create_user(self, user_id, username, first_name):
-        """Получить или создать пользователя"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT * FROM users WHERE user_id = ?", (user_id,)
-        )
-        user = cursor.fetchone()
-        
-        if not user:
-            cursor.execute(
-                "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
-                (user_id, username, first_name)
-            )
-            conn.commit()
+        """Зарегистрировать пользователя (UPSERT через очередь отложенной записи)
         
-        conn.close()
+        Пользователь из кэша уже есть в БД - для него ничего не делается.
+        """
+        if user_id not in self.user_cache:
+            self.user_registrations.put((user_id, username, first_name))
         return True
     
+    @writes
     def accept_consent(self, user_id):
         """Принять соглашение"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
+        # Строка пользователя могла еще не дойти до БД
+        self.user_registrations.flush()
         
-        cursor.execute("""
-            UPDATE users 
-            SET consent_accepted = 1, consent_accepted_at = ?
-            WHERE user_id = ?
-        """, (datetime.now(), user_id))
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE users 
+                SET consent_accepted = 1, consent_accepted_at = ?
+                WHERE user_id = ?
+            """, (datetime.now(), user_id))
+            accepted = cursor.rowcount > 0
+            
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        if accepted:
+            self.user_cache.put(user_id, True)
     
     def has_accepted_consent(self, user_id):
         """Проверить, принял ли пользователь соглашение"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
+        consent = self.user_cache.get(user_id)
+        if consent is not None:
+            return consent
         
-        cursor.execute(
-            "SELECT consent_accepted FROM users WHERE user_id = ?", (user_id,)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "SELECT consent_accepted FROM users WHERE user_id = ?", (user_id,)
+            )
+            result = cursor.fetchone()
         
-        return result and result[0] == 1
+        # В кэш попадают только пользователи, уже записанные в БД
+        if result is None:
+            return False
+        consent = result[0] == 1
+        self.user_cache.put(user_id, consent)
+        return consent
     
-    def mark_code_used(self, code, user_id, test_id):
-        """Пометить код как использованный и начать сессию"""
-        # Помечаем код как использованный в tests.db
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
-        cursor_tests.execute(
-            "UPDATE personal_codes SET is_used = 1 WHERE code = ?", 
-            (code,)
-        )
-        conn_tests.commit()
-        conn_tests.close()
+    @writes
+    def redeem_code(self, code, user_id, test_id=None):
+        """Погасить код и начать сессию одной транзакцией
         
-        # Создаем сессию в users.db
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
+        users.db подключается к соединению tests.db, и под блокировкой на запись
+        условный UPDATE ... WHERE is_used = 0 решает, кто получил код: при
+        одновременной отправке одного кода сессию начнет только один пользователь.
+        Возвращает session_id, test_id, title, content_revision или None.
+        """
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            self._attach_users_db(conn)
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            cursor.execute("""
+                UPDATE personal_codes SET is_used = 1
+                WHERE code = ? AND is_used = 0
+                  AND test_id IN (SELECT test_id FROM tests WHERE is_active = 1)
+                  AND (? IS NULL OR test_id = ?)
+                RETURNING test_id, candidate_id
+            """, (code, test_id, test_id))
+            redeemed = cursor.fetchone()
+            if not redeemed:
+                conn.rollback()
+                return None
+            
+            test_id = redeemed['test_id']
+            self._add_test_stats(cursor, test_id, used=1)
+            if redeemed['candidate_id'] is not None:
+                self._add_candidate_stats(cursor, redeemed['candidate_id'], used=1)
+            
+            cursor.execute("""
+                INSERT INTO users.testing_sessions (user_id, test_id, code, content_revision, started_at)
+                VALUES (?, ?, ?, (SELECT content_revision FROM tests WHERE test_id = ?), ?)
+            """, (user_id, test_id, code, test_id, datetime.now()))
+            session_id = cursor.lastrowid
+            
+            cursor.execute(
+                "SELECT title, content_revision FROM tests WHERE test_id = ?", (test_id,)
+            )
+            test = cursor.fetchone()
+            conn.commit()
         
-        cursor_users.execute("""
-            INSERT INTO testing_sessions (user_id, test_id, code, started_at)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, test_id, code, datetime.now()))
+        return {
+            'session_id': session_id,
+            'test_id': test_id,
+            'title': test['title'],
+            'content_revision': test['content_revision']
+        }
+    
+    @writes
+    def mark_code_used(self, code, user_id, test_id):
+        """Пометить код как использованный и начать сессию (см. redeem_code)"""
+        redemption = self.redeem_code(code, user_id, test_id)
+        return redemption['session_id'] if redemption else None
+    
+    def save_answer(self, session_id, question_id, answer_index, question_index=0):
+        """Сохранить ответ пользователя через журнал ответов
         
-        session_id = cursor_users.lastrowid
-        conn_users.commit()
-        conn_users.close()
+        Ответ попадает в очередь и записывается пакетом вместе с ответами других
+        пользователей. При answer_durability = 'commit' вызов ждет фиксации пакета.
+        """
+        future = self.answer_journal.append(session_id, question_id, question_index, answer_index)
+        if self.answer_journal.durable:
+            future.result()
+        return future
+    
+    def get_active_session(self, user_id):
+        """Получить последнюю незавершенную сессию пользователя"""
+        with self._connection(self.users_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT session_id, test_id, code, current_question, content_revision, answers
+                FROM testing_sessions
+                WHERE user_id = ?
+                ORDER BY session_id DESC
+                LIMIT 1
+            """, (user_id,))
+            
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            session = dict(row)
+            # Ответы из JSON - сессии, начатые до появления журнала ответов
+            answers = json.loads(session['answers']) if session['answers'] else {}
+            next_question = session['current_question'] or 0
+            
+            cursor.execute("""
+                SELECT question_id, question_index, answer_index FROM session_answers
+                WHERE session_id = ?
+                ORDER BY answer_id
+            """, (session['session_id'],))
+            for answer in cursor.fetchall():
+                answers[str(answer['question_id'])] = answer['answer_index']
+                next_question = max(next_question, answer['question_index'] + 1)
         
-        return session_id
+        session['answers'] = answers
+        session['current_question'] = next_question
+        return session
     
-    def save_answer(self, session_id, question_id, answer_index):
-        """Сохранить ответ пользователя"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
+    @writes
+    def save_result(self, session_id, score, total_questions, answers=None):
+        """Сохранить результат теста
         
-        # Получаем текущие ответы
-        cursor.execute(
-            "SELECT answers FROM testing_sessions WHERE session_id = ?", 
-            (session_id,)
-        )
-        result = cursor.fetchone()
+        answers - тройки (question_id, option_id, is_correct) выбранных вариантов,
+        сохраняются в result_answers и в накопительную статистику заданий.
+        Счетчики кандидата (candidate_stats в tests.db) меняются в той же
+        транзакции, поэтому users.db подключается к соединению tests.db.
+        Возвращает result_id.
+        """
+        result_id = None
+        # Ответы сессии из журнала должны быть записаны до удаления сессии
+        self.answer_journal.flush()
         
-        answers = {}
-        if result and result[0]:
-            import json
-            answers = json.loads(result[0])
+        with self._connection(self.tests_db) as conn:
+            self._attach_users_db(conn)
+            cursor = conn.cursor()
+            
+            # Получаем данные сессии
+            cursor.execute("""
+                SELECT user_id, test_id, code FROM users.testing_sessions 
+                WHERE session_id = ?
+            """, (session_id,))
+            session = cursor.fetchone()
+            
+            if session:
+                user_id, test_id, code = session
+                score_pct = score * 100.0 / total_questions if total_questions else 0
+                
+                # Сохраняем результат
+                cursor.execute("""
+                    INSERT INTO users.results (user_id, test_id, code, score, total_questions)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (user_id, test_id, code, score, total_questions))
+                result_id = cursor.lastrowid
+                self._add_global_stats(
+                    cursor, results=1, scored=1 if total_questions else 0, score_pct=score_pct
+                )
+                
+                cursor.execute("SELECT candidate_id FROM personal_codes WHERE code = ?", (code,))
+                candidate = cursor.fetchone()
+                if candidate and candidate[0] is not None:
+                    self._add_candidate_stats(cursor, candidate[0], taken=1, score_pct=score_pct)
+                
+                if answers:
+                    # Время ответа берем из журнала ответов сессии
+                    cursor.execute("""
+                        INSERT OR REPLACE INTO users.result_answers (result_id, question_id, option_id, answered_at)
+                        SELECT ?, json_extract(a.value, '$[0]'), json_extract(a.value, '$[1]'),
+                               COALESCE((
+                                   SELECT MAX(sa.answered_at) FROM users.session_answers sa
+                                   WHERE sa.session_id = ?
+                                     AND sa.question_id = json_extract(a.value, '$[0]')
+                               ), ?)
+                        FROM json_each(?) a
+                    """, (result_id, session_id, datetime.now(), json.dumps(list(answers))))
+                    self._update_item_statistics(cursor, test_id, score / total_questions, answers)
+                
+                # Удаляем сессию
+                cursor.execute(
+                    "DELETE FROM users.testing_sessions WHERE session_id = ?", 
+                    (session_id,)
+                )
+                cursor.execute(
+                    "DELETE FROM users.session_answers WHERE session_id = ?", 
+                    (session_id,)
+                )
+            
+            conn.commit()
         
-        answers[str(question_id)] = answer_index
+        return result_id
+    
+    def _update_item_statistics(self, cursor, test_id, score_ratio, answers):
+        """Добавить ответы одного результата в накопительную статистику заданий"""
+        answers_json = json.dumps([[q_id, o_id, int(bool(ok))] for q_id, o_id, ok in answers])
         
         cursor.execute("""
-            UPDATE testing_sessions 
-            SET answers = ?, last_activity = ?, current_question = ?
-            WHERE session_id = ?
-        """, (json.dumps(answers), datetime.now(), question_id, session_id))
+            INSERT INTO item_stats
+                (question_id, test_id, responses, correct, score_sum, score_sq_sum, correct_score_sum)
+            SELECT json_extract(value, '$[0]'), ?, 1, json_extract(value, '$[2]'),
+                   ?, ?, ? * json_extract(value, '$[2]')
+            FROM json_each(?) WHERE 1
+            ON CONFLICT (question_id) DO UPDATE SET
+                responses = responses + 1,
+                correct = correct + excluded.correct,
+                score_sum = score_sum + excluded.score_sum,
+                score_sq_sum = score_sq_sum + excluded.score_sq_sum,
+                correct_score_sum = correct_score_sum + excluded.correct_score_sum
+        """, (test_id, score_ratio, score_ratio * score_ratio, score_ratio, answers_json))
         
-        conn.commit()
-        conn.close()
+        cursor.execute("""
+            INSERT INTO option_stats (option_id, question_id, test_id, chosen)
+            SELECT json_extract(value, '$[1]'), json_extract(value, '$[0]'), ?, 1
+            FROM json_each(?) WHERE 1
+            ON CONFLICT (option_id) DO UPDATE SET chosen = chosen + 1
+        """, (test_id, answers_json))
     
-    def save_result(self, session_id, score, total_questions):
-        """Сохранить результат теста"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
+    # === МЕТОДЫ ДЛЯ СТАТИСТИКИ ===
+    
+    def _add_test_stats(self, cursor, test_id, codes=0, used=0):
+        """Изменить счетчики кодов теста и его автора в текущей транзакции"""
+        cursor.execute("""
+            UPDATE test_stats
+            SET total_codes = total_codes + ?, used_codes = used_codes + ?
+            WHERE test_id = ?
+            RETURNING created_by, total_codes
+        """, (codes, used, test_id))
+        stats = cursor.fetchone()
+        if not codes or not stats or stats[0] is None:
+            return
         
-        # Получаем данные сессии
+        # Тест становится активным, когда у него появляется первый код
+        became_active = (1 if stats[1] > 0 else 0) - (1 if stats[1] - codes > 0 else 0)
         cursor.execute("""
-            SELECT user_id, test_id, code FROM testing_sessions 
-            WHERE session_id = ?
-        """, (session_id,))
-        session = cursor.fetchone()
+            UPDATE admin_stats
+            SET total_codes = total_codes + ?, active_tests = active_tests + ?
+            WHERE user_id = ?
+        """, (codes, became_active, stats[0]))
+    
+    def _add_candidate_stats(self, cursor, candidate_id, codes=0, used=0, taken=0, score_pct=0):
+        """Изменить счетчики кандидата и сводку кандидатов его теста в текущей транзакции
         
-        if session:
-            user_id, test_id, code = session
-            
-            # Сохраняем результат
-            cursor.execute("""
-                INSERT INTO results (user_id, test_id, code, score, total_questions)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, test_id, code, score, total_questions))
-            
-            # Удаляем сессию
-            cursor.execute(
-                "DELETE FROM testing_sessions WHERE session_id = ?", 
-                (session_id,)
-            )
+        taken - новые попытки, score_pct - результат попытки в процентах (лучший сохраняется).
+        """
+        cursor.execute("""
+            UPDATE candidate_stats
+            SET total_codes = total_codes + ?, used_codes = used_codes + ?,
+                tests_taken = tests_taken + ?, best_score = MAX(best_score, ?)
+            WHERE candidate_id = ?
+            RETURNING test_id, total_codes, tests_taken
+        """, (codes, used, taken, score_pct, candidate_id))
+        stats = cursor.fetchone()
+        if not stats:
+            return
         
-        conn.commit()
-        conn.close()
+        # Кандидат попадает в "с кодами" и "прошедшие" с первым кодом и первой попыткой
+        test_id, total_codes, tests_taken = stats
+        cursor.execute("""
+            UPDATE test_stats
+            SET candidates_with_codes = candidates_with_codes + ?,
+                tested_candidates = tested_candidates + ?,
+                total_attempts = total_attempts + ?
+            WHERE test_id = ?
+        """, (1 if codes and total_codes == codes else 0,
+              1 if taken and tests_taken == taken else 0, taken, test_id))
     
-    # === МЕТОДЫ ДЛЯ СТАТИСТИКИ ===
+    def _add_global_stats(self, cursor, users=0, results=0, scored=0, score_pct=0):
+        """Изменить общие счетчики в текущей транзакции
+        
+        scored - результаты с вопросами (total_questions > 0): только они входят в средний балл.
+        """
+        cursor.execute("""
+            UPDATE global_stats
+            SET total_users = total_users + ?,
+                total_results = total_results + ?,
+                scored_results = scored_results + ?,
+                score_pct_sum = score_pct_sum + ?
+            WHERE id = 1
+        """, (users, results, scored, score_pct))
     
     def get_statistics(self):
         """Получить статистику для админки"""
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
-        
-        # Общая статистика
-        cursor_users.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor_users.fetchone()[0]
-        
-        cursor_users.execute("SELECT COUNT(*) FROM results")
-        total_tests_taken = cursor_users.fetchone()[0]
-        
-        cursor_users.execute("SELECT AVG(score * 100.0 / total_questions) FROM results")
-        avg_score = cursor_users.fetchone()[0] or 0
+        with self._connection(self.users_db) as conn_users:
+            cursor_users = conn_users.cursor()
+            
+            # Общая статистика
+            cursor_users.execute("SELECT COUNT(*) FROM users")
+            total_users = cursor_users.fetchone()[0]
+            
+            cursor_users.execute("SELECT COUNT(*) FROM results")
+            total_tests_taken = cursor_users.fetchone()[0]
+            
+            cursor_users.execute("SELECT AVG(score * 100.0 / total_questions) FROM results")
+            avg_score = cursor_users.fetchone()[0] or 0
         
         # Статистика по тестам
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
-        
-        cursor_tests.execute("""
-            SELECT t.test_id, t.title, 
-                   COUNT(pc.code) as total_codes,
-                   SUM(CASE WHEN pc.is_used = 1 THEN 1 ELSE 0 END) as used_codes
-            FROM tests t
-            LEFT JOIN personal_codes pc ON t.test_id = pc.test_id
-            GROUP BY t.test_id, t.title
-        """)
-        
-        tests_stats = cursor_tests.fetchall()
-        
-        conn_users.close()
-        conn_tests.close()
+        with self._connection(self.tests_db) as conn_tests:
+            cursor_tests = conn_tests.cursor()
+            
+            cursor_tests.execute("""
+                SELECT t.test_id, t.title, 
+                       COUNT(pc.code) as total_codes,
+                       SUM(CASE WHEN pc.is_used = 1 THEN 1 ELSE 0 END) as used_codes
+                FROM tests t
+                LEFT JOIN personal_codes pc ON t.test_id = pc.test_id
+                GROUP BY t.test_id, t.title
+            """)
+            
+            tests_stats = cursor_tests.fetchall()
         
         return {
             'total_users': total_users,
@@ -484,28 +1343,101 @@ class DatabaseManager:
     
     # === МЕТОДЫ ДЛЯ ОЧИСТКИ ===
     
+    @writes
     def clear_user_data(self):
         """Очистить все пользовательские данные"""
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
-        
-        # Очищаем все таблицы пользовательских данных
-        cursor_users.execute("DELETE FROM results")
-        cursor_users.execute("DELETE FROM testing_sessions")
-        cursor_users.execute("DELETE FROM users")
+        self.user_registrations.flush()
         
-        # Сбрасываем автоинкремент
-        cursor_users.execute("DELETE FROM sqlite_sequence WHERE name IN ('results', 'testing_sessions', 'users')")
+        with self._connection(self.users_db) as conn_users:
+            cursor_users = conn_users.cursor()
+            
+            # Очищаем все таблицы пользовательских данных
+            cursor_users.execute("DELETE FROM results")
+            cursor_users.execute("DELETE FROM testing_sessions")
+            cursor_users.execute("DELETE FROM session_answers")
+            cursor_users.execute("DELETE FROM result_answers")
+            cursor_users.execute("DELETE FROM item_stats")
+            cursor_users.execute("DELETE FROM option_stats")
+            cursor_users.execute("UPDATE global_stats SET total_users = 0, total_results = 0, scored_results = 0, score_pct_sum = 0")
+            cursor_users.execute("DELETE FROM users")
+            
+            # Сбрасываем автоинкремент
+            cursor_users.execute("DELETE FROM sqlite_sequence WHERE name IN ('results', 'testing_sessions', 'users')")
+            
+            conn_users.commit()
         
-        conn_users.commit()
-        conn_users.close()
+        self.user_cache.clear()
         
         # Сбрасываем коды в tests.db
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
+        with self._connection(self.tests_db) as conn_tests:
+            cursor_tests = conn_tests.cursor()
+            
+            cursor_tests.execute("UPDATE personal_codes SET is_used = 0")
+            cursor_tests.execute("UPDATE test_stats SET used_codes = 0, tested_candidates = 0, total_attempts = 0")
+            cursor_tests.execute("UPDATE candidate_stats SET used_codes = 0, tests_taken = 0, best_score = 0")
+            cursor_tests.execute("""
+                INSERT INTO code_resets (id, generation) VALUES (1, 1)
+                ON CONFLICT(id) DO UPDATE SET generation = generation + 1
+            """)
+            conn_tests.commit()
         
-        cursor_tests.execute("UPDATE personal_codes SET is_used = 0")
-        conn_tests.commit()
-        conn_tests.close()
+        return True
+
+
+class AsyncDatabaseManager:
+    """Асинхронная обертка над DatabaseManager для бота
+    
+    Синхронные вызовы SQLite выполняются вне event loop: чтения - в ограниченном
+    пуле потоков, записи - в единственном потоке-писателе (записи в SQLite все
+    равно сериализуются, а один писатель не ждет busy_timeout на блокировках).
+    Любой публичный метод DatabaseManager доступен как корутина с тем же именем;
+    в поток-писатель уходят методы, помеченные @writes.
+    """
+    
+    def __init__(self, db, read_workers=4):
+        self.db = db
+        self._reader = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-read")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+    
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if name.startswith('_') or not callable(method):
+            return method
+        
+        executor = self._writer if getattr(method, 'writes', False) else self._reader
+        
+        async def call(*args, **kwargs):
+            return await self._run(executor, method, *args, **kwargs)
         
-        return True
\ No newline at end of file
+        call.__name__ = name
+        return call
+    
+    async def _run(self, executor, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(method, *args, **kwargs))
+    
+    async def get_or_create_user(self, user_id, username, first_name):
+        """Зарегистрировать пользователя: проверка кэша и постановка в очередь не блокируют"""
+        return self.db.get_or_create_user(user_id, username, first_name)
+    
+    async def has_accepted_consent(self, user_id):
+        """Проверить соглашение; для пользователя из кэша - без перехода в пул потоков"""
+        if user_id in self.db.user_cache:
+            return self.db.has_accepted_consent(user_id)
+        return await self._run(self._reader, self.db.has_accepted_consent, user_id)
+    
+    async def save_answer(self, session_id, question_id, answer_index, question_index=0):
+        """Поставить ответ в журнал без блокировки потока-писателя
+        
+        При answer_durability = 'commit' корутина завершается после фиксации пакета.
+        """
+        journal = self.db.answer_journal
+        future = journal.append(session_id, question_id, question_index, answer_index)
+        if journal.durable:
+            await asyncio.wrap_future(future)
+    
+    def shutdown(self):
+        """Дождаться выполнения поставленных операций и закрыть соединения"""
+        self._writer.shutdown(wait=True)
+        self._reader.shutdown(wait=True)
+        self.db.close_all()
@@ -0,0 +1,31 @@
+import threading
+from collections import Counter
+
+class BotMetrics:
+    """Счетчики работы бота
+    
+    Метрики пишутся в лог при остановке бота и доступны через snapshot().
+    api_calls_per_test считается только по тестам, пройденным целиком после
+    запуска бота: у сессий, восстановленных из БД, часть вызовов не учтена.
+    """
+    
+    def __init__(self):
+        self._counters = Counter()
+        self._lock = threading.Lock()
+    
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+    
+    def get(self, name):
+        return self._counters[name]
+    
+    def snapshot(self):
+        """Текущие значения счетчиков и производные показатели"""
+        with self._lock:
+            metrics = dict(self._counters)
+        
+        measured = metrics.get('tests_completed', 0) - metrics.get('tests_completed_restored', 0)
+        if measured:
+            metrics['api_calls_per_test'] = round(metrics.get('test_api_calls', 0) / measured, 2)
+        return metrics
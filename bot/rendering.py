@@ -0,0 +1,35 @@
+from collections import namedtuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Готовое представление вопроса: номер в тесте, текст сообщения и подписи кнопок
+QuestionView = namedtuple('QuestionView', ['ordinal', 'text', 'labels'])
+
+def compile_views(content):
+    """Собрать представления всех вопросов теста (не зависят от сессии)"""
+    total = len(content)
+    return tuple(
+        QuestionView(
+            ordinal,
+            f"Вопрос {ordinal + 1} из {total}:\n\n{question.text}",
+            tuple(option.text for option in question.options)
+        )
+        for ordinal, question in enumerate(content.questions)
+    )
+
+def question_view(content, ordinal):
+    """Представление вопроса; собирается один раз на ревизию содержимого теста
+    
+    Представления хранятся в самом TestContent, поэтому при изменении теста
+    уходят из кэша вместе с ним.
+    """
+    views = content.views
+    if views is None:
+        views = content.views = compile_views(content)
+    return views[ordinal]
+
+def question_markup(view, callback_data):
+    """Клавиатура вопроса для сессии: к готовым подписям добавляется только callback_data"""
+    return InlineKeyboardMarkup(tuple(
+        (InlineKeyboardButton(label, callback_data=data),)
+        for label, data in zip(view.labels, callback_data)
+    ))
@@ -0,0 +1,149 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+NO_ANSWER = -1
+
+class SessionContentChanged(Exception):
+    """Тест изменили после начала сессии: ответы нельзя сопоставить с новыми вопросами"""
+
+class TestSession:
+    """Компактная запись о прохождении теста
+    
+    Вопросы не копируются в сессию: content - общий неизменяемый TestContent
+    для всех, кто проходит тест в этой ревизии. Ответы хранятся массивом
+    индексов выбранных вариантов по порядковому номеру вопроса.
+    """
+    
+    __slots__ = ('session_id', 'test_id', 'revision', 'index', 'answers', 'content', 'api_calls', 'restored', 'touched')
+    
+    def __init__(self, session_id, content, index=0, answers=None, restored=False):
+        self.session_id = session_id
+        self.test_id = content.test_id
+        self.revision = content.revision
+        self.index = index
+        self.answers = answers if answers is not None else array('b', [NO_ANSWER]) * len(content)
+        self.content = content
+        # Вызовы Bot API за время прохождения (для метрик); у восстановленной
+        # из БД сессии вызовы до перезапуска не известны
+        self.api_calls = 0
+        self.restored = restored
+        # Время последнего обращения (для вытеснения брошенных сессий)
+        self.touched = time.monotonic()
+    
+    @property
+    def questions(self):
+        return self.content.questions
+    
+    def chosen_options(self):
+        """Тройки (question_id, option_id, is_correct) для вопросов, на которые дан ответ"""
+        return [
+            (question.question_id, question.options[answer].option_id, question.options[answer].is_correct)
+            for question, answer in zip(self.content.questions, self.answers)
+            if 0 <= answer < len(question.options)
+        ]
+    
+    @property
+    def current_question(self):
+        """Текущий вопрос или None, если все вопросы пройдены"""
+        if self.index < len(self.content):
+            return self.content.questions[self.index]
+        return None
+
+class SessionStore:
+    """Сессии прохождения тестов с хранением в testing_sessions
+    
+    В памяти держатся только сессии, с которыми бот работал после запуска.
+    Индекс текущего вопроса и ответы пишутся в БД при каждом ответе, поэтому
+    после перезапуска сессия восстанавливается лениво - при первом нажатии
+    кнопки пользователем, без загрузки всех сессий на старте. По той же
+    причине брошенные сессии можно вытеснять: не больше max_sessions, без
+    обращений дольше idle_timeout секунд - вернувшийся пользователь получит
+    сессию из БД.
+    """
+    
+    def __init__(self, db, max_sessions=100000, idle_timeout=6 * 3600):
+        self.db = db
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # user_id -> TestSession в порядке последнего обращения
+        self._sessions = OrderedDict()
+        self.rehydrated = 0
+        self.evicted = 0
+    
+    def __len__(self):
+        return len(self._sessions)
+    
+    def start(self, user_id, session_id, content):
+        """Зарегистрировать новую сессию (строка в БД создается redeem_code)"""
+        session = TestSession(session_id, content)
+        self._put(user_id, session)
+        return session
+    
+    async def get(self, user_id):
+        """Получить сессию пользователя, при необходимости восстановив ее из БД
+        
+        Если тест изменили после начала сессии, бросает SessionContentChanged:
+        прежняя ревизия вопросов не хранится, а сохраненные номера ответов
+        относятся к ней.
+        """
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.touched = time.monotonic()
+            self._sessions.move_to_end(user_id)
+            return session
+        
+        stored = await self.db.get_active_session(user_id)
+        if not stored:
+            return None
+        
+        content = await self.db.get_test_content(stored['test_id'])
+        if not len(content):
+            return None
+        # У сессий, начатых до сохранения ревизии, проверять нечего
+        if stored['content_revision'] is not None and stored['content_revision'] != content.revision:
+            raise SessionContentChanged(stored['session_id'])
+        
+        # Ответы в БД хранятся по question_id, в памяти - по порядку вопросов
+        answers = array('b', [NO_ANSWER]) * len(content)
+        for ordinal, question in enumerate(content.questions):
+            answer = stored['answers'].get(str(question.question_id))
+            if answer is not None:
+                answers[ordinal] = answer
+        
+        session = TestSession(
+            stored['session_id'], content, stored['current_question'] or 0, answers, restored=True
+        )
+        self._put(user_id, session)
+        self.rehydrated += 1
+        logger.info(f"Сессия {session.session_id} пользователя {user_id} восстановлена из БД")
+        return session
+    
+    async def record_answer(self, session, answer_index):
+        """Сохранить ответ на текущий вопрос и перейти к следующему"""
+        question_id = session.current_question.question_id
+        await self.db.save_answer(session.session_id, question_id, answer_index, session.index)
+        session.answers[session.index] = answer_index
+        session.index += 1
+    
+    def discard(self, user_id):
+        """Убрать завершенную сессию из памяти"""
+        self._sessions.pop(user_id, None)
+    
+    def _put(self, user_id, session):
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        self._evict(session.touched)
+    
+    def _evict(self, now):
+        """Вытеснить самые давние сессии сверх max_sessions и простаивающие дольше idle_timeout"""
+        sessions = self._sessions
+        while sessions:
+            user_id, oldest = next(iter(sessions.items()))
+            if len(sessions) <= self.max_sessions and now - oldest.touched < self.idle_timeout:
+                break
+            del sessions[user_id]
+            self.evicted += 1
@@ -2,24 +2,245 @@ import sqlite3
 import os
 import logging
 import json
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import hashlib
+import base64
 import secrets
-import random
 import string
 
+# Настройки хранилища SQLite (можно переопределить через storage_config)
+DEFAULT_STORAGE_CONFIG = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,          # отрицательное значение - размер в КиБ
+    'mmap_size': 64 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,          # мс ожидания снятия блокировки
+    'wal_autocheckpoint': 1000,    # страниц WAL до автоматического checkpoint
+    'checkpoint_interval': 30      # секунд между фоновыми checkpoint, 0 - отключить
+}
+
+# Кандидаты со счетчиками из сводной таблицы candidate_stats, без агрегации.
+# {key} - таблица, из которой берутся candidate_id и test_id: страницу отдает индекс
+# той таблицы, где лежат и поле сортировки, и ключ, и фильтр по тесту
+CANDIDATES_WITH_STATS_QUERY = """
+    SELECT {key}.candidate_id, {key}.test_id, c.full_name, c.position, c.department,
+           c.created_by, c.created_at, t.title as test_title,
+           s.total_codes, s.used_codes, s.best_score, s.tests_taken
+    FROM {tables}
+    JOIN candidate_stats s ON s.candidate_id = c.candidate_id
+"""
+CANDIDATES_TABLES = "candidates c JOIN tests t ON c.test_id = t.test_id"
+# По названию теста: тесты перебираются по индексу названия, а кандидаты сортируются
+# в пределах одного теста (CROSS JOIN фиксирует этот порядок соединения)
+CANDIDATES_BY_TEST_TABLES = "tests t CROSS JOIN candidates c ON c.test_id = t.test_id"
+
+# Пространство персональных кодов формата ABC12345
+CODE_PREFIXES = [a + b + c for a in string.ascii_uppercase
+                 for b in string.ascii_uppercase
+                 for c in string.ascii_uppercase]
+CODE_SPACE = len(CODE_PREFIXES) * 100000
+# Коды - пропуск к тесту, поэтому выбираются криптостойким генератором
+_code_random = secrets.SystemRandom()
+
+# Допустимые поля сортировки постраничных списков
+# (у каждого поля кодов есть индекс с test_id, поэтому страница не сортирует весь тест)
+CODES_SORT_FIELDS = ('created_at', 'code', 'is_used')
+CANDIDATES_SORT_FIELDS = ('created_at', 'full_name', 'position', 'department',
+                          'test_title', 'best_score', 'tests_taken', 'total_codes')
+NULLABLE_SORT_FIELDS = ('full_name', 'position', 'department')
+# Поля кандидатов, которые берутся из candidate_stats (у каждого есть индекс с test_id и без)
+CANDIDATE_STATS_SORT_FIELDS = ('best_score', 'tests_taken', 'total_codes')
+
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, pool_size=5, statement_cache_size=128, storage_config=None):
         self.data_dir = "data"
         self.tests_db = os.path.join(self.data_dir, "tests.db")
         self.users_db = os.path.join(self.data_dir, "users.db")
+        
+        self.storage_config = dict(DEFAULT_STORAGE_CONFIG)
+        if storage_config:
+            self.storage_config.update(storage_config)
+        
+        # Пул долгоживущих соединений: по очереди свободных соединений на файл БД
+        self.pool_size = pool_size
+        self.statement_cache_size = statement_cache_size
+        self._pools = {
+            self.tests_db: queue.LifoQueue(maxsize=pool_size),
+            self.users_db: queue.LifoQueue(maxsize=pool_size)
+        }
+        self._local = threading.local()
+        # id соединений tests.db, к которым сейчас подключена users.db
+        self._attached = set()
+        self._stats_lock = threading.Lock()
+        self.connections_opened = 0
+        
+        self._checkpoint_stop = threading.Event()
+        self._checkpoint_thread = None
+        
         self._init_databases()
+        self._start_checkpointer()
+    
+    # === ПУЛ СОЕДИНЕНИЙ ===
+    
+    def _open_connection(self, db_path):
+        """Открыть новое соединение с БД"""
+        config = self.storage_config
+        conn = sqlite3.connect(
+            db_path,
+            timeout=config['busy_timeout'] / 1000,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
+        # Настройки уровня соединения применяются к каждому новому соединению
+        conn.execute(f"PRAGMA busy_timeout = {int(config['busy_timeout'])}")
+        conn.execute(f"PRAGMA synchronous = {config['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {int(config['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(config['mmap_size'])}")
+        conn.execute(f"PRAGMA temp_store = {config['temp_store']}")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {int(config['wal_autocheckpoint'])}")
+        with self._stats_lock:
+            self.connections_opened += 1
+        return conn
+    
+    def _acquire(self, db_path):
+        """Взять свободное соединение из пула или открыть новое"""
+        try:
+            return self._pools[db_path].get_nowait()
+        except queue.Empty:
+            return self._open_connection(db_path)
+    
+    def _release(self, db_path, conn):
+        """Вернуть соединение в пул (лишние соединения закрываются)"""
+        try:
+            self._pools[db_path].put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    @contextmanager
+    def _connection(self, db_path, row_factory=None):
+        """Соединение из пула, закрепленное за текущим потоком.
+        
+        Вложенные вызовы в одном потоке (и в одном event loop бота)
+        получают то же самое соединение. По выходу из внешнего блока
+        незавершенная транзакция фиксируется (или откатывается при ошибке),
+        а соединение возвращается в пул вместе с кэшем подготовленных запросов.
+        """
+        held = getattr(self._local, 'connections', None)
+        if held is None:
+            held = self._local.connections = {}
+        
+        owner = db_path not in held
+        conn = self._acquire(db_path) if owner else held[db_path]
+        held[db_path] = conn
+        previous_factory = conn.row_factory
+        conn.row_factory = row_factory
+        try:
+            yield conn
+            if owner and conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if owner and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.row_factory = previous_factory
+            if owner:
+                del held[db_path]
+                if self._detach_users_db(conn):
+                    self._release(db_path, conn)
+    
+    def _attach_users_db(self, conn):
+        """Подключить users.db к соединению tests.db как схему users
+        
+        Подключение действует до возврата соединения в пул (см. _detach_users_db).
+        """
+        if id(conn) not in self._attached:
+            conn.execute("ATTACH DATABASE ? AS users", (self.users_db,))
+            self._attached.add(id(conn))
+    
+    def _detach_users_db(self, conn):
+        """Отключить users.db перед возвратом соединения в пул
+        
+        Иначе следующая транзакция на этом соединении (BEGIN IMMEDIATE при
+        генерации кодов, импорте) брала бы блокировку на запись и в users.db.
+        Возвращает False, если соединение пришлось закрыть.
+        """
+        if id(conn) not in self._attached:
+            return True
+        self._attached.discard(id(conn))
+        try:
+            conn.execute("DETACH DATABASE users")
+            return True
+        except sqlite3.Error as e:
+            logging.warning(f"Не удалось отключить users.db, соединение закрыто: {e}")
+            conn.close()
+            return False
+    
+    def _start_checkpointer(self):
+        """Запустить фоновый checkpoint WAL-журналов"""
+        interval = self.storage_config['checkpoint_interval']
+        if not interval or self.storage_config['journal_mode'].upper() != 'WAL':
+            return
+        
+        def run():
+            while not self._checkpoint_stop.wait(interval):
+                self.checkpoint()
+        
+        self._checkpoint_thread = threading.Thread(
+            target=run, name="sqlite-checkpoint", daemon=True
+        )
+        self._checkpoint_thread.start()
+    
+    def checkpoint(self, mode="PASSIVE"):
+        """Перенести содержимое WAL в основные файлы БД"""
+        for db_path in (self.tests_db, self.users_db):
+            try:
+                with self._connection(db_path) as conn:
+                    conn.execute(f"PRAGMA wal_checkpoint({mode})")
+            except sqlite3.Error as e:
+                logging.warning(f"Checkpoint {db_path} не выполнен: {e}")
+    
+    def close_all(self):
+        """Закрыть все свободные соединения пула"""
+        self._checkpoint_stop.set()
+        if self._checkpoint_thread and self._checkpoint_thread is not threading.current_thread():
+            self._checkpoint_thread.join()
+        for pool in self._pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
     
     def _init_databases(self):
         os.makedirs(self.data_dir, exist_ok=True)
         
+        # Режим журнала сохраняется в самом файле БД, достаточно установить его один раз
+        for db_path in (self.tests_db, self.users_db):
+            with self._connection(db_path) as conn:
+                conn.execute(f"PRAGMA journal_mode = {self.storage_config['journal_mode']}")
+        
         # Инициализация базы тестов
-        conn_tests = sqlite3.connect(self.tests_db)
+        with self._connection(self.tests_db) as conn_tests, \
+                self._connection(self.users_db) as conn_users:
+            self._create_schema(conn_tests, conn_users)
+        
+        # Сводная статистика заполняется по существующим данным при первом запуске
+        # (candidate_stats появилась позже остальных - ее заполняют и в старых БД)
+        with self._connection(self.users_db) as conn:
+            initialized = conn.execute("SELECT 1 FROM global_stats").fetchone()
+        with self._connection(self.tests_db) as conn:
+            candidates_missing = conn.execute("""
+                SELECT (SELECT COUNT(*) FROM candidates) != (SELECT COUNT(*) FROM candidate_stats)
+            """).fetchone()[0]
+        if not initialized or candidates_missing:
+            self.rebuild_statistics_rollups()
+    
+    def _create_schema(self, conn_tests, conn_users):
         cursor_tests = conn_tests.cursor()
         
         cursor_tests.execute("""
@@ -29,7 +250,8 @@ class DatabaseManager:
                 description TEXT,
                 is_active BOOLEAN DEFAULT 1,
                 created_by INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                content_revision INTEGER DEFAULT 0
             )
         """)
         
@@ -80,8 +302,53 @@ class DatabaseManager:
             )
         """)
         
+        # Сводные счетчики для дашборда: поддерживаются в тех же транзакциях,
+        # что и изменения данных, пересобираются rebuild_statistics_rollups
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS test_stats (
+                test_id INTEGER PRIMARY KEY,
+                created_by INTEGER,
+                total_codes INTEGER DEFAULT 0,
+                used_codes INTEGER DEFAULT 0,
+                total_candidates INTEGER DEFAULT 0,
+                candidates_with_codes INTEGER DEFAULT 0,
+                tested_candidates INTEGER DEFAULT 0,
+                total_attempts INTEGER DEFAULT 0
+            )
+        """)
+        
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS admin_stats (
+                user_id INTEGER PRIMARY KEY,
+                total_tests INTEGER DEFAULT 0,
+                active_tests INTEGER DEFAULT 0,
+                total_codes INTEGER DEFAULT 0
+            )
+        """)
+        
+        # Счетчики кандидата: строка заводится вместе с кандидатом, по ним
+        # строятся страницы и сортировки списка кандидатов
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS candidate_stats (
+                candidate_id INTEGER PRIMARY KEY,
+                test_id INTEGER,
+                total_codes INTEGER DEFAULT 0,
+                used_codes INTEGER DEFAULT 0,
+                tests_taken INTEGER DEFAULT 0,
+                best_score REAL DEFAULT 0
+            )
+        """)
+        
+        # Поколение сброса кодов: растет при каждом "очистить данные", по нему
+        # бот понимает, что погашенные коды снова действуют
+        cursor_tests.execute("""
+            CREATE TABLE IF NOT EXISTS code_resets (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER DEFAULT 0
+            )
+        """)
+        
         # Создаем администратора по умолчанию если нет пользователей
-        conn_users = sqlite3.connect(self.users_db)
         cursor_users = conn_users.cursor()
         
         cursor_users.execute("""
@@ -128,6 +395,7 @@ class DatabaseManager:
                 test_id INTEGER,
                 code TEXT,
                 current_question INTEGER DEFAULT 0,
+                content_revision INTEGER,
                 answers TEXT,
                 started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 last_activity DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -135,6 +403,61 @@ class DatabaseManager:
             )
         """)
         
+        # Журнал ответов: строки только добавляются, последний ответ на вопрос - актуальный
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS session_answers (
+                answer_id INTEGER PRIMARY KEY,
+                session_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                question_index INTEGER NOT NULL,
+                answer_index INTEGER NOT NULL,
+                answered_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Ответы завершенных тестов по вопросам (для аналитики)
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS result_answers (
+                result_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                option_id INTEGER,
+                answered_at DATETIME,
+                PRIMARY KEY (result_id, question_id)
+            ) WITHOUT ROWID
+        """)
+        
+        # Накопительные суммы для анализа заданий (обновляются в save_result)
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS item_stats (
+                question_id INTEGER PRIMARY KEY,
+                test_id INTEGER NOT NULL,
+                responses INTEGER DEFAULT 0,
+                correct INTEGER DEFAULT 0,
+                score_sum REAL DEFAULT 0,
+                score_sq_sum REAL DEFAULT 0,
+                correct_score_sum REAL DEFAULT 0
+            )
+        """)
+        
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS option_stats (
+                option_id INTEGER PRIMARY KEY,
+                question_id INTEGER NOT NULL,
+                test_id INTEGER NOT NULL,
+                chosen INTEGER DEFAULT 0
+            )
+        """)
+        
+        cursor_users.execute("""
+            CREATE TABLE IF NOT EXISTS global_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_users INTEGER DEFAULT 0,
+                total_results INTEGER DEFAULT 0,
+                scored_results INTEGER DEFAULT 0,
+                score_pct_sum REAL DEFAULT 0
+            )
+        """)
+        
         # Создаем администратора по умолчанию
         cursor_users.execute("SELECT COUNT(*) FROM admin_users WHERE username = 'admin'")
         if cursor_users.fetchone()[0] == 0:
@@ -149,10 +472,145 @@ class DatabaseManager:
             except sqlite3.IntegrityError as e:
                 print(f"Ошибка при создании администратора: {e}")
         
+        self._migrate_columns(cursor_tests, cursor_users)
+        self._migrate_indexes(cursor_tests, cursor_users)
+        
         conn_tests.commit()
-        conn_tests.close()
         conn_users.commit()
-        conn_users.close()
+    
+    def _migrate_columns(self, cursor_tests, cursor_users):
+        """Добавить в существующие БД колонки, появившиеся после их создания"""
+        cursor_tests.execute("PRAGMA table_info(tests)")
+        if 'content_revision' not in {row[1] for row in cursor_tests.fetchall()}:
+            cursor_tests.execute("ALTER TABLE tests ADD COLUMN content_revision INTEGER DEFAULT 0")
+        
+        # Сводка кандидатов теста; в старых БД ее заполняет пересборка при запуске
+        cursor_tests.execute("PRAGMA table_info(test_stats)")
+        test_stats_columns = {row[1] for row in cursor_tests.fetchall()}
+        for column in ('total_candidates', 'candidates_with_codes', 'tested_candidates', 'total_attempts'):
+            if column not in test_stats_columns:
+                cursor_tests.execute(f"ALTER TABLE test_stats ADD COLUMN {column} INTEGER DEFAULT 0")
+        
+        # Средний балл считается только по результатам с вопросами; score_pct_sum
+        # их и так не включал, досчитываем лишь знаменатель
+        cursor_users.execute("PRAGMA table_info(global_stats)")
+        if 'scored_results' not in {row[1] for row in cursor_users.fetchall()}:
+            cursor_users.execute("ALTER TABLE global_stats ADD COLUMN scored_results INTEGER DEFAULT 0")
+            cursor_users.execute("""
+                UPDATE global_stats
+                SET scored_results = (SELECT COUNT(*) FROM results WHERE total_questions > 0)
+            """)
+        
+        # Ревизия содержимого, на которой начата сессия (у старых сессий - NULL)
+        cursor_users.execute("PRAGMA table_info(testing_sessions)")
+        if 'content_revision' not in {row[1] for row in cursor_users.fetchall()}:
+            cursor_users.execute("ALTER TABLE testing_sessions ADD COLUMN content_revision INTEGER")
+    
+    def _migrate_indexes(self, cursor_tests, cursor_users):
+        """Создать вторичные индексы для горячих запросов (в том числе в существующих БД)"""
+        # personal_codes.code уже покрыт UNIQUE-индексом (redeem_code, get_test_by_code)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_personal_codes_candidate
+            ON personal_codes (candidate_id, is_used, code)
+        """)
+        # (test_id, is_used) заменен индексом (test_id, is_used, code) - его префиксом
+        cursor_tests.execute("DROP INDEX IF EXISTS idx_personal_codes_test")
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_personal_codes_test_used_code
+            ON personal_codes (test_id, is_used, code)
+        """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_personal_codes_test_created
+            ON personal_codes (test_id, created_at)
+        """)
+        # Сортировки и фильтр по статусу в списке кодов (get_codes_page)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_personal_codes_test_code
+            ON personal_codes (test_id, code)
+        """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_personal_codes_test_used_created
+            ON personal_codes (test_id, is_used, created_at)
+        """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_candidates_test
+            ON candidates (test_id, created_at)
+        """)
+        # Страницы кандидатов: по индексу на каждое поле сортировки, общий и внутри теста
+        # (candidate_id - rowid, он входит в индекс и упорядочивает равные значения)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_candidates_created
+            ON candidates (created_at)
+        """)
+        for field in NULLABLE_SORT_FIELDS:
+            cursor_tests.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_candidates_{field}
+                ON candidates (COALESCE({field}, ''))
+            """)
+            cursor_tests.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_candidates_test_{field}
+                ON candidates (test_id, COALESCE({field}, ''))
+            """)
+        for field in CANDIDATE_STATS_SORT_FIELDS:
+            cursor_tests.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_candidate_stats_{field}
+                ON candidate_stats ({field})
+            """)
+            cursor_tests.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_candidate_stats_test_{field}
+                ON candidate_stats (test_id, {field})
+            """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_questions_test
+            ON questions (test_id, question_order)
+        """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_options_question
+            ON options (question_id)
+        """)
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tests_created_by
+            ON tests (created_by, created_at)
+        """)
+        # Страница кандидатов по названию теста сортирует только кандидатов одного теста
+        cursor_tests.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tests_title
+            ON tests (title)
+        """)
+        
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_results_code
+            ON results (code, score, total_questions)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_testing_sessions_user
+            ON testing_sessions (user_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_session_answers_session
+            ON session_answers (session_id, question_index)
+        """)
+        # Распределение ответов по вопросу и выборки по варианту ответа
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_result_answers_question
+            ON result_answers (question_id, option_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_result_answers_option
+            ON result_answers (option_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_item_stats_test
+            ON item_stats (test_id)
+        """)
+        cursor_users.execute("""
+            CREATE INDEX IF NOT EXISTS idx_option_stats_test
+            ON option_stats (test_id)
+        """)
+        
+        # Обновляем статистику планировщика после создания индексов
+        cursor_tests.execute("PRAGMA optimize")
+        cursor_users.execute("PRAGMA optimize")
     
     def _hash_password(self, password):
         """Хеширование пароля"""
@@ -162,16 +620,14 @@ class DatabaseManager:
     
     def authenticate_admin(self, username, password):
         """Аутентификация администратора"""
-        conn = sqlite3.connect(self.users_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT * FROM admin_users WHERE username = ? AND is_active = 1",
-            (username,)
-        )
-        user = cursor.fetchone()
-        conn.close()
+        with self._connection(self.users_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "SELECT * FROM admin_users WHERE username = ? AND is_active = 1",
+                (username,)
+            )
+            user = cursor.fetchone()
         
         if user:
             user_dict = dict(user)
@@ -183,61 +639,54 @@ class DatabaseManager:
     
     def create_admin_user(self, username, password, email, role="hr", current_user_id=None):
         """Создать нового администратора"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM admin_users WHERE username = ?", (username,))
-        if cursor.fetchone():
-            conn.close()
-            return False, "Пользователь с таким именем уже существует"
-        
-        password_hash = self._hash_password(password)
-        cursor.execute(
-            "INSERT INTO admin_users (username, password_hash, email, role, created_by) VALUES (?, ?, ?, ?, ?)",
-            (username, password_hash, email, role, current_user_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM admin_users WHERE username = ?", (username,))
+            if cursor.fetchone():
+                return False, "Пользователь с таким именем уже существует"
+            
+            password_hash = self._hash_password(password)
+            cursor.execute(
+                "INSERT INTO admin_users (username, password_hash, email, role, created_by) VALUES (?, ?, ?, ?, ?)",
+                (username, password_hash, email, role, current_user_id)
+            )
+            conn.commit()
         return True, "Пользователь успешно создан"
     
     def get_all_admin_users(self):
         """Получить всех администраторов"""
-        conn = sqlite3.connect(self.users_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT a1.*, a2.username as created_by_username 
-            FROM admin_users a1 
-            LEFT JOIN admin_users a2 ON a1.created_by = a2.user_id 
-            ORDER BY a1.created_at DESC
-        """)
-        users = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.users_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT a1.*, a2.username as created_by_username 
+                FROM admin_users a1 
+                LEFT JOIN admin_users a2 ON a1.created_by = a2.user_id 
+                ORDER BY a1.created_at DESC
+            """)
+            users = [dict(row) for row in cursor.fetchall()]
         return users
     
     def get_admin_user_by_id(self, user_id):
         """Получить администратора по ID"""
-        conn = sqlite3.connect(self.users_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM admin_users WHERE user_id = ?", (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with self._connection(self.users_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM admin_users WHERE user_id = ?", (user_id,))
+            user = cursor.fetchone()
         return dict(user) if user else None
     
     def update_admin_user(self, user_id, username, email, role, is_active):
         """Обновить администратора"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "UPDATE admin_users SET username = ?, email = ?, role = ?, is_active = ? WHERE user_id = ?",
-            (username, email, role, 1 if is_active else 0, user_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "UPDATE admin_users SET username = ?, email = ?, role = ?, is_active = ? WHERE user_id = ?",
+                (username, email, role, 1 if is_active else 0, user_id)
+            )
+            conn.commit()
         return True
     
     def delete_admin_user(self, user_id, current_user_id):
@@ -245,407 +694,537 @@ class DatabaseManager:
         if user_id == current_user_id:
             return False, "Нельзя удалить самого себя"
         
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM admin_users WHERE created_by = ?", (user_id,))
-        if cursor.fetchone()[0] > 0:
-            conn.close()
-            return False, "Нельзя удалить пользователя, который создал других пользователей"
-        
-        cursor.execute("DELETE FROM admin_users WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT COUNT(*) FROM admin_users WHERE created_by = ?", (user_id,))
+            if cursor.fetchone()[0] > 0:
+                return False, "Нельзя удалить пользователя, который создал других пользователей"
+            
+            cursor.execute("DELETE FROM admin_users WHERE user_id = ?", (user_id,))
+            conn.commit()
         return True, "Пользователь успешно удален"
     
     def change_password(self, user_id, new_password):
         """Изменить пароль текущего пользователя"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        password_hash = self._hash_password(new_password)
-        cursor.execute(
-            "UPDATE admin_users SET password_hash = ? WHERE user_id = ?",
-            (password_hash, user_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            password_hash = self._hash_password(new_password)
+            cursor.execute(
+                "UPDATE admin_users SET password_hash = ? WHERE user_id = ?",
+                (password_hash, user_id)
+            )
+            conn.commit()
         return True
     
     def change_user_password(self, admin_user_id, target_user_id, new_password):
         """Смена пароля другого пользователя (только для администраторов)"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        # Проверяем, что текущий пользователь - администратор
-        cursor.execute("SELECT role FROM admin_users WHERE user_id = ?", (admin_user_id,))
-        current_user = cursor.fetchone()
-        
-        if not current_user or current_user[0] != 'administrator':
-            conn.close()
-            return False, "Только администраторы могут менять пароли других пользователей"
-        
-        # Проверяем, что целевой пользователь существует
-        cursor.execute("SELECT username FROM admin_users WHERE user_id = ?", (target_user_id,))
-        target_user = cursor.fetchone()
-        
-        if not target_user:
-            conn.close()
-            return False, "Пользователь не найден"
-        
-        # Меняем пароль
-        password_hash = self._hash_password(new_password)
-        cursor.execute(
-            "UPDATE admin_users SET password_hash = ? WHERE user_id = ?",
-            (password_hash, target_user_id)
-        )
-        
-        conn.commit()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            # Проверяем, что текущий пользователь - администратор
+            cursor.execute("SELECT role FROM admin_users WHERE user_id = ?", (admin_user_id,))
+            current_user = cursor.fetchone()
+            
+            if not current_user or current_user[0] != 'administrator':
+                return False, "Только администраторы могут менять пароли других пользователей"
+            
+            # Проверяем, что целевой пользователь существует
+            cursor.execute("SELECT username FROM admin_users WHERE user_id = ?", (target_user_id,))
+            target_user = cursor.fetchone()
+            
+            if not target_user:
+                return False, "Пользователь не найден"
+            
+            # Меняем пароль
+            password_hash = self._hash_password(new_password)
+            cursor.execute(
+                "UPDATE admin_users SET password_hash = ? WHERE user_id = ?",
+                (password_hash, target_user_id)
+            )
+            
+            conn.commit()
         return True, f"Пароль для пользователя {target_user[0]} успешно изменен"
     
     # === МЕТОДЫ ДЛЯ ТЕСТОВ ===
     
     def get_all_tests(self, user_id=None):
         """Получить все тесты"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        if user_id:
-            cursor.execute("SELECT * FROM tests WHERE created_by = ? ORDER BY created_at DESC", (user_id,))
-        else:
-            cursor.execute("SELECT * FROM tests ORDER BY created_at DESC")
-        
-        tests = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            if user_id:
+                cursor.execute("SELECT * FROM tests WHERE created_by = ? ORDER BY created_at DESC", (user_id,))
+            else:
+                cursor.execute("SELECT * FROM tests ORDER BY created_at DESC")
+            
+            tests = [dict(row) for row in cursor.fetchall()]
         return tests
     
     def get_test_by_id(self, test_id):
         """Получить тест по ID"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM tests WHERE test_id = ?", (test_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM tests WHERE test_id = ?", (test_id,))
+            result = cursor.fetchone()
         return dict(result) if result else None
     
     def create_test(self, title, description, created_by):
         """Создать новый тест"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO tests (title, description, created_by) VALUES (?, ?, ?)",
-            (title, description, created_by)
-        )
-        test_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO tests (title, description, created_by) VALUES (?, ?, ?)",
+                (title, description, created_by)
+            )
+            test_id = cursor.lastrowid
+            
+            cursor.execute(
+                "INSERT INTO test_stats (test_id, created_by) VALUES (?, ?)",
+                (test_id, created_by)
+            )
+            if created_by is not None:
+                cursor.execute("""
+                    INSERT INTO admin_stats (user_id, total_tests) VALUES (?, 1)
+                    ON CONFLICT (user_id) DO UPDATE SET total_tests = total_tests + 1
+                """, (created_by,))
+            conn.commit()
         return test_id
     
     def update_test(self, test_id, title, description, is_active):
         """Обновить тест"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "UPDATE tests SET title = ?, description = ?, is_active = ? WHERE test_id = ?",
-            (title, description, 1 if is_active else 0, test_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE tests SET title = ?, description = ?, is_active = ?,
+                       content_revision = content_revision + 1
+                WHERE test_id = ?
+            """, (title, description, 1 if is_active else 0, test_id))
+            conn.commit()
     
     def delete_test(self, test_id):
         """Удалить тест"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM tests WHERE test_id = ?", (test_id,))
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("DELETE FROM tests WHERE test_id = ?", (test_id,))
+            
+            # Коды удаленного теста больше не учитываются в статистике
+            cursor.execute(
+                "DELETE FROM test_stats WHERE test_id = ? RETURNING created_by, total_codes",
+                (test_id,)
+            )
+            stats = cursor.fetchone()
+            if stats and stats[0] is not None:
+                cursor.execute("""
+                    UPDATE admin_stats
+                    SET total_tests = total_tests - 1,
+                        active_tests = active_tests - ?,
+                        total_codes = total_codes - ?
+                    WHERE user_id = ?
+                """, (1 if stats[1] > 0 else 0, stats[1], stats[0]))
+            conn.commit()
         return True
     
     # === МЕТОДЫ ДЛЯ ВОПРОСОВ ===
     
+    def _bump_content_revision(self, cursor, question_id=None, option_id=None):
+        """Увеличить ревизию содержимого теста, чтобы бот сбросил закэшированные вопросы"""
+        if option_id is not None:
+            cursor.execute("""
+                UPDATE tests SET content_revision = content_revision + 1
+                WHERE test_id = (
+                    SELECT q.test_id FROM options o
+                    JOIN questions q ON o.question_id = q.question_id
+                    WHERE o.option_id = ?
+                )
+            """, (option_id,))
+        else:
+            cursor.execute("""
+                UPDATE tests SET content_revision = content_revision + 1
+                WHERE test_id = (SELECT test_id FROM questions WHERE question_id = ?)
+            """, (question_id,))
+    
     def get_questions_for_test(self, test_id):
         """Получить все вопросы для теста"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM questions 
-            WHERE test_id = ? 
-            ORDER BY question_order
-        """, (test_id,))
-        questions = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT * FROM questions 
+                WHERE test_id = ? 
+                ORDER BY question_order
+            """, (test_id,))
+            questions = [dict(row) for row in cursor.fetchall()]
         return questions
     
     def get_question_by_id(self, question_id):
         """Получить вопрос по ID"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM questions WHERE question_id = ?", (question_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM questions WHERE question_id = ?", (question_id,))
+            result = cursor.fetchone()
         return dict(result) if result else None
     
     def create_question(self, test_id, text, question_order):
         """Создать вопрос"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO questions (test_id, text, question_order) VALUES (?, ?, ?)",
-            (test_id, text, question_order)
-        )
-        question_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO questions (test_id, text, question_order) VALUES (?, ?, ?)",
+                (test_id, text, question_order)
+            )
+            question_id = cursor.lastrowid
+            self._bump_content_revision(cursor, question_id=question_id)
+            conn.commit()
         return question_id
     
     def update_question(self, question_id, text, question_order):
         """Обновить вопрос"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "UPDATE questions SET text = ?, question_order = ? WHERE question_id = ?",
-            (text, question_order, question_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "UPDATE questions SET text = ?, question_order = ? WHERE question_id = ?",
+                (text, question_order, question_id)
+            )
+            self._bump_content_revision(cursor, question_id=question_id)
+            conn.commit()
         return True
     
     def delete_question(self, question_id):
         """Удалить вопрос"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM questions WHERE question_id = ?", (question_id,))
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            self._bump_content_revision(cursor, question_id=question_id)
+            cursor.execute("DELETE FROM questions WHERE question_id = ?", (question_id,))
+            conn.commit()
         return True
     
     def get_options_for_question(self, question_id):
         """Получить варианты ответов для вопроса"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM options WHERE question_id = ? ORDER BY option_id", (question_id,))
-        options = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM options WHERE question_id = ? ORDER BY option_id", (question_id,))
+            options = [dict(row) for row in cursor.fetchall()]
         return options
     
     def create_option(self, question_id, text, is_correct):
         """Создать вариант ответа"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO options (question_id, text, is_correct) VALUES (?, ?, ?)",
-            (question_id, text, is_correct)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO options (question_id, text, is_correct) VALUES (?, ?, ?)",
+                (question_id, text, is_correct)
+            )
+            self._bump_content_revision(cursor, question_id=question_id)
+            conn.commit()
     
     def update_option(self, option_id, text, is_correct):
         """Обновить вариант ответа"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "UPDATE options SET text = ?, is_correct = ? WHERE option_id = ?",
-            (text, is_correct, option_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "UPDATE options SET text = ?, is_correct = ? WHERE option_id = ?",
+                (text, is_correct, option_id)
+            )
+            self._bump_content_revision(cursor, option_id=option_id)
+            conn.commit()
         return True
     
     def delete_option(self, option_id):
         """Удалить вариант ответа"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM options WHERE option_id = ?", (option_id,))
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            self._bump_content_revision(cursor, option_id=option_id)
+            cursor.execute("DELETE FROM options WHERE option_id = ?", (option_id,))
+            conn.commit()
         return True
     
     # === МЕТОДЫ ДЛЯ КАНДИДАТОВ ===
     
     def create_candidate(self, test_id, full_name, position, department, created_by):
         """Создать кандидата"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO candidates (test_id, full_name, position, department, created_by) VALUES (?, ?, ?, ?, ?)",
-            (test_id, full_name, position, department, created_by)
-        )
-        candidate_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO candidates (test_id, full_name, position, department, created_by) VALUES (?, ?, ?, ?, ?)",
+                (test_id, full_name, position, department, created_by)
+            )
+            candidate_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO candidate_stats (candidate_id, test_id) VALUES (?, ?)",
+                (candidate_id, test_id)
+            )
+            self._add_test_candidate_stats(cursor, test_id, candidates=1)
+            conn.commit()
         return candidate_id
     
+    def import_candidates(self, test_id, rows, created_by, codes_per_candidate=0, batch_size=1000):
+        """Массовый импорт кандидатов одной транзакцией
+        
+        rows - итерируемый поток словарей с ключами full_name, position, department.
+        Некорректные записи пропускаются и попадают в errors (номер записи с 1),
+        остальные вставляются пакетами через executemany. При codes_per_candidate > 0
+        каждому импортированному кандидату в той же транзакции выдаются коды.
+        """
+        imported = 0
+        codes_generated = 0
+        errors = []
+        
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            cursor.execute("SELECT 1 FROM tests WHERE test_id = ?", (test_id,))
+            if not cursor.fetchone():
+                conn.rollback()
+                return {'imported': 0, 'codes_generated': 0, 'errors': [(0, 'Тест не найден')]}
+            
+            def flush(batch):
+                # Под блокировкой на запись AUTOINCREMENT выдает идущие подряд ID
+                cursor.execute("SELECT COALESCE(MAX(candidate_id), 0) FROM candidates")
+                first_id = cursor.fetchone()[0] + 1
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'candidates'")
+                seq = cursor.fetchone()
+                if seq:
+                    first_id = max(first_id, seq[0] + 1)
+                cursor.executemany(
+                    "INSERT INTO candidates (test_id, full_name, position, department, created_by) VALUES (?, ?, ?, ?, ?)",
+                    batch
+                )
+                cursor.execute("""
+                    INSERT INTO candidate_stats (candidate_id, test_id, total_codes)
+                    SELECT candidate_id, test_id, ? FROM candidates WHERE candidate_id >= ?
+                """, (codes_per_candidate, first_id))
+                self._add_test_candidate_stats(
+                    cursor, test_id, candidates=len(batch),
+                    with_codes=len(batch) if codes_per_candidate else 0
+                )
+                if not codes_per_candidate:
+                    return 0
+                
+                codes = self._generate_unique_codes(cursor, len(batch) * codes_per_candidate)
+                assignments = [
+                    [first_id + i // codes_per_candidate, code]
+                    for i, code in enumerate(codes)
+                ]
+                cursor.execute("""
+                    INSERT INTO personal_codes (test_id, candidate_id, code, created_by)
+                    SELECT ?, json_extract(value, '$[0]'), json_extract(value, '$[1]'), ?
+                    FROM json_each(?)
+                """, (test_id, created_by, json.dumps(assignments)))
+                self._add_test_stats(cursor, test_id, codes=len(codes))
+                return len(codes)
+            
+            batch = []
+            for row_number, row in enumerate(rows, 1):
+                full_name = (row.get('full_name') or '').strip()
+                position = (row.get('position') or '').strip()
+                department = (row.get('department') or '').strip()
+                
+                if not full_name:
+                    errors.append((row_number, 'Не указано ФИО'))
+                    continue
+                if len(full_name) > 255 or len(position) > 255 or len(department) > 255:
+                    errors.append((row_number, 'Значение длиннее 255 символов'))
+                    continue
+                
+                batch.append((test_id, full_name, position, department, created_by))
+                if len(batch) >= batch_size:
+                    codes_generated += flush(batch)
+                    imported += len(batch)
+                    batch = []
+            
+            if batch:
+                codes_generated += flush(batch)
+                imported += len(batch)
+            
+            conn.commit()
+        
+        return {'imported': imported, 'codes_generated': codes_generated, 'errors': errors}
+    
     def get_candidates_for_test(self, test_id):
         """Получить всех кандидатов для теста"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT c.*
-            FROM candidates c
-            WHERE c.test_id = ?
-            ORDER BY c.created_at DESC
-        """, (test_id,))
-        
-        candidates = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT c.*
+                FROM candidates c
+                WHERE c.test_id = ?
+                ORDER BY c.created_at DESC
+            """, (test_id,))
+            
+            candidates = [dict(row) for row in cursor.fetchall()]
         return candidates
     
     def get_candidate_by_id(self, candidate_id):
         """Получить кандидата по ID"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM candidates WHERE candidate_id = ?", (candidate_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM candidates WHERE candidate_id = ?", (candidate_id,))
+            result = cursor.fetchone()
         return dict(result) if result else None
     
     def update_candidate(self, candidate_id, full_name, position, department):
         """Обновить кандидата"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "UPDATE candidates SET full_name = ?, position = ?, department = ? WHERE candidate_id = ?",
-            (full_name, position, department, candidate_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "UPDATE candidates SET full_name = ?, position = ?, department = ? WHERE candidate_id = ?",
+                (full_name, position, department, candidate_id)
+            )
+            conn.commit()
         return True
     
     def delete_candidate(self, candidate_id):
         """Удалить кандидата"""
-        conn = sqlite3.connect(self.tests_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM candidates WHERE candidate_id = ?", (candidate_id,))
-        conn.commit()
-        conn.close()
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("DELETE FROM candidates WHERE candidate_id = ?", (candidate_id,))
+            cursor.execute("""
+                DELETE FROM candidate_stats WHERE candidate_id = ?
+                RETURNING test_id, total_codes, tests_taken
+            """, (candidate_id,))
+            stats = cursor.fetchone()
+            if stats:
+                test_id, total_codes, tests_taken = stats
+                self._add_test_candidate_stats(
+                    cursor, test_id, candidates=-1, with_codes=-1 if total_codes else 0,
+                    tested=-1 if tests_taken else 0, attempts=-tests_taken
+                )
+            conn.commit()
         return True
     
     # === МЕТОДЫ ДЛЯ КОДОВ ===
     
-    def generate_codes_for_candidate(self, candidate_id, count, created_by):
-        """Сгенерировать коды для конкретного кандидата"""
-        conn = sqlite3.connect(self.tests_db)
+    def _generate_unique_codes(self, cursor, count):
+        """Подобрать count новых кодов, которых еще нет в personal_codes"""
+        codes = set()
+        while len(codes) < count:
+            # Выборка без повторений из пространства кодов, затем вычитаем уже занятые
+            needed = count - len(codes)
+            batch = {
+                CODE_PREFIXES[n // 100000] + f"{n % 100000:05d}"
+                for n in _code_random.sample(range(CODE_SPACE), needed)
+            } - codes
+            
+            cursor.execute("""
+                SELECT value FROM json_each(?)
+                WHERE value IN (SELECT code FROM personal_codes)
+            """, (json.dumps(list(batch)),))
+            batch.difference_update(row[0] for row in cursor.fetchall())
+            
+            codes |= batch
+        # Вставка в порядке ключа дешевле для уникального индекса по code
+        return sorted(codes)
+    
+    def _insert_codes(self, conn, test_id, candidate_id, count, created_by):
+        """Вставить ровно count уникальных кодов одной транзакцией"""
         cursor = conn.cursor()
-        
-        # Получаем информацию о кандидате и тесте
-        cursor.execute("SELECT test_id FROM candidates WHERE candidate_id = ?", (candidate_id,))
-        candidate = cursor.fetchone()
-        if not candidate:
-            conn.close()
-            return []
-        
-        test_id = candidate[0]
-        
-        codes = []
-        for _ in range(count):
-            # Генерируем код формата: ABC12345
-            code = ''.join(random.choices(string.ascii_uppercase, k=3)) + \
-                   ''.join(random.choices(string.digits, k=5))
-            try:
-                cursor.execute(
-                    "INSERT INTO personal_codes (test_id, candidate_id, code, created_by) VALUES (?, ?, ?, ?)",
-                    (test_id, candidate_id, code, created_by)
-                )
-                codes.append(code)
-            except sqlite3.IntegrityError:
-                continue
-        
+        # Блокировка на запись до вставки: между проверкой и INSERT коды не займут
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        codes = self._generate_unique_codes(cursor, count)
+        # Один INSERT ... SELECT по JSON-массиву вместо построчной привязки параметров
+        cursor.execute("""
+            INSERT INTO personal_codes (test_id, candidate_id, code, created_by)
+            SELECT ?, ?, value, ? FROM json_each(?)
+        """, (test_id, candidate_id, created_by, json.dumps(codes)))
+        self._add_test_stats(cursor, test_id, codes=len(codes))
+        if candidate_id is not None:
+            self._add_candidate_stats(cursor, candidate_id, codes=len(codes))
         conn.commit()
-        conn.close()
         return codes
     
+    def generate_codes_for_candidate(self, candidate_id, count, created_by):
+        """Сгенерировать коды для конкретного кандидата"""
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            
+            # Получаем информацию о кандидате и тесте
+            cursor.execute("SELECT test_id FROM candidates WHERE candidate_id = ?", (candidate_id,))
+            candidate = cursor.fetchone()
+            if not candidate:
+                return []
+            
+            return self._insert_codes(conn, candidate[0], candidate_id, count, created_by)
+    
+    def generate_codes_for_test(self, test_id, count, created_by):
+        """Сгенерировать коды для теста (без привязки к кандидату)"""
+        with self._connection(self.tests_db) as conn:
+            return self._insert_codes(conn, test_id, None, count, created_by)
+    
     def get_codes_for_candidate(self, candidate_id):
         """Получить все коды для кандидата"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT pc.* 
-            FROM personal_codes pc
-            WHERE pc.candidate_id = ?
-            ORDER BY pc.created_at DESC
-        """, (candidate_id,))
-        
-        codes = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT pc.* 
+                FROM personal_codes pc
+                WHERE pc.candidate_id = ?
+                ORDER BY pc.created_at DESC
+            """, (candidate_id,))
+            
+            codes = [dict(row) for row in cursor.fetchall()]
         return codes
     
     def get_codes_for_test(self, test_id):
         """Получить все коды для теста с информацией о кандидатах"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT pc.*, c.full_name, c.position, c.department
-            FROM personal_codes pc
-            LEFT JOIN candidates c ON pc.candidate_id = c.candidate_id
-            WHERE pc.test_id = ?
-            ORDER BY c.full_name, pc.created_at DESC
-        """, (test_id,))
-        
-        codes = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT pc.*, c.full_name, c.position, c.department
+                FROM personal_codes pc
+                LEFT JOIN candidates c ON pc.candidate_id = c.candidate_id
+                WHERE pc.test_id = ?
+                ORDER BY c.full_name, pc.created_at DESC
+            """, (test_id,))
+            
+            codes = [dict(row) for row in cursor.fetchall()]
         return codes
     
     # === МЕТОДЫ ДЛЯ СТАТИСТИКИ КАНДИДАТОВ ===
     
     def get_candidate_results(self, candidate_id):
         """Получить результаты кандидата"""
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
-        
-        # Получаем информацию о кандидате
-        cursor_tests.execute("""
-            SELECT c.*, t.title as test_title
-            FROM candidates c
-            JOIN tests t ON c.test_id = t.test_id
-            WHERE c.candidate_id = ?
-        """, (candidate_id,))
-        
-        candidate_info = cursor_tests.fetchone()
-        conn_tests.close()
-        
-        if not candidate_info:
-            return None
-        
-        # Получаем результаты из users.db
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
-        
-        # Получаем коды кандидата
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
-        cursor_tests.execute("SELECT code FROM personal_codes WHERE candidate_id = ?", (candidate_id,))
-        candidate_codes = [row[0] for row in cursor_tests.fetchall()]
-        conn_tests.close()
+        with self._connection(self.tests_db) as conn_tests:
+            cursor_tests = conn_tests.cursor()
+            
+            # Получаем информацию о кандидате
+            cursor_tests.execute("""
+                SELECT c.*, t.title as test_title
+                FROM candidates c
+                JOIN tests t ON c.test_id = t.test_id
+                WHERE c.candidate_id = ?
+            """, (candidate_id,))
+            
+            candidate_info = cursor_tests.fetchone()
+            
+            if not candidate_info:
+                return None
+            
+            # Получаем коды кандидата
+            cursor_tests.execute("SELECT code FROM personal_codes WHERE candidate_id = ?", (candidate_id,))
+            candidate_codes = [row[0] for row in cursor_tests.fetchall()]
         
         if not candidate_codes:
             return {
@@ -653,18 +1232,20 @@ class DatabaseManager:
                 'results': []
             }
         
-        # Получаем результаты по кодам кандидата
-        placeholders = ','.join('?' for _ in candidate_codes)
-        cursor_users.execute(f"""
-            SELECT r.*, u.username, u.first_name
-            FROM results r
-            JOIN telegram_users u ON r.user_id = u.user_id
-            WHERE r.code IN ({placeholders})
-            ORDER BY r.finished_at DESC
-        """, candidate_codes)
-        
-        results = cursor_users.fetchall()
-        conn_users.close()
+        # Получаем результаты по кодам кандидата из users.db
+        with self._connection(self.users_db) as conn_users:
+            cursor_users = conn_users.cursor()
+            
+            placeholders = ','.join('?' for _ in candidate_codes)
+            cursor_users.execute(f"""
+                SELECT r.*, u.username, u.first_name
+                FROM results r
+                JOIN telegram_users u ON r.user_id = u.user_id
+                WHERE r.code IN ({placeholders})
+                ORDER BY r.finished_at DESC
+            """, candidate_codes)
+            
+            results = cursor_users.fetchall()
         
         return {
             'candidate_info': candidate_info,
@@ -673,111 +1254,391 @@ class DatabaseManager:
     
     def get_test_candidates_statistics(self, test_id):
         """Получить статистику по кандидатам теста"""
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
-        
-        # Получаем базовую информацию о кандидатах
-        cursor_tests.execute("""
-            SELECT c.candidate_id, c.full_name, c.position, c.department
-            FROM candidates c
-            WHERE c.test_id = ?
-            ORDER BY c.full_name
-        """, (test_id,))
-        
-        candidates_basic = cursor_tests.fetchall()
-        
-        # Получаем статистику по кодам для каждого кандидата
-        enhanced_stats = []
-        for candidate in candidates_basic:
-            candidate_id = candidate[0]
-            
-            # Получаем количество кодов
-            cursor_tests.execute("""
-                SELECT COUNT(*), SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END)
-                FROM personal_codes 
-                WHERE candidate_id = ?
-            """, (candidate_id,))
-            
-            codes_result = cursor_tests.fetchone()
-            total_codes = codes_result[0] if codes_result else 0
-            used_codes = codes_result[1] if codes_result and codes_result[1] else 0
-            
-            # Получаем результаты тестирования из users.db
-            conn_users = sqlite3.connect(self.users_db)
-            cursor_users = conn_users.cursor()
+        with self._connection(self.tests_db) as conn:
+            self._attach_users_db(conn)
+            cursor = conn.cursor()
             
-            # Получаем коды кандидата
-            cursor_tests.execute("SELECT code FROM personal_codes WHERE candidate_id = ?", (candidate_id,))
-            candidate_codes = [row[0] for row in cursor_tests.fetchall()]
-            
-            best_score = 0
-            tests_taken = 0
+            # Один проход: кандидаты -> их коды -> результаты по этим кодам
+            cursor.execute("""
+                SELECT c.candidate_id, c.full_name, c.position, c.department,
+                       COUNT(DISTINCT pc.code_id) as total_codes,
+                       COUNT(DISTINCT CASE WHEN pc.is_used = 1 THEN pc.code_id END) as used_codes,
+                       MAX(r.score * 100.0 / r.total_questions) as best_score,
+                       COUNT(r.result_id) as tests_taken
+                FROM candidates c
+                LEFT JOIN personal_codes pc ON pc.candidate_id = c.candidate_id
+                LEFT JOIN users.results r ON r.code = pc.code
+                WHERE c.test_id = ?
+                GROUP BY c.candidate_id
+                ORDER BY c.full_name, c.candidate_id
+            """, (test_id,))
             
-            if candidate_codes:
-                placeholders = ','.join('?' for _ in candidate_codes)
-                cursor_users.execute(f"""
-                    SELECT MAX(score * 100.0 / total_questions), COUNT(*)
-                    FROM results 
-                    WHERE code IN ({placeholders})
-                """, candidate_codes)
-                
-                result = cursor_users.fetchone()
-                best_score = result[0] if result and result[0] else 0
-                tests_taken = result[1] if result else 0
-            
-            conn_users.close()
-            
-            enhanced_stats.append({
-                'candidate_id': candidate[0],
-                'full_name': candidate[1],
-                'position': candidate[2],
-                'department': candidate[3],
-                'total_codes': total_codes,
-                'used_codes': used_codes,
-                'best_score': round(best_score, 2),
-                'tests_taken': tests_taken
-            })
-        
-        conn_tests.close()
-        return enhanced_stats
+            rows = cursor.fetchall()
+        
+        return [
+            {
+                'candidate_id': row[0],
+                'full_name': row[1],
+                'position': row[2],
+                'department': row[3],
+                'total_codes': row[4],
+                'used_codes': row[5],
+                'best_score': round(row[6] or 0, 2),
+                'tests_taken': row[7]
+            }
+            for row in rows
+        ]
     
-    # === МЕТОДЫ ДЛЯ БОТА ===
+    # === ПОСТРАНИЧНЫЕ СПИСКИ ===
     
-    def get_test_by_code(self, code):
-        """Получить тест по коду"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def _encode_cursor(self, sort_value, key_value):
+        """Упаковать позицию keyset-пагинации в строку для URL"""
+        raw = json.dumps([sort_value, key_value]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+    
+    def _decode_cursor(self, token):
+        """Распаковать позицию keyset-пагинации"""
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            sort_value, key_value = json.loads(raw)
+        except (ValueError, TypeError):
+            raise ValueError("Некорректный курсор страницы")
+        return sort_value, key_value
+    
+    def _fetch_page(self, cursor, query, params, sort, key, order, limit, after):
+        """Выполнить запрос постранично (keyset): следующая страница начинается после курсора
+        
+        query должен возвращать колонки sort и key. Значения NULL
+        (поля из NULLABLE_SORT_FIELDS) сортируются как ''.
+        """
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        comparison = '>' if order == 'asc' else '<'
+        if sort in NULLABLE_SORT_FIELDS:
+            sort_expr = f"COALESCE(page.{sort}, '')"
+        else:
+            sort_expr = f"page.{sort}"
+        
+        page_query = f"SELECT * FROM ({query}) AS page"
+        page_params = list(params)
+        if after:
+            sort_value, key_value = self._decode_cursor(after)
+            page_query += f" WHERE ({sort_expr}, page.{key}) {comparison} (?, ?)"
+            page_params += [sort_value, key_value]
+        page_query += f" ORDER BY {sort_expr} {direction}, page.{key} {direction} LIMIT ?"
+        page_params.append(limit + 1)
+        
+        cursor.execute(page_query, page_params)
+        items = [dict(row) for row in cursor.fetchall()]
+        
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            sort_value = last[sort] if last[sort] is not None else ''
+            next_cursor = self._encode_cursor(sort_value, last[key])
+        
+        return {'items': items, 'next_cursor': next_cursor}
+    
+    def get_codes_page(self, test_id=None, candidate_id=None, limit=100, after=None,
+                       sort='created_at', order='desc', status=None, search=None):
+        """Получить страницу кодов теста или кандидата с сортировкой и фильтрами"""
+        if sort not in CODES_SORT_FIELDS:
+            raise ValueError(f"Недопустимое поле сортировки: {sort}")
+        if status in ('used', 'free') and sort == 'is_used':
+            # При фильтре по статусу сортировка по нему ничего не меняет
+            sort = 'created_at'
+        
+        conditions = []
+        params = []
+        if test_id is not None:
+            conditions.append("pc.test_id = ?")
+            params.append(test_id)
+        if candidate_id is not None:
+            conditions.append("pc.candidate_id = ?")
+            params.append(candidate_id)
+        if status == 'used':
+            conditions.append("pc.is_used = 1")
+        elif status == 'free':
+            conditions.append("pc.is_used = 0")
+        if search:
+            # Поиск по началу кода - диапазон, который идет по индексу (LIKE индекс не использует)
+            prefix = search.strip().upper()
+            conditions.append("pc.code >= ? AND pc.code < ?")
+            params += [prefix, prefix + '\U0010ffff']
+        
+        query = """
+            SELECT pc.*, c.full_name, c.position, c.department
+            FROM personal_codes pc
+            LEFT JOIN candidates c ON pc.candidate_id = c.candidate_id
+        """
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            # Внутри статуса коды упорядочены по code: так страницу отдает индекс (test_id, is_used, code)
+            key = 'code' if sort == 'is_used' else 'code_id'
+            return self._fetch_page(conn.cursor(), query, params, sort, key, order, limit, after)
+    
+    def get_code_counts(self, test_id=None, candidate_id=None):
+        """Получить количество всех, использованных и свободных кодов"""
+        conditions = []
+        params = []
+        if test_id is not None:
+            conditions.append("test_id = ?")
+            params.append(test_id)
+        if candidate_id is not None:
+            conditions.append("candidate_id = ?")
+            params.append(candidate_id)
+        
+        query = "SELECT COUNT(*), SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) FROM personal_codes"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            total, used = cursor.fetchone()
+        
+        used = used or 0
+        return {'total': total, 'used': used, 'free': total - used}
+    
+    def get_candidates_page(self, user_id=None, test_id=None, limit=50, after=None,
+                            sort='created_at', order='desc', search=None):
+        """Получить страницу кандидатов со статистикой, сортировкой и фильтрами
+        
+        Счетчики берутся из candidate_stats, поэтому страница читает только
+        свои строки по индексу поля сортировки, а не агрегирует всех кандидатов.
+        """
+        if sort not in CANDIDATES_SORT_FIELDS:
+            raise ValueError(f"Недопустимое поле сортировки: {sort}")
+        
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            scan_in_order = False
+            if user_id and test_id is None:
+                scan_in_order = self._owner_scan_in_order(cursor, user_id)
+            query, params = self._candidates_filter_query(user_id, test_id, search, sort, scan_in_order)
+            page = self._fetch_page(cursor, query, params, sort, 'candidate_id', order, limit, after)
+        
+        for candidate in page['items']:
+            candidate['best_score'] = round(candidate['best_score'], 2)
+        return page
+    
+    def get_candidates_summary(self, user_id=None, test_id=None, search=None):
+        """Получить сводку по отфильтрованным кандидатам (для карточек статистики)
+        
+        Без поиска сводка складывается из счетчиков тестов в test_stats; поиск
+        по подстроке индексом не ускорить, тогда суммируются строки candidate_stats.
+        """
+        with self._connection(self.tests_db) as conn:
+            cursor = conn.cursor()
+            if search:
+                query, params = self._candidates_filter_query(user_id, test_id, search)
+                cursor.execute(f"""
+                    SELECT COUNT(*),
+                           SUM(CASE WHEN tests_taken > 0 THEN 1 ELSE 0 END),
+                           SUM(CASE WHEN total_codes > 0 THEN 1 ELSE 0 END),
+                           SUM(tests_taken)
+                    FROM ({query})
+                """, params)
+            else:
+                conditions = []
+                params = []
+                if user_id:
+                    conditions.append("created_by = ?")
+                    params.append(user_id)
+                if test_id is not None:
+                    conditions.append("test_id = ?")
+                    params.append(test_id)
+                query = """
+                    SELECT COALESCE(SUM(total_candidates), 0), SUM(tested_candidates),
+                           SUM(candidates_with_codes), SUM(total_attempts)
+                    FROM test_stats
+                """
+                if conditions:
+                    query += " WHERE " + " AND ".join(conditions)
+                cursor.execute(query, params)
+            row = cursor.fetchone()
         
+        return {
+            'total_candidates': row[0],
+            'tested_candidates': row[1] or 0,
+            'candidates_with_codes': row[2] or 0,
+            'total_attempts': row[3] or 0
+        }
+    
+    def _owner_scan_in_order(self, cursor, user_id):
+        """Выбрать план страницы кандидатов автора по счетчикам test_stats
+        
+        Страницу можно получить, идя по индексу поля сортировки и пропуская чужих
+        кандидатов, или выбрать кандидатов тестов автора и отсортировать их все.
+        Без статистики ANALYZE планировщик всегда выбирает второе, даже если у автора
+        большинство кандидатов. Пропуск чужой строки примерно вдвое дешевле сортировки
+        своей, поэтому идти по индексу выгоднее, когда у автора больше трети кандидатов.
+        """
         cursor.execute("""
-            SELECT t.test_id, t.title, t.description, pc.code, c.full_name, c.candidate_id
+            SELECT COALESCE(SUM(CASE WHEN created_by = ? THEN total_candidates END), 0),
+                   COALESCE(SUM(total_candidates), 0)
+            FROM test_stats
+        """, (user_id,))
+        own, total = cursor.fetchone()
+        return own * 3 > total
+    
+    def _candidates_filter_query(self, user_id=None, test_id=None, search=None, sort=None,
+                                 scan_in_order=False):
+        """Запрос кандидатов со статистикой и условиями фильтрации
+        
+        Ключ и фильтр по тесту берутся из той же таблицы, что и поле сортировки
+        (candidates или candidate_stats), чтобы страницу отдавал индекс этого поля.
+        При scan_in_order фильтр по автору не используется для поиска по индексу
+        (унарный +), и страница читается в порядке сортировки.
+        """
+        key = 's' if sort in CANDIDATE_STATS_SORT_FIELDS else 'c'
+        tables = CANDIDATES_BY_TEST_TABLES if sort == 'test_title' else CANDIDATES_TABLES
+        
+        conditions = []
+        params = []
+        if user_id:
+            plus = '+' if scan_in_order else ''
+            conditions.append(f"{plus}{key}.test_id IN (SELECT test_id FROM tests WHERE created_by = ?)")
+            params.append(user_id)
+        if test_id is not None:
+            conditions.append(f"{key}.test_id = ?")
+            params.append(test_id)
+        if search:
+            conditions.append("(c.full_name LIKE ? OR c.position LIKE ? OR c.department LIKE ?)")
+            params += [f"%{search.strip()}%"] * 3
+        
+        query = CANDIDATES_WITH_STATS_QUERY.format(key=key, tables=tables)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return query, params
+    
+    # === ПОТОКОВАЯ ВЫГРУЗКА ===
+    
+    def _iter_query(self, db_path, query, params=(), chunk_size=1000, attach_users=False):
+        """Построчно отдавать результат запроса, читая курсор порциями
+        
+        Соединение берется из пула на все время итерации, но не закрепляется
+        за потоком: генератор может быть приостановлен между порциями.
+        """
+        conn = self._acquire(db_path)
+        cursor = None
+        try:
+            if attach_users:
+                self._attach_users_db(conn)
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            # Незавершенный курсор (выгрузку прервали) не дал бы отключить users.db
+            if cursor is not None:
+                cursor.close()
+            if conn.in_transaction:
+                conn.rollback()
+            if self._detach_users_db(conn):
+                self._release(db_path, conn)
+    
+    def iter_codes(self, test_id=None, candidate_id=None, chunk_size=1000):
+        """Выгрузка кодов теста или кандидата: (код, использован, создан, ФИО, должность, отдел, тест)"""
+        conditions = []
+        params = []
+        if test_id is not None:
+            conditions.append("pc.test_id = ?")
+            params.append(test_id)
+        if candidate_id is not None:
+            conditions.append("pc.candidate_id = ?")
+            params.append(candidate_id)
+        
+        query = """
+            SELECT pc.code, pc.is_used, pc.created_at,
+                   c.full_name, c.position, c.department, t.title
             FROM personal_codes pc
-            JOIN tests t ON pc.test_id = t.test_id
             LEFT JOIN candidates c ON pc.candidate_id = c.candidate_id
-            WHERE pc.code = ? AND pc.is_used = 0 AND t.is_active = 1
-        """, (code,))
+            LEFT JOIN tests t ON pc.test_id = t.test_id
+        """
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY pc.code_id"
+        
+        return self._iter_query(self.tests_db, query, params, chunk_size)
+    
+    def iter_candidates_with_stats(self, user_id=None, test_id=None, chunk_size=1000):
+        """Выгрузка кандидатов со статистикой:
+        (ФИО, должность, отдел, тест, всего кодов, использовано, лучший результат, попыток, добавлен)
+        """
+        query, params = self._candidates_filter_query(user_id, test_id)
+        query = f"""
+            SELECT full_name, position, department, test_title,
+                   total_codes, used_codes, ROUND(best_score, 2), tests_taken, created_at
+            FROM ({query})
+            ORDER BY candidate_id
+        """
+        return self._iter_query(self.tests_db, query, params, chunk_size)
+    
+    def iter_results(self, user_id=None, test_id=None, chunk_size=1000):
+        """Выгрузка результатов: (ID, тест, код, ФИО, username, имя, баллы, вопросов, завершен)"""
+        conditions = []
+        params = []
+        if user_id:
+            conditions.append("t.created_by = ?")
+            params.append(user_id)
+        if test_id is not None:
+            conditions.append("r.test_id = ?")
+            params.append(test_id)
+        
+        query = """
+            SELECT r.result_id, t.title, r.code, c.full_name,
+                   u.username, u.first_name, r.score, r.total_questions, r.finished_at
+            FROM users.results r
+            LEFT JOIN tests t ON r.test_id = t.test_id
+            LEFT JOIN personal_codes pc ON pc.code = r.code
+            LEFT JOIN candidates c ON pc.candidate_id = c.candidate_id
+            LEFT JOIN users.telegram_users u ON r.user_id = u.user_id
+        """
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY r.result_id"
         
-        result = cursor.fetchone()
-        conn.close()
+        return self._iter_query(self.tests_db, query, params, chunk_size, attach_users=True)
+    
+    # === МЕТОДЫ ДЛЯ БОТА ===
+    
+    def get_test_by_code(self, code):
+        """Получить тест по коду"""
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT t.test_id, t.title, t.description, pc.code, c.full_name, c.candidate_id
+                FROM personal_codes pc
+                JOIN tests t ON pc.test_id = t.test_id
+                LEFT JOIN candidates c ON pc.candidate_id = c.candidate_id
+                WHERE pc.code = ? AND pc.is_used = 0 AND t.is_active = 1
+            """, (code,))
+            
+            result = cursor.fetchone()
         return dict(result) if result else None
     
     def get_questions_with_options(self, test_id):
         """Получить вопросы с вариантами ответов"""
-        conn = sqlite3.connect(self.tests_db)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT q.question_id, q.text, q.question_order,
-                   o.option_id, o.text as option_text, o.is_correct
-            FROM questions q
-            LEFT JOIN options o ON q.question_id = o.question_id
-            WHERE q.test_id = ?
-            ORDER BY q.question_order, o.option_id
-        """, (test_id,))
-        
-        rows = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT q.question_id, q.text, q.question_order,
+                       o.option_id, o.text as option_text, o.is_correct
+                FROM questions q
+                LEFT JOIN options o ON q.question_id = o.question_id
+                WHERE q.test_id = ?
+                ORDER BY q.question_order, o.option_id
+            """, (test_id,))
+            
+            rows = [dict(row) for row in cursor.fetchall()]
         
         # Группируем варианты по вопросам
         questions = {}
@@ -803,254 +1664,595 @@ class DatabaseManager:
     
     def get_or_create_telegram_user(self, user_id, username, first_name):
         """Получить или создать телеграм пользователя"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT * FROM telegram_users WHERE user_id = ?", (user_id,)
-        )
-        user = cursor.fetchone()
-        
-        if not user:
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
             cursor.execute(
-                "INSERT INTO telegram_users (user_id, username, first_name) VALUES (?, ?, ?)",
-                (user_id, username, first_name)
+                "SELECT * FROM telegram_users WHERE user_id = ?", (user_id,)
             )
-            conn.commit()
-        
-        conn.close()
+            user = cursor.fetchone()
+            
+            if not user:
+                cursor.execute(
+                    "INSERT INTO telegram_users (user_id, username, first_name) VALUES (?, ?, ?)",
+                    (user_id, username, first_name)
+                )
+                self._add_global_stats(cursor, users=1)
+                conn.commit()
         return True
     
     def accept_consent(self, user_id):
         """Принять соглашение"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE telegram_users 
-            SET consent_accepted = 1, consent_accepted_at = ?
-            WHERE user_id = ?
-        """, (datetime.now(), user_id))
-        
-        conn.commit()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE telegram_users 
+                SET consent_accepted = 1, consent_accepted_at = ?
+                WHERE user_id = ?
+            """, (datetime.now(), user_id))
+            
+            conn.commit()
     
     def has_accepted_consent(self, user_id):
         """Проверить, принял ли пользователь соглашение"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT consent_accepted FROM telegram_users WHERE user_id = ?", (user_id,)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        with self._connection(self.users_db) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "SELECT consent_accepted FROM telegram_users WHERE user_id = ?", (user_id,)
+            )
+            result = cursor.fetchone()
         
         return result and result[0] == 1
     
-    def mark_code_used(self, code, user_id, test_id, candidate_id=None):
-        """Пометить код как использованный и начать сессию"""
-        # Помечаем код как использованный в tests.db
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
-        cursor_tests.execute(
-            "UPDATE personal_codes SET is_used = 1 WHERE code = ?", 
-            (code,)
-        )
-        conn_tests.commit()
-        conn_tests.close()
-        
-        # Создаем сессию в users.db
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
-        
-        cursor_users.execute("""
-            INSERT INTO testing_sessions (user_id, test_id, code, started_at)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, test_id, code, datetime.now()))
-        
-        session_id = cursor_users.lastrowid
-        conn_users.commit()
-        conn_users.close()
-        
-        return session_id
-    
-    def save_answer(self, session_id, question_id, answer_index):
-        """Сохранить ответ пользователя"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT answers FROM testing_sessions WHERE session_id = ?", 
-            (session_id,)
-        )
-        result = cursor.fetchone()
-        
-        answers = {}
-        if result and result[0]:
-            answers = json.loads(result[0])
-        
-        answers[str(question_id)] = answer_index
-        
-        cursor.execute("""
-            UPDATE testing_sessions 
-            SET answers = ?, last_activity = ?, current_question = ?
-            WHERE session_id = ?
-        """, (json.dumps(answers), datetime.now(), question_id, session_id))
-        
-        conn.commit()
-        conn.close()
-    
-    def save_result(self, session_id, score, total_questions):
-        """Сохранить результат теста"""
-        conn = sqlite3.connect(self.users_db)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT user_id, test_id, code FROM testing_sessions 
-            WHERE session_id = ?
-        """, (session_id,))
-        session = cursor.fetchone()
-        
-        if session:
-            user_id, test_id, code = session
+    def redeem_code(self, code, user_id, test_id=None):
+        """Погасить код и начать сессию одной транзакцией
+        
+        users.db подключается к соединению tests.db, и под блокировкой на запись
+        условный UPDATE ... WHERE is_used = 0 решает, кто получил код: при
+        одновременной отправке одного кода сессию начнет только один пользователь.
+        Возвращает session_id, test_id, title, content_revision или None.
+        """
+        with self._connection(self.tests_db, sqlite3.Row) as conn:
+            self._attach_users_db(conn)
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
             
             cursor.execute("""
-                INSERT INTO results (user_id, test_id, code, score, total_questions)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, test_id, code, score, total_questions))
+                UPDATE personal_codes SET is_used = 1
+                WHERE code = ? AND is_used = 0
+                  AND test_id IN (SELECT test_id FROM tests WHERE is_active = 1)
+                  AND (? IS NULL OR test_id = ?)
+                RETURNING test_id, candidate_id
+            """, (code, test_id, test_id))
+            redeemed = cursor.fetchone()
+            if not redeemed:
+                conn.rollback()
+                return None
+            
+            test_id = redeemed['test_id']
+            self._add_test_stats(cursor, test_id, used=1)
+            if redeemed['candidate_id'] is not None:
+                self._add_candidate_stats(cursor, redeemed['candidate_id'], used=1)
+            
+            cursor.execute("""
+                INSERT INTO users.testing_sessions (user_id, test_id, code, content_revision, started_at)
+                VALUES (?, ?, ?, (SELECT content_revision FROM tests WHERE test_id = ?), ?)
+            """, (user_id, test_id, code, test_id, datetime.now()))
+            session_id = cursor.lastrowid
             
             cursor.execute(
-                "DELETE FROM testing_sessions WHERE session_id = ?", 
-                (session_id,)
+                "SELECT title, content_revision FROM tests WHERE test_id = ?", (test_id,)
             )
+            test = cursor.fetchone()
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        return {
+            'session_id': session_id,
+            'test_id': test_id,
+            'title': test['title'],
+            'content_revision': test['content_revision']
+        }
     
-    # === МЕТОДЫ ДЛЯ СТАТИСТИКИ ===
+    def mark_code_used(self, code, user_id, test_id, candidate_id=None):
+        """Пометить код как использованный и начать сессию (см. redeem_code)"""
+        redemption = self.redeem_code(code, user_id, test_id)
+        return redemption['session_id'] if redemption else None
     
-    def get_statistics(self, user_id=None):
-        """Получить статистику для админки"""
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
+    def save_answer(self, session_id, question_id, answer_index, question_index=0):
+        """Сохранить ответ пользователя (добавить строку в журнал ответов)"""
+        with self._connection(self.users_db) as conn:
+            conn.execute("""
+                INSERT INTO session_answers (session_id, question_id, question_index, answer_index, answered_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (session_id, question_id, question_index, answer_index, datetime.now()))
+    
+    def get_active_session(self, user_id):
+        """Получить последнюю незавершенную сессию пользователя"""
+        with self._connection(self.users_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT session_id, test_id, code, current_question, content_revision, answers
+                FROM testing_sessions
+                WHERE user_id = ?
+                ORDER BY session_id DESC
+                LIMIT 1
+            """, (user_id,))
+            
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            session = dict(row)
+            # Ответы из JSON - сессии, начатые до появления журнала ответов
+            answers = json.loads(session['answers']) if session['answers'] else {}
+            next_question = session['current_question'] or 0
+            
+            cursor.execute("""
+                SELECT question_id, question_index, answer_index FROM session_answers
+                WHERE session_id = ?
+                ORDER BY answer_id
+            """, (session['session_id'],))
+            for answer in cursor.fetchall():
+                answers[str(answer['question_id'])] = answer['answer_index']
+                next_question = max(next_question, answer['question_index'] + 1)
+        
+        session['answers'] = answers
+        session['current_question'] = next_question
+        return session
+    
+    def save_result(self, session_id, score, total_questions, answers=None):
+        """Сохранить результат теста
+        
+        answers - тройки (question_id, option_id, is_correct) выбранных вариантов,
+        сохраняются в result_answers и в накопительную статистику заданий.
+        Счетчики кандидата (candidate_stats в tests.db) меняются в той же
+        транзакции, поэтому users.db подключается к соединению tests.db.
+        Возвращает result_id.
+        """
+        result_id = None
+        with self._connection(self.tests_db) as conn:
+            self._attach_users_db(conn)
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT user_id, test_id, code FROM users.testing_sessions 
+                WHERE session_id = ?
+            """, (session_id,))
+            session = cursor.fetchone()
+            
+            if session:
+                user_id, test_id, code = session
+                score_pct = score * 100.0 / total_questions if total_questions else 0
+                
+                cursor.execute("""
+                    INSERT INTO users.results (user_id, test_id, code, score, total_questions)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (user_id, test_id, code, score, total_questions))
+                result_id = cursor.lastrowid
+                self._add_global_stats(
+                    cursor, results=1, scored=1 if total_questions else 0, score_pct=score_pct
+                )
+                
+                cursor.execute("SELECT candidate_id FROM personal_codes WHERE code = ?", (code,))
+                candidate = cursor.fetchone()
+                if candidate and candidate[0] is not None:
+                    self._add_candidate_stats(cursor, candidate[0], taken=1, score_pct=score_pct)
+                
+                if answers:
+                    # Время ответа берем из журнала ответов сессии
+                    cursor.execute("""
+                        INSERT OR REPLACE INTO users.result_answers (result_id, question_id, option_id, answered_at)
+                        SELECT ?, json_extract(a.value, '$[0]'), json_extract(a.value, '$[1]'),
+                               COALESCE((
+                                   SELECT MAX(sa.answered_at) FROM users.session_answers sa
+                                   WHERE sa.session_id = ?
+                                     AND sa.question_id = json_extract(a.value, '$[0]')
+                               ), ?)
+                        FROM json_each(?) a
+                    """, (result_id, session_id, datetime.now(), json.dumps(list(answers))))
+                    self._update_item_statistics(cursor, test_id, score / total_questions, answers)
+                
+                cursor.execute(
+                    "DELETE FROM users.testing_sessions WHERE session_id = ?", 
+                    (session_id,)
+                )
+                cursor.execute(
+                    "DELETE FROM users.session_answers WHERE session_id = ?", 
+                    (session_id,)
+                )
+            
+            conn.commit()
         
-        cursor_users.execute("SELECT COUNT(*) FROM telegram_users")
-        total_users = cursor_users.fetchone()[0]
+        return result_id
+    
+    def _update_item_statistics(self, cursor, test_id, score_ratio, answers):
+        """Добавить ответы одного результата в накопительную статистику заданий"""
+        answers_json = json.dumps([[q_id, o_id, int(bool(ok))] for q_id, o_id, ok in answers])
         
-        cursor_users.execute("SELECT COUNT(*) FROM results")
-        total_tests_taken = cursor_users.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO item_stats
+                (question_id, test_id, responses, correct, score_sum, score_sq_sum, correct_score_sum)
+            SELECT json_extract(value, '$[0]'), ?, 1, json_extract(value, '$[2]'),
+                   ?, ?, ? * json_extract(value, '$[2]')
+            FROM json_each(?) WHERE 1
+            ON CONFLICT (question_id) DO UPDATE SET
+                responses = responses + 1,
+                correct = correct + excluded.correct,
+                score_sum = score_sum + excluded.score_sum,
+                score_sq_sum = score_sq_sum + excluded.score_sq_sum,
+                correct_score_sum = correct_score_sum + excluded.correct_score_sum
+        """, (test_id, score_ratio, score_ratio * score_ratio, score_ratio, answers_json))
         
-        cursor_users.execute("SELECT AVG(score * 100.0 / total_questions) FROM results")
-        avg_score = cursor_users.fetchone()[0] or 0
+        cursor.execute("""
+            INSERT INTO option_stats (option_id, question_id, test_id, chosen)
+            SELECT json_extract(value, '$[1]'), json_extract(value, '$[0]'), ?, 1
+            FROM json_each(?) WHERE 1
+            ON CONFLICT (option_id) DO UPDATE SET chosen = chosen + 1
+        """, (test_id, answers_json))
+    
+    # === АНАЛИЗ ЗАДАНИЙ ===
+    
+    def get_item_statistics(self, test_id):
+        """Получить статистику заданий теста из накопительных сумм
+        
+        Для вопроса: решаемость (процент правильных ответов) и точечно-бисериальная
+        корреляция правильности ответа с долей набранных баллов (дискриминация).
+        Для варианта ответа: сколько раз и в каком проценте ответов он выбран.
+        """
+        with self._connection(self.users_db, sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT * FROM item_stats WHERE test_id = ?", (test_id,))
+            item_rows = cursor.fetchall()
+            
+            cursor.execute("SELECT option_id, question_id, chosen FROM option_stats WHERE test_id = ?", (test_id,))
+            option_rows = cursor.fetchall()
         
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
+        questions = {}
+        for row in item_rows:
+            n, n_correct = row['responses'], row['correct']
+            discrimination = None
+            mean = row['score_sum'] / n
+            variance = row['score_sq_sum'] / n - mean * mean
+            if 0 < n_correct < n and variance > 1e-12:
+                p = n_correct / n
+                mean_correct = row['correct_score_sum'] / n_correct
+                mean_wrong = (row['score_sum'] - row['correct_score_sum']) / (n - n_correct)
+                discrimination = round((mean_correct - mean_wrong) / variance ** 0.5 * (p * (1 - p)) ** 0.5, 3)
+            
+            questions[row['question_id']] = {
+                'responses': n,
+                'difficulty': round(n_correct * 100.0 / n, 1),
+                'discrimination': discrimination
+            }
         
-        if user_id:
-            cursor_tests.execute("""
-                SELECT t.test_id, t.title, 
-                       COUNT(pc.code) as total_codes,
-                       SUM(CASE WHEN pc.is_used = 1 THEN 1 ELSE 0 END) as used_codes
-                FROM tests t
-                LEFT JOIN personal_codes pc ON t.test_id = pc.test_id
-                WHERE t.created_by = ?
-                GROUP BY t.test_id, t.title
-            """, (user_id,))
-        else:
-            cursor_tests.execute("""
-                SELECT t.test_id, t.title, 
-                       COUNT(pc.code) as total_codes,
-                       SUM(CASE WHEN pc.is_used = 1 THEN 1 ELSE 0 END) as used_codes
-                FROM tests t
-                LEFT JOIN personal_codes pc ON t.test_id = pc.test_id
-                GROUP BY t.test_id, t.title
-            """)
+        options = {}
+        for row in option_rows:
+            responses = questions.get(row['question_id'], {}).get('responses')
+            options[row['option_id']] = {
+                'chosen': row['chosen'],
+                'share': round(row['chosen'] * 100.0 / responses, 1) if responses else 0
+            }
         
-        tests_stats = cursor_tests.fetchall()
+        return {'questions': questions, 'options': options}
+    
+    def rebuild_item_statistics(self, test_id=None):
+        """Пересчитать статистику заданий с нуля по result_answers (для теста или всех)"""
+        stats_filter = ""
+        results_filter = ""
+        params = ()
+        if test_id is not None:
+            stats_filter = "WHERE test_id = ?"
+            results_filter = "AND r.test_id = ?"
+            params = (test_id,)
+        
+        with self._connection(self.tests_db) as conn:
+            self._attach_users_db(conn)
+            cursor = conn.cursor()
+            
+            cursor.execute(f"DELETE FROM users.item_stats {stats_filter}", params)
+            cursor.execute(f"DELETE FROM users.option_stats {stats_filter}", params)
+            
+            # Правильность ответа берется из текущих options.is_correct
+            cursor.execute(f"""
+                INSERT INTO users.item_stats
+                    (question_id, test_id, responses, correct, score_sum, score_sq_sum, correct_score_sum)
+                SELECT question_id, MAX(test_id), COUNT(*), SUM(correct),
+                       SUM(ratio), SUM(ratio * ratio), SUM(ratio * correct)
+                FROM (
+                    SELECT ra.question_id, r.test_id,
+                           COALESCE(o.is_correct, 0) AS correct,
+                           r.score * 1.0 / r.total_questions AS ratio
+                    FROM users.result_answers ra
+                    JOIN users.results r ON r.result_id = ra.result_id
+                    LEFT JOIN options o ON o.option_id = ra.option_id
+                    WHERE r.total_questions > 0 {results_filter}
+                )
+                GROUP BY question_id
+            """, params)
+            
+            cursor.execute(f"""
+                INSERT INTO users.option_stats (option_id, question_id, test_id, chosen)
+                SELECT ra.option_id, MAX(ra.question_id), MAX(r.test_id), COUNT(*)
+                FROM users.result_answers ra
+                JOIN users.results r ON r.result_id = ra.result_id
+                WHERE ra.option_id IS NOT NULL AND r.total_questions > 0 {results_filter}
+                GROUP BY ra.option_id
+            """, params)
+            
+            cursor.execute(f"SELECT COUNT(*) FROM users.item_stats {stats_filter}", params)
+            return cursor.fetchone()[0]
+    
+    # === МЕТОДЫ ДЛЯ СТАТИСТИКИ ===
+    
+    def _add_test_stats(self, cursor, test_id, codes=0, used=0):
+        """Изменить счетчики кодов теста и его автора в текущей транзакции"""
+        cursor.execute("""
+            UPDATE test_stats
+            SET total_codes = total_codes + ?, used_codes = used_codes + ?
+            WHERE test_id = ?
+            RETURNING created_by, total_codes
+        """, (codes, used, test_id))
+        stats = cursor.fetchone()
+        if not codes or not stats or stats[0] is None:
+            return
+        
+        # Тест становится активным, когда у него появляется первый код
+        became_active = (1 if stats[1] > 0 else 0) - (1 if stats[1] - codes > 0 else 0)
+        cursor.execute("""
+            UPDATE admin_stats
+            SET total_codes = total_codes + ?, active_tests = active_tests + ?
+            WHERE user_id = ?
+        """, (codes, became_active, stats[0]))
+    
+    def _add_candidate_stats(self, cursor, candidate_id, codes=0, used=0, taken=0, score_pct=0):
+        """Изменить счетчики кандидата и сводку кандидатов его теста в текущей транзакции
         
-        conn_users.close()
-        conn_tests.close()
+        taken - новые попытки, score_pct - результат попытки в процентах (лучший сохраняется).
+        """
+        cursor.execute("""
+            UPDATE candidate_stats
+            SET total_codes = total_codes + ?, used_codes = used_codes + ?,
+                tests_taken = tests_taken + ?, best_score = MAX(best_score, ?)
+            WHERE candidate_id = ?
+            RETURNING test_id, total_codes, tests_taken
+        """, (codes, used, taken, score_pct, candidate_id))
+        stats = cursor.fetchone()
+        if not stats:
+            return
+        
+        # Кандидат попадает в "с кодами" и "прошедшие" с первым кодом и первой попыткой
+        test_id, total_codes, tests_taken = stats
+        self._add_test_candidate_stats(
+            cursor, test_id,
+            with_codes=1 if codes and total_codes == codes else 0,
+            tested=1 if taken and tests_taken == taken else 0,
+            attempts=taken
+        )
+    
+    def _add_test_candidate_stats(self, cursor, test_id, candidates=0, with_codes=0, tested=0, attempts=0):
+        """Изменить сводку кандидатов теста в текущей транзакции"""
+        cursor.execute("""
+            UPDATE test_stats
+            SET total_candidates = total_candidates + ?,
+                candidates_with_codes = candidates_with_codes + ?,
+                tested_candidates = tested_candidates + ?,
+                total_attempts = total_attempts + ?
+            WHERE test_id = ?
+        """, (candidates, with_codes, tested, attempts, test_id))
+    
+    def _add_global_stats(self, cursor, users=0, results=0, scored=0, score_pct=0):
+        """Изменить общие счетчики в текущей транзакции
         
+        scored - результаты с вопросами (total_questions > 0): только они входят в средний балл.
+        """
+        cursor.execute("""
+            UPDATE global_stats
+            SET total_users = total_users + ?,
+                total_results = total_results + ?,
+                scored_results = scored_results + ?,
+                score_pct_sum = score_pct_sum + ?
+            WHERE id = 1
+        """, (users, results, scored, score_pct))
+    
+    def _get_global_stats(self):
+        """Общие счетчики из сводной таблицы"""
+        with self._connection(self.users_db) as conn:
+            row = conn.execute(
+                "SELECT total_users, total_results, scored_results, score_pct_sum FROM global_stats WHERE id = 1"
+            ).fetchone()
+        
+        total_users, total_results, scored_results, score_pct_sum = row or (0, 0, 0, 0)
         return {
             'total_users': total_users,
-            'total_tests_taken': total_tests_taken,
-            'avg_score': round(avg_score, 2),
-            'tests_stats': tests_stats
+            'total_tests_taken': total_results,
+            'avg_score': round(score_pct_sum / scored_results, 2) if scored_results else 0
         }
     
-    def get_admin_statistics(self, admin_user_id):
-        """Получить статистику для администратора"""
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
-        
-        cursor_users.execute("SELECT COUNT(*) FROM telegram_users")
-        total_users = cursor_users.fetchone()[0]
-        
-        cursor_users.execute("SELECT COUNT(*) FROM results")
-        total_tests_taken = cursor_users.fetchone()[0]
-        
-        cursor_users.execute("SELECT AVG(score * 100.0 / total_questions) FROM results")
-        avg_score = cursor_users.fetchone()[0] or 0
-        
-        conn_users.close()
-        
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
-        
-        cursor_tests.execute("""
-            SELECT t.test_id, t.title, 
-                   COUNT(pc.code) as total_codes,
-                   SUM(CASE WHEN pc.is_used = 1 THEN 1 ELSE 0 END) as used_codes
-            FROM tests t
-            LEFT JOIN personal_codes pc ON t.test_id = pc.test_id
-            WHERE t.created_by = ?
-            GROUP BY t.test_id, t.title
-        """, (admin_user_id,))
-        
-        tests_stats = cursor_tests.fetchall()
+    def get_statistics(self, user_id=None):
+        """Получить статистику для админки (из сводных таблиц)"""
+        stats = self._get_global_stats()
         
-        total_tests = len(tests_stats)
-        active_tests = 0
-        total_codes = 0
+        with self._connection(self.tests_db) as conn_tests:
+            cursor_tests = conn_tests.cursor()
+            
+            query = """
+                SELECT t.test_id, t.title,
+                       COALESCE(s.total_codes, 0) as total_codes,
+                       COALESCE(s.used_codes, 0) as used_codes
+                FROM tests t
+                LEFT JOIN test_stats s ON s.test_id = t.test_id
+            """
+            if user_id:
+                cursor_tests.execute(query + " WHERE t.created_by = ?", (user_id,))
+            else:
+                cursor_tests.execute(query)
+            
+            stats['tests_stats'] = cursor_tests.fetchall()
         
-        for test in tests_stats:
-            total_codes += test[2]
-            if test[2] > 0:
-                active_tests += 1
+        return stats
+    
+    def get_admin_statistics(self, admin_user_id):
+        """Получить статистику для администратора (из сводных таблиц)"""
+        stats = self._get_global_stats()
         
-        conn_tests.close()
+        with self._connection(self.tests_db) as conn_tests:
+            row = conn_tests.execute("""
+                SELECT total_tests, active_tests, total_codes FROM admin_stats
+                WHERE user_id = ?
+            """, (admin_user_id,)).fetchone()
         
-        return {
-            'total_users': total_users,
-            'total_tests_taken': total_tests_taken,
-            'avg_score': round(avg_score, 2),
+        total_tests, active_tests, total_codes = row or (0, 0, 0)
+        stats.update({
             'total_tests': total_tests,
             'active_tests': active_tests,
             'total_codes': total_codes
-        }
+        })
+        return stats
+    
+    def _read_statistics_rollups(self, cursor):
+        """Содержимое сводных таблиц (соединение tests.db с подключенной users.db)"""
+        rollups = {}
+        cursor.execute("""
+            SELECT test_id, created_by, total_codes, used_codes, total_candidates,
+                   candidates_with_codes, tested_candidates, total_attempts
+            FROM test_stats
+        """)
+        for row in cursor.fetchall():
+            rollups[('test_stats', row[0])] = tuple(row[1:])
+        cursor.execute("""
+            SELECT candidate_id, test_id, total_codes, used_codes, tests_taken, round(best_score, 6)
+            FROM candidate_stats
+        """)
+        for row in cursor.fetchall():
+            rollups[('candidate_stats', row[0])] = tuple(row[1:])
+        cursor.execute("SELECT user_id, total_tests, active_tests, total_codes FROM admin_stats")
+        for row in cursor.fetchall():
+            rollups[('admin_stats', row[0])] = tuple(row[1:])
+        cursor.execute("SELECT id, total_users, total_results, scored_results, round(score_pct_sum, 6) FROM users.global_stats")
+        for row in cursor.fetchall():
+            rollups[('global_stats', row[0])] = tuple(row[1:])
+        return rollups
+    
+    def rebuild_statistics_rollups(self):
+        """Проверить сводные таблицы статистики и пересобрать их с нуля
+        
+        Возвращает список расхождений (таблица, ключ, было, стало) между
+        сохраненными счетчиками и пересчитанными по исходным данным.
+        """
+        with self._connection(self.tests_db) as conn:
+            self._attach_users_db(conn)
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            before = self._read_statistics_rollups(cursor)
+            
+            cursor.execute("DELETE FROM test_stats")
+            cursor.execute("DELETE FROM admin_stats")
+            cursor.execute("DELETE FROM candidate_stats")
+            cursor.execute("DELETE FROM users.global_stats")
+            
+            cursor.execute("""
+                WITH code_stats AS (
+                    SELECT candidate_id,
+                           COUNT(*) as total_codes,
+                           SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END) as used_codes
+                    FROM personal_codes
+                    WHERE candidate_id IS NOT NULL
+                    GROUP BY candidate_id
+                ),
+                result_stats AS (
+                    SELECT pc.candidate_id,
+                           MAX(r.score * 100.0 / r.total_questions) as best_score,
+                           COUNT(*) as tests_taken
+                    FROM users.results r
+                    JOIN personal_codes pc ON pc.code = r.code
+                    WHERE pc.candidate_id IS NOT NULL
+                    GROUP BY pc.candidate_id
+                )
+                INSERT INTO candidate_stats (candidate_id, test_id, total_codes, used_codes, tests_taken, best_score)
+                SELECT c.candidate_id, c.test_id,
+                       COALESCE(cs.total_codes, 0), COALESCE(cs.used_codes, 0),
+                       COALESCE(rs.tests_taken, 0), COALESCE(rs.best_score, 0)
+                FROM candidates c
+                LEFT JOIN code_stats cs ON cs.candidate_id = c.candidate_id
+                LEFT JOIN result_stats rs ON rs.candidate_id = c.candidate_id
+            """)
+            cursor.execute("""
+                INSERT INTO test_stats (test_id, created_by, total_codes, used_codes)
+                SELECT t.test_id, t.created_by, COUNT(pc.code_id),
+                       COALESCE(SUM(CASE WHEN pc.is_used = 1 THEN 1 ELSE 0 END), 0)
+                FROM tests t
+                LEFT JOIN personal_codes pc ON pc.test_id = t.test_id
+                GROUP BY t.test_id
+            """)
+            cursor.execute("""
+                UPDATE test_stats
+                SET (total_candidates, candidates_with_codes, tested_candidates, total_attempts) = (
+                    SELECT COUNT(*),
+                           COALESCE(SUM(CASE WHEN s.total_codes > 0 THEN 1 ELSE 0 END), 0),
+                           COALESCE(SUM(CASE WHEN s.tests_taken > 0 THEN 1 ELSE 0 END), 0),
+                           COALESCE(SUM(s.tests_taken), 0)
+                    FROM candidate_stats s
+                    WHERE s.test_id = test_stats.test_id
+                )
+            """)
+            cursor.execute("""
+                INSERT INTO admin_stats (user_id, total_tests, active_tests, total_codes)
+                SELECT created_by, COUNT(*), SUM(CASE WHEN total_codes > 0 THEN 1 ELSE 0 END), SUM(total_codes)
+                FROM test_stats
+                WHERE created_by IS NOT NULL
+                GROUP BY created_by
+            """)
+            cursor.execute("""
+                INSERT INTO users.global_stats (id, total_users, total_results, scored_results, score_pct_sum)
+                SELECT 1, (SELECT COUNT(*) FROM users.telegram_users), COUNT(*),
+                       COALESCE(SUM(CASE WHEN total_questions > 0 THEN 1 ELSE 0 END), 0),
+                       COALESCE(SUM(CASE WHEN total_questions > 0 THEN score * 100.0 / total_questions END), 0)
+                FROM users.results
+            """)
+            
+            after = self._read_statistics_rollups(cursor)
+        
+        return [
+            (key[0], key[1], before.get(key), after.get(key))
+            for key in sorted(before.keys() | after.keys(), key=str)
+            if before.get(key) != after.get(key)
+        ]
     
     # === МЕТОДЫ ДЛЯ ОЧИСТКИ ===
     
     def clear_user_data(self):
         """Очистить все пользовательские данные"""
-        conn_users = sqlite3.connect(self.users_db)
-        cursor_users = conn_users.cursor()
-        
-        cursor_users.execute("DELETE FROM results")
-        cursor_users.execute("DELETE FROM testing_sessions")
-        cursor_users.execute("DELETE FROM telegram_users")
-        
-        cursor_users.execute("DELETE FROM sqlite_sequence WHERE name IN ('results', 'testing_sessions', 'telegram_users')")
-        
-        conn_users.commit()
-        conn_users.close()
-        
-        conn_tests = sqlite3.connect(self.tests_db)
-        cursor_tests = conn_tests.cursor()
+        with self._connection(self.users_db) as conn_users:
+            cursor_users = conn_users.cursor()
+            
+            cursor_users.execute("DELETE FROM results")
+            cursor_users.execute("DELETE FROM testing_sessions")
+            cursor_users.execute("DELETE FROM session_answers")
+            cursor_users.execute("DELETE FROM result_answers")
+            cursor_users.execute("DELETE FROM item_stats")
+            cursor_users.execute("DELETE FROM option_stats")
+            cursor_users.execute("UPDATE global_stats SET total_users = 0, total_results = 0, scored_results = 0, score_pct_sum = 0")
+            cursor_users.execute("DELETE FROM telegram_users")
+            
+            cursor_users.execute("DELETE FROM sqlite_sequence WHERE name IN ('results', 'testing_sessions', 'telegram_users')")
+            
+            conn_users.commit()
         
-        cursor_tests.execute("UPDATE personal_codes SET is_used = 0")
-        conn_tests.commit()
-        conn_tests.close()
+        with self._connection(self.tests_db) as conn_tests:
+            cursor_tests = conn_tests.cursor()
+            
+            cursor_tests.execute("UPDATE personal_codes SET is_used = 0")
+            cursor_tests.execute("UPDATE test_stats SET used_codes = 0, tested_candidates = 0, total_attempts = 0")
+            cursor_tests.execute("UPDATE candidate_stats SET used_codes = 0, tests_taken = 0, best_score = 0")
+            cursor_tests.execute("""
+                INSERT INTO code_resets (id, generation) VALUES (1, 1)
+                ON CONFLICT(id) DO UPDATE SET generation = generation + 1
+            """)
+            conn_tests.commit()
         
-        return True
\ No newline at end of file
+        return True
@@ -0,0 +1,52 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_module(name, path):
+    """Загрузить модуль по пути: bot/database.py и shared/database.py называются одинаково"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+shared_database = load_module('shared_database', 'shared/database.py')
+bot_database = load_module('bot_database', 'bot/database.py')
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Пустой каталог data/ для каждого теста (DatabaseManager работает относительно cwd)"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / "data"
+
+@pytest.fixture
+def shared_db(data_dir):
+    db = shared_database.DatabaseManager()
+    yield db
+    db.close_all()
+
+@pytest.fixture
+def bot_db(data_dir):
+    db = bot_database.DatabaseManager()
+    yield db
+    db.close_all()
+
+def create_test_with_questions(db, n_questions=3, n_options=3, created_by=None):
+    """Активный тест с вопросами; правильный вариант - второй
+    
+    created_by передается только админской копии (в схеме бота автора теста нет).
+    """
+    creator = () if created_by is None else (created_by,)
+    test_id = db.create_test("Тест", "Описание", *creator)
+    for order in range(n_questions):
+        question_id = db.create_question(test_id, f"Вопрос {order}", order)
+        for idx in range(n_options):
+            db.create_option(question_id, f"Вариант {idx}", idx == 1)
+    db.update_test(test_id, "Тест", "Описание", 1)
+    return test_id
@@ -0,0 +1,19 @@
+import inspect
+import re
+
+from conftest import bot_database
+
+WRITE_SQL = re.compile(r'\b(INSERT|UPDATE|DELETE|REPLACE)\b|\.commit\(\)|self\.(redeem_code|save_result)\(')
+
+def test_writing_methods_are_marked_for_the_writer_thread():
+    """Метод с записью в БД без @writes молча ушел бы в пул чтения"""
+    manager = bot_database.DatabaseManager
+    wrapper = bot_database.AsyncDatabaseManager
+    unmarked = [
+        name for name, method in vars(manager).items()
+        if inspect.isfunction(method) and not name.startswith('_')
+        and name not in vars(wrapper)
+        and WRITE_SQL.search(inspect.getsource(method))
+        and not getattr(method, 'writes', False)
+    ]
+    assert unmarked == []
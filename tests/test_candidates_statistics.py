@@ -0,0 +1,220 @@
+"""Сверка get_test_candidates_statistics с прежней реализацией (запросы по каждому кандидату)
+и счетчиков candidate_stats, по которым строятся страницы кандидатов"""
+import sqlite3
+
+import pytest
+
+from conftest import bot_database, create_test_with_questions, shared_database
+
+def legacy_test_candidates_statistics(tests_db, users_db, test_id):
+    """Прежняя реализация: два запроса к tests.db и соединение с users.db на кандидата"""
+    conn_tests = sqlite3.connect(tests_db)
+    cursor_tests = conn_tests.cursor()
+    
+    cursor_tests.execute("""
+        SELECT c.candidate_id, c.full_name, c.position, c.department
+        FROM candidates c
+        WHERE c.test_id = ?
+        ORDER BY c.full_name
+    """, (test_id,))
+    
+    candidates_basic = cursor_tests.fetchall()
+    
+    enhanced_stats = []
+    for candidate in candidates_basic:
+        candidate_id = candidate[0]
+        
+        cursor_tests.execute("""
+            SELECT COUNT(*), SUM(CASE WHEN is_used = 1 THEN 1 ELSE 0 END)
+            FROM personal_codes 
+            WHERE candidate_id = ?
+        """, (candidate_id,))
+        
+        codes_result = cursor_tests.fetchone()
+        total_codes = codes_result[0] if codes_result else 0
+        used_codes = codes_result[1] if codes_result and codes_result[1] else 0
+        
+        conn_users = sqlite3.connect(users_db)
+        cursor_users = conn_users.cursor()
+        
+        cursor_tests.execute("SELECT code FROM personal_codes WHERE candidate_id = ?", (candidate_id,))
+        candidate_codes = [row[0] for row in cursor_tests.fetchall()]
+        
+        best_score = 0
+        tests_taken = 0
+        
+        if candidate_codes:
+            placeholders = ','.join('?' for _ in candidate_codes)
+            cursor_users.execute(f"""
+                SELECT MAX(score * 100.0 / total_questions), COUNT(*)
+                FROM results 
+                WHERE code IN ({placeholders})
+            """, candidate_codes)
+            
+            result = cursor_users.fetchone()
+            best_score = result[0] if result and result[0] else 0
+            tests_taken = result[1] if result else 0
+        
+        conn_users.close()
+        
+        enhanced_stats.append({
+            'candidate_id': candidate[0],
+            'full_name': candidate[1],
+            'position': candidate[2],
+            'department': candidate[3],
+            'total_codes': total_codes,
+            'used_codes': used_codes,
+            'best_score': round(best_score, 2),
+            'tests_taken': tests_taken
+        })
+    
+    conn_tests.close()
+    return enhanced_stats
+
+def add_result(db, code, score, total_questions, user_id=500):
+    with db._connection(db.users_db) as conn:
+        conn.execute(
+            "INSERT INTO results (user_id, test_id, code, score, total_questions) VALUES (?, ?, ?, ?, ?)",
+            (user_id, 0, code, score, total_questions)
+        )
+
+def test_matches_legacy_output(shared_db):
+    test_id = create_test_with_questions(shared_db, created_by=1)
+    other_test_id = create_test_with_questions(shared_db, created_by=1)
+    
+    def candidate(name, test=test_id):
+        return shared_db.create_candidate(test, name, "Инженер", "ИТ", 1)
+    
+    # Без кодов
+    candidate("Алексеев")
+    # Коды без результатов, один погашен
+    no_results = shared_db.generate_codes_for_candidate(candidate("Борисов"), 3, 1)
+    shared_db.mark_code_used(no_results[0], 501, test_id)
+    # Повторные результаты по одному коду и по разным кодам
+    repeated = shared_db.generate_codes_for_candidate(candidate("Васильев"), 2, 1)
+    for code in repeated:
+        shared_db.mark_code_used(code, 502, test_id)
+    add_result(shared_db, repeated[0], 1, 3)
+    add_result(shared_db, repeated[0], 3, 3)
+    add_result(shared_db, repeated[1], 2, 4)
+    # Только результаты с нулем вопросов
+    empty = shared_db.generate_codes_for_candidate(candidate("Григорьев"), 1, 1)
+    add_result(shared_db, empty[0], 0, 0)
+    # Результаты с нулем вопросов вперемешку с обычными
+    mixed = shared_db.generate_codes_for_candidate(candidate("Дмитриев"), 2, 1)
+    add_result(shared_db, mixed[0], 0, 0)
+    add_result(shared_db, mixed[1], 1, 2)
+    # Однофамильцы и кандидат другого теста
+    candidate("Борисов")
+    shared_db.generate_codes_for_candidate(candidate("Егоров", other_test_id), 2, 1)
+    
+    expected = legacy_test_candidates_statistics(shared_db.tests_db, shared_db.users_db, test_id)
+    actual = shared_db.get_test_candidates_statistics(test_id)
+    
+    # Порядок однофамильцев в прежнем запросе не определен
+    key = lambda row: (row['full_name'], row['candidate_id'])
+    assert sorted(actual, key=key) == sorted(expected, key=key)
+    assert [row['full_name'] for row in actual] == [row['full_name'] for row in expected]
+    assert len(actual) == 6
+
+def assert_rollups_match(db, *test_ids):
+    """Счетчики страницы и сводки совпадают с подсчетом по исходным таблицам"""
+    assert db.rebuild_statistics_rollups() == []
+    for test_id in test_ids:
+        expected = {row['candidate_id']: row for row in db.get_test_candidates_statistics(test_id)}
+        page = db.get_candidates_page(test_id=test_id, limit=1000)['items']
+        assert {row['candidate_id'] for row in page} == set(expected)
+        for row in page:
+            for field in ('total_codes', 'used_codes', 'best_score', 'tests_taken'):
+                assert row[field] == expected[row['candidate_id']][field], field
+        
+        summary = db.get_candidates_summary(test_id=test_id)
+        assert summary == db.get_candidates_summary(test_id=test_id, search='%')
+        assert summary == {
+            'total_candidates': len(expected),
+            'tested_candidates': sum(1 for row in expected.values() if row['tests_taken']),
+            'candidates_with_codes': sum(1 for row in expected.values() if row['total_codes']),
+            'total_attempts': sum(row['tests_taken'] for row in expected.values())
+        }
+
+def test_candidate_rollups_follow_changes(shared_db, data_dir):
+    """candidate_stats и сводка в test_stats меняются в тех же транзакциях, что и данные"""
+    bot_db = bot_database.DatabaseManager()
+    try:
+        test_id = create_test_with_questions(shared_db, created_by=1)
+        other_test_id = create_test_with_questions(shared_db, created_by=2)
+        first = shared_db.create_candidate(test_id, "Алексеев", "Инженер", "ИТ", 1)
+        shared_db.import_candidates(test_id, [{'full_name': "Борисов"}, {'full_name': "Васильев"}], 1,
+                                    codes_per_candidate=2)
+        shared_db.create_candidate(other_test_id, "Егоров", None, None, 2)
+        assert_rollups_match(shared_db, test_id, other_test_id)
+        
+        codes = shared_db.generate_codes_for_candidate(first, 3, 1)
+        shared_db.save_result(shared_db.redeem_code(codes[0], 501)['session_id'], 1, 3)
+        shared_db.save_result(shared_db.redeem_code(codes[1], 501)['session_id'], 0, 0)
+        # Бот гасит коды и сохраняет результаты в те же счетчики
+        bot_db.save_result(bot_db.redeem_code(codes[2], 502)['session_id'], 3, 3)
+        imported = [row['code'] for row in shared_db.get_codes_for_test(test_id) if row['full_name'] == "Борисов"]
+        bot_db.save_result(bot_db.redeem_code(imported[0], 503)['session_id'], 2, 4)
+        assert_rollups_match(shared_db, test_id, other_test_id)
+        
+        shared_db.delete_candidate(first)
+        assert_rollups_match(shared_db, test_id, other_test_id)
+        
+        shared_db.clear_user_data()
+        assert_rollups_match(shared_db, test_id, other_test_id)
+    finally:
+        bot_db.close_all()
+
+def test_candidate_stats_filled_for_existing_database(data_dir):
+    """В БД без candidate_stats и сводки кандидатов в test_stats они заполняются при запуске"""
+    db = shared_database.DatabaseManager()
+    test_id = create_test_with_questions(db, created_by=1)
+    db.import_candidates(test_id, [{'full_name': f"Кандидат {n}"} for n in range(3)], 1, codes_per_candidate=1)
+    code = db.get_codes_for_test(test_id)[0]['code']
+    db.save_result(db.redeem_code(code, 501)['session_id'], 2, 3)
+    db.close_all()
+    
+    conn = sqlite3.connect(data_dir / "tests.db")
+    conn.execute("DROP TABLE candidate_stats")
+    for column in ('total_candidates', 'candidates_with_codes', 'tested_candidates', 'total_attempts'):
+        conn.execute(f"ALTER TABLE test_stats DROP COLUMN {column}")
+    conn.commit()
+    conn.close()
+    
+    db = shared_database.DatabaseManager()
+    try:
+        assert db.get_candidates_summary()['tested_candidates'] == 1
+        assert_rollups_match(db, test_id)
+    finally:
+        db.close_all()
+
+@pytest.mark.parametrize('sort', shared_database.CANDIDATES_SORT_FIELDS)
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_candidates_pages_follow_sort_order(shared_db, sort, order):
+    """Постраничный обход дает всех кандидатов в порядке сортировки, без пропусков и повторов"""
+    test_ids = [create_test_with_questions(shared_db, created_by=owner) for owner in (1, 1, 2)]
+    for n, test_id in enumerate(test_ids):
+        for i in range(4):
+            candidate_id = shared_db.create_candidate(
+                test_id, f"Кандидат {i % 2}", "Инженер" if i % 3 else None, f"Отдел {n}", 1
+            )
+            codes = shared_db.generate_codes_for_candidate(candidate_id, i % 3, 1)
+            for user_id, code in enumerate(codes[:i % 2 + 1], start=100 * n + 10 * i):
+                shared_db.save_result(shared_db.redeem_code(code, user_id)['session_id'], i, 3)
+    
+    for filters in ({}, {'test_id': test_ids[1]}, {'user_id': 1}, {'user_id': 2}):
+        everything = shared_db.get_candidates_page(limit=1000, **filters)['items']
+        value = lambda row: row[sort] if row[sort] is not None else ''
+        expected = sorted(everything, key=lambda row: (value(row), row['candidate_id']),
+                          reverse=order == 'desc')
+        
+        walked = []
+        after = None
+        while True:
+            page = shared_db.get_candidates_page(limit=2, after=after, sort=sort, order=order, **filters)
+            walked += page['items']
+            after = page['next_cursor']
+            if not after:
+                break
+        assert [row['candidate_id'] for row in walked] == [row['candidate_id'] for row in expected]
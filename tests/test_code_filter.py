@@ -0,0 +1,31 @@
+import asyncio
+import os
+import sys
+
+from conftest import ROOT, create_test_with_questions, load_module
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+bot_app = load_module('bot_app', 'bot/bot.py')
+
+def test_codes_reset_in_admin_are_accepted_without_waiting_for_rebuild(shared_db):
+    """После "очистить данные" погашенный код снова проходит фильтр при первом же промахе"""
+    test_id = create_test_with_questions(shared_db, created_by=1)
+    code = shared_db.generate_codes_for_test(test_id, 1, 1)[0]
+    
+    bot = bot_app.TestBot('123:TEST')
+    bot.code_filter = bot_app.CodeFilter(refresh_interval=0)
+    
+    async def scenario():
+        await bot.rebuild_code_filter()
+        assert await bot.db.redeem_code(code, 42)
+        bot.code_filter.discard(code)
+        assert not await bot.code_may_exist(code)
+        
+        shared_db.clear_user_data()
+        assert await bot.code_may_exist(code)
+        assert await bot.db.redeem_code(code, 42)
+    
+    try:
+        asyncio.run(scenario())
+    finally:
+        bot.db.shutdown()
@@ -0,0 +1,66 @@
+"""Одновременная работа бота (записи) и админки (чтения) с общими файлами БД"""
+import threading
+
+from conftest import bot_database, create_test_with_questions
+
+BOT_USERS = 8
+TESTS_PER_USER = 15
+ADMIN_READERS = 4
+
+def test_bot_writes_and_admin_reads_without_lock_errors(shared_db, data_dir):
+    # Схему создает админка, как при обычном развертывании
+    test_id = create_test_with_questions(shared_db, n_questions=5, created_by=1)
+    codes = shared_db.generate_codes_for_test(test_id, BOT_USERS * TESTS_PER_USER, 1)
+    content = shared_db.get_questions_with_options(test_id)
+    
+    bot_db = bot_database.DatabaseManager()
+    errors = []
+    finished = threading.Event()
+    completed = []
+    
+    def bot_user(user_id, user_codes):
+        try:
+            bot_db.get_or_create_user(user_id, f"user{user_id}", "Имя")
+            for code in user_codes:
+                redeemed = bot_db.redeem_code(code, user_id)
+                assert redeemed, code
+                for index, question in enumerate(content):
+                    bot_db.save_answer(redeemed['session_id'], question['question_id'], 1, index)
+                bot_db.save_result(redeemed['session_id'], len(content), len(content))
+                completed.append(code)
+        except Exception as e:
+            errors.append(e)
+    
+    def admin_reader():
+        try:
+            while not finished.is_set():
+                shared_db.get_admin_statistics(1)
+                shared_db.get_statistics(1)
+                shared_db.get_test_candidates_statistics(test_id)
+                shared_db.get_codes_page(test_id=test_id)
+                shared_db.get_item_statistics(test_id)
+        except Exception as e:
+            errors.append(e)
+    
+    writers = [
+        threading.Thread(target=bot_user, args=(
+            1000 + n, codes[n * TESTS_PER_USER:(n + 1) * TESTS_PER_USER]
+        ))
+        for n in range(BOT_USERS)
+    ]
+    readers = [threading.Thread(target=admin_reader) for _ in range(ADMIN_READERS)]
+    try:
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+    finally:
+        finished.set()
+        for thread in readers:
+            thread.join()
+        bot_db.close_all()
+    
+    assert not errors, errors
+    assert len(completed) == BOT_USERS * TESTS_PER_USER
+    stats = shared_db.get_admin_statistics(1)
+    assert stats['total_tests_taken'] == BOT_USERS * TESTS_PER_USER
@@ -0,0 +1,42 @@
+"""Пул соединений: соединения возвращаются в пул без подключенной users.db"""
+import sqlite3
+
+from conftest import create_test_with_questions
+
+def test_attached_connection_is_detached_before_release(shared_db, data_dir):
+    test_id = create_test_with_questions(shared_db, created_by=1)
+    # Запрос с ATTACH users.db на соединении из пула
+    shared_db.get_test_candidates_statistics(test_id)
+    
+    with shared_db._connection(shared_db.tests_db) as conn:
+        schemas = {row[1] for row in conn.execute("PRAGMA database_list")}
+        assert 'users' not in schemas
+        
+        # Транзакция на tests.db (как генерация кодов) не блокирует запись в users.db
+        conn.execute("BEGIN IMMEDIATE")
+        users = sqlite3.connect(data_dir / "users.db", timeout=0)
+        try:
+            users.execute("INSERT INTO telegram_users (user_id, username) VALUES (1, 'user')")
+            users.commit()
+        finally:
+            users.close()
+        conn.rollback()
+
+def attached_schemas(db):
+    with db._connection(db.tests_db) as conn:
+        return [row[1] for row in conn.execute("PRAGMA database_list")]
+
+def test_export_releases_connection_without_users_db(shared_db):
+    test_id = create_test_with_questions(shared_db, created_by=1)
+    for user_id, code in enumerate(shared_db.generate_codes_for_test(test_id, 3, 1), start=1):
+        shared_db.save_result(shared_db.redeem_code(code, user_id)['session_id'], 1, 2)
+    
+    # Выгрузка результатов (с ATTACH users.db) целиком
+    assert len(list(shared_db.iter_results())) == 3
+    assert attached_schemas(shared_db) == ['main']
+    
+    # Выгрузка, прерванная на первой строке (клиент закрыл соединение)
+    rows = shared_db.iter_results(chunk_size=1)
+    next(rows)
+    rows.close()
+    assert attached_schemas(shared_db) == ['main']
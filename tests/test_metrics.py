@@ -0,0 +1,25 @@
+import os
+import sys
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+from metrics import BotMetrics
+
+def test_api_calls_per_test_skips_restored_sessions():
+    """Тест, восстановленный после перезапуска, не занижает среднее число вызовов"""
+    metrics = BotMetrics()
+    metrics.incr('tests_completed', 2)
+    metrics.incr('test_api_calls', 2 * 12)
+    metrics.incr('tests_completed')
+    metrics.incr('tests_completed_restored')
+    
+    snapshot = metrics.snapshot()
+    assert snapshot['tests_completed'] == 3
+    assert snapshot['api_calls_per_test'] == 12
+
+def test_api_calls_per_test_absent_when_all_sessions_restored():
+    metrics = BotMetrics()
+    metrics.incr('tests_completed')
+    metrics.incr('tests_completed_restored')
+    assert 'api_calls_per_test' not in metrics.snapshot()
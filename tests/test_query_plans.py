@@ -0,0 +1,86 @@
+"""EXPLAIN QUERY PLAN для горячих запросов: ни один не должен сканировать таблицу целиком"""
+import re
+import sqlite3
+
+import pytest
+
+from conftest import create_test_with_questions, shared_database
+
+HOT_TABLES = ('personal_codes', 'candidates', 'questions', 'options', 'results')
+FULL_SCAN = re.compile(r'\bSCAN (?:\w+\.)?(%s)\b' % '|'.join(HOT_TABLES))
+
+def trace_statements(db):
+    """Собирать SQL всех соединений пула (с подставленными параметрами)"""
+    statements = []
+    open_connection = db._open_connection
+    
+    def traced_open(db_path):
+        conn = open_connection(db_path)
+        conn.set_trace_callback(statements.append)
+        return conn
+    
+    db._open_connection = traced_open
+    for pool in db._pools.values():
+        pooled = []
+        while not pool.empty():
+            pooled.append(pool.get_nowait())
+        for conn in pooled:
+            conn.set_trace_callback(statements.append)
+            pool.put_nowait(conn)
+    return statements
+
+def query_plan(db, sql):
+    conn = sqlite3.connect(db.tests_db)
+    try:
+        conn.execute("ATTACH DATABASE ? AS users", (db.users_db,))
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    finally:
+        conn.close()
+
+@pytest.fixture
+def seeded(shared_db):
+    test_id = create_test_with_questions(shared_db, created_by=1)
+    candidate_id = shared_db.create_candidate(test_id, "Иванов Иван", "Инженер", "ИТ", 1)
+    codes = shared_db.generate_codes_for_candidate(candidate_id, 3, 1)
+    session_id = shared_db.mark_code_used(codes[0], 100, test_id, candidate_id)
+    shared_db.save_result(session_id, 2, 3)
+    return {'test_id': test_id, 'candidate_id': candidate_id, 'code': codes[1]}
+
+HOT_QUERIES = {
+    'get_test_by_code': lambda s: (s['code'],),
+    'get_codes_for_candidate': lambda s: (s['candidate_id'],),
+    'get_candidates_for_test': lambda s: (s['test_id'],),
+    'get_questions_with_options': lambda s: (s['test_id'],),
+    'get_candidate_results': lambda s: (s['candidate_id'],),
+}
+
+@pytest.mark.parametrize('method', sorted(HOT_QUERIES))
+def test_hot_query_uses_indexes(shared_db, seeded, method):
+    statements = trace_statements(shared_db)
+    getattr(shared_db, method)(*HOT_QUERIES[method](seeded))
+    
+    selects = [sql for sql in statements if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+    assert selects, f"{method} не выполнил ни одного запроса"
+    for sql in selects:
+        plan = query_plan(shared_db, sql)
+        scans = [step for step in plan if FULL_SCAN.search(step)]
+        assert not scans, f"{method}: полный просмотр {scans}\n{sql}\n{plan}"
+
+@pytest.mark.parametrize('sort', shared_database.CANDIDATES_SORT_FIELDS)
+@pytest.mark.parametrize('filters', [{}, {'test_id': 1}, {'user_id': 1}], ids=['all', 'test', 'owner'])
+def test_candidates_page_reads_in_sort_order(shared_db, seeded, sort, filters):
+    """Страница кандидатов идет по индексу поля сортировки, а не сортирует всех кандидатов
+    
+    По названию теста допустима сортировка кандидатов внутри одного теста (RIGHT PART).
+    """
+    statements = trace_statements(shared_db)
+    page = shared_db.get_candidates_page(sort=sort, limit=1, **filters)
+    shared_db.get_candidates_page(sort=sort, limit=1, after=page['next_cursor'] or 'WyIiLDBd', **filters)
+    
+    selects = [sql for sql in statements if 'candidate_stats s' in sql]
+    assert len(selects) == 2
+    for sql in selects:
+        plan = query_plan(shared_db, sql)
+        sorts = [step for step in plan if 'TEMP B-TREE FOR ORDER BY' in step]
+        scans = [step for step in plan if step.startswith('SCAN') and 'USING' not in step]
+        assert not sorts and not scans, f"{sort}: {plan}\n{sql}"
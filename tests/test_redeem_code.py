@@ -0,0 +1,64 @@
+"""Погашение кодов под конкуренцией: каждый код начинает ровно одну сессию"""
+import random
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import bot_database, shared_database, create_test_with_questions
+
+CODES = 100
+ATTEMPTS = 1000
+MANAGERS = 4
+
+def generate_codes(module, db, test_id):
+    if module is shared_database:
+        return db.generate_codes_for_test(test_id, CODES, 1)
+    return db.generate_codes(test_id, CODES)
+
+@pytest.mark.parametrize('module', [bot_database, shared_database], ids=['bot', 'shared'])
+def test_concurrent_redemptions_start_one_session_per_code(module, data_dir):
+    setup = module.DatabaseManager()
+    created_by = 1 if module is shared_database else None
+    test_id = create_test_with_questions(setup, created_by=created_by)
+    codes = generate_codes(module, setup, test_id)
+    setup.close_all()
+    
+    # Несколько менеджеров со своими пулами - как несколько процессов бота
+    managers = [module.DatabaseManager(storage_config={'checkpoint_interval': 0}) for _ in range(MANAGERS)]
+    attempts = [codes[n % CODES] for n in range(ATTEMPTS)]
+    random.Random(21).shuffle(attempts)
+    winners = []
+    lock = threading.Lock()
+    
+    def redeem(n):
+        redeemed = managers[n % MANAGERS].redeem_code(attempts[n], 10000 + n)
+        if redeemed:
+            with lock:
+                winners.append((attempts[n], redeemed['session_id']))
+    
+    try:
+        with ThreadPoolExecutor(max_workers=64) as executor:
+            list(executor.map(redeem, range(ATTEMPTS)))
+    finally:
+        for db in managers:
+            db.close_all()
+    
+    assert len(winners) == CODES
+    assert {code for code, _ in winners} == set(codes)
+    
+    users = sqlite3.connect(data_dir / "users.db")
+    tests = sqlite3.connect(data_dir / "tests.db")
+    try:
+        assert users.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT code) FROM testing_sessions"
+        ).fetchone() == (CODES, CODES)
+        assert tests.execute("SELECT COUNT(*) FROM personal_codes WHERE is_used = 1").fetchone()[0] == CODES
+        if module is shared_database:
+            # Строку test_stats заводит create_test админки
+            used = tests.execute("SELECT used_codes FROM test_stats WHERE test_id = ?", (test_id,)).fetchone()
+            assert used == (CODES,)
+    finally:
+        users.close()
+        tests.close()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+from rendering import QuestionView, question_markup
+
+def test_question_markup_serializes_as_plain_keyboard():
+    """Клавиатура уходит в Telegram тем JSON, который строит сам PTB"""
+    view = QuestionView(0, "Вопрос 1 из 1:\n\nТекст", ("Да", "Нет"))
+    markup = question_markup(view, ["a:1", "a:2"])
+    
+    assert markup.to_dict() == {'inline_keyboard': [
+        [{'text': "Да", 'callback_data': "a:1"}],
+        [{'text': "Нет", 'callback_data': "a:2"}],
+    ]}
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from conftest import ROOT, bot_database, create_test_with_questions
+
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+from sessions import SessionContentChanged, SessionStore
+
+@pytest.fixture
+def async_db(bot_db):
+    db = bot_database.AsyncDatabaseManager(bot_db)
+    yield db
+    db._writer.shutdown(wait=True)
+    db._reader.shutdown(wait=True)
+
+def start_sessions(db, users):
+    """Начатые в БД сессии: user_id -> (session_id, TestContent)"""
+    test_id = create_test_with_questions(db)
+    codes = db.generate_codes(test_id, len(users))
+    started = {}
+    for user_id, code in zip(users, codes):
+        redemption = db.redeem_code(code, user_id)
+        started[user_id] = (redemption['session_id'], db.get_test_content(test_id, redemption['content_revision']))
+    return test_id, started
+
+def test_restore_rejects_session_of_changed_test(bot_db, async_db):
+    test_id, started = start_sessions(bot_db, [1, 2])
+    bot_db.save_answer(started[1][0], started[1][1].questions[0].question_id, 1, 0)
+    
+    # Без изменений теста сессия восстанавливается с ответами
+    restored = asyncio.run(SessionStore(async_db).get(1))
+    assert (restored.session_id, restored.index, restored.answers[0]) == (started[1][0], 1, 1)
+    
+    bot_db.create_question(test_id, "Новый вопрос", 0)
+    with pytest.raises(SessionContentChanged):
+        asyncio.run(SessionStore(async_db).get(2))
+
+def test_sessions_are_evicted_by_count_and_idle_time(bot_db, async_db):
+    _, started = start_sessions(bot_db, [1, 2, 3, 4])
+    store = SessionStore(async_db, max_sessions=2, idle_timeout=60)
+    
+    async def scenario():
+        store.start(1, *started[1])
+        store.start(2, *started[2])
+        await store.get(1)
+        store.start(3, *started[3])
+        # Вытеснена давнее всех использованная сессия 2
+        assert set(store._sessions) == {1, 3}
+        
+        # Простаивающая дольше idle_timeout вытесняется и без превышения числа
+        store.max_sessions = 10
+        store._sessions[1].touched -= 120
+        store.start(4, *started[4])
+        assert set(store._sessions) == {3, 4}
+        assert store.evicted == 2
+        
+        # Вытесненная сессия восстанавливается из БД при следующем нажатии
+        session = await store.get(2)
+        assert session.session_id == started[2][0] and session.restored
+    
+    asyncio.run(scenario())
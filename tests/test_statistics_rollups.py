@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+from conftest import create_test_with_questions, shared_database
+
+def save_results(db, results):
+    test_id = create_test_with_questions(db, n_questions=4, created_by=1)
+    codes = db.generate_codes_for_test(test_id, len(results), 1)
+    for user_id, (code, (score, total)) in enumerate(zip(codes, results), start=1):
+        session_id = db.redeem_code(code, user_id)['session_id']
+        db.save_result(session_id, score, total)
+
+@pytest.mark.parametrize('results, avg_score', [
+    ([(0, 0), (2, 4)], 50.0),
+    ([(0, 0)], 0),
+    ([(1, 4), (3, 4), (0, 0), (0, 0)], 50.0),
+])
+def test_avg_score_ignores_results_without_questions(shared_db, results, avg_score):
+    """Результат 0/0 входит в число пройденных тестов, но не в средний балл"""
+    save_results(shared_db, results)
+    
+    stats = shared_db.get_statistics()
+    assert stats['total_tests_taken'] == len(results)
+    assert stats['avg_score'] == avg_score
+    # Пересборка по исходным данным дает те же счетчики
+    assert shared_db.rebuild_statistics_rollups() == []
+
+def test_existing_global_stats_get_scored_results(data_dir):
+    """Старая global_stats без scored_results дополняется при запуске"""
+    db = shared_database.DatabaseManager()
+    save_results(db, [(0, 0), (2, 4)])
+    db.close_all()
+    
+    conn = sqlite3.connect(data_dir / "users.db")
+    conn.execute("ALTER TABLE global_stats DROP COLUMN scored_results")
+    conn.commit()
+    conn.close()
+    
+    db = shared_database.DatabaseManager()
+    try:
+        assert db.get_statistics()['avg_score'] == 50.0
+        assert db.rebuild_statistics_rollups() == []
+    finally:
+        db.close_all()
@@ -0,0 +1,21 @@
+import time
+
+from conftest import bot_database
+
+def test_flush_does_not_wait_for_buffered_batch_timer(bot_db):
+    """accept_consent вызывает flush в потоке-писателе: таймер пакета его бы задерживал"""
+    registrations = bot_database.WriteBehindQueue(
+        bot_db, bot_db.users_db, "INSERT INTO users (user_id) VALUES (?)",
+        flush_interval=1.0, durable=False
+    )
+    try:
+        started = time.monotonic()
+        for user_id in range(1, 6):
+            registrations.put((user_id,))
+            registrations.flush()
+        assert time.monotonic() - started < 1.0
+        
+        with bot_db._connection(bot_db.users_db) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 5
+    finally:
+        registrations.close()